@@ -0,0 +1,265 @@
+"""
+Throughput and latency of requests through the whole stack over loopback: an in-process Registry, a tcp and an
+http service registered with it and a caller service whose TCPServiceClient and HTTPServiceClient reach them
+through the buses, swept over payload sizes and concurrency levels.
+
+Results are printed as json and can be saved to compare later runs against: with --compare every result is
+checked against the baseline result of the same protocol, payload size and concurrency, and the run exits with
+status 1 when requests/sec dropped or p50/p99 latency rose by more than the tolerance.
+
+usage: python -m benchmarks.e2e [--requests N] [--sizes 64,1024,16384] [--concurrency 1,16,64]
+                                [--output results.json] [--compare baseline.json] [--tolerance 0.15]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import sys
+import time
+from functools import partial
+
+from aiohttp.web import Application, Response
+
+from trellio import TCPService, TCPServiceClient, HTTPService, HTTPServiceClient, api, request, post
+from trellio.bus import TCPBus, HTTPBus
+from trellio.protocol_factory import get_trellio_protocol
+from trellio.registry import Registry, Repository
+from trellio.registry_client import RegistryClient
+
+HOST = '127.0.0.1'
+SERVICE = 'bench'
+WARMUP = 100  # requests per protocol before measuring, connections are opened lazily
+READY_TIMEOUT = 10
+
+
+class _EchoTCPService(TCPService):
+    @api
+    def echo(self, data):
+        return data
+
+
+class _EchoHTTPService(HTTPService):
+    @post('/echo')
+    def echo(self, request):
+        body = yield from request.read()
+        return Response(body=body)
+
+
+class _EchoTCPClient(TCPServiceClient):
+    def __init__(self):
+        super(_EchoTCPClient, self).__init__(SERVICE, '1')
+
+    @request
+    def echo(self, data):
+        return locals()
+
+
+class _EchoHTTPClient(HTTPServiceClient):
+    def __init__(self):
+        super(_EchoHTTPClient, self).__init__(SERVICE, '1')
+
+    @post()
+    def echo(self, data):
+        path = '/echo'
+        return locals()
+
+
+def _bound_socket():
+    sock = socket.socket()
+    sock.bind((HOST, 0))
+    return sock
+
+
+def _bus(service, registry_port, loop):
+    # what Host._set_bus does for the service it hosts
+    registry_client = RegistryClient(loop, HOST, registry_port)
+    bus = TCPBus(registry_client)
+    bus.http_bus = HTTPBus(registry_client)
+    registry_client.bus = bus
+    if isinstance(service, TCPService):
+        bus.tcp_host = service
+        bus.build_endpoint_table()
+    else:
+        bus.http_host = service
+    service.tcp_bus = bus
+    service.http_bus = bus.http_bus
+    return bus
+
+
+class Topology:
+    def __init__(self, loop):
+        self._loop = loop
+        self._servers = []
+        self._buses = []
+        self.tcp_client = _EchoTCPClient()
+        self.http_client = _EchoHTTPClient()
+
+    @asyncio.coroutine
+    def _serve_tcp(self, service, registry_port, sock):
+        bus = _bus(service, registry_port, self._loop)
+        self._buses.append(bus)
+        self._servers.append((yield from self._loop.create_server(partial(get_trellio_protocol, bus), sock=sock)))
+        return bus
+
+    @asyncio.coroutine
+    def start(self):
+        registry = Registry(HOST, 0, Repository())
+        registry_server = yield from self._loop.create_server(partial(get_trellio_protocol, registry), HOST, 0)
+        self._servers.append(registry_server)
+        registry_port = registry_server.sockets[0].getsockname()[1]
+
+        sock = _bound_socket()
+        tcp_bus = yield from self._serve_tcp(_EchoTCPService(SERVICE, '1', HOST, sock.getsockname()[1]),
+                                             registry_port, sock)
+        TCPBus._local_buses.clear()  # requests are to go over loopback, not straight to the bus in this process
+
+        sock = _bound_socket()
+        http_service = _EchoHTTPService(SERVICE, '1', HOST, sock.getsockname()[1])
+        app = Application(loop=self._loop)
+        app.router.add_post('/echo', http_service.echo)
+        self._servers.append((yield from self._loop.create_server(app.make_handler(), sock=sock)))
+        http_bus = _bus(http_service, registry_port, self._loop)
+        self._buses.append(http_bus)
+
+        sock = _bound_socket()
+        caller = TCPService('bench_caller', '1', HOST, sock.getsockname()[1])
+        caller.clients = [self.tcp_client, self.http_client]
+        caller_bus = yield from self._serve_tcp(caller, registry_port, sock)
+
+        for bus in (tcp_bus, http_bus, caller_bus):
+            yield from bus.connect()
+        yield from self._ready(caller_bus)
+
+    @asyncio.coroutine
+    def _ready(self, caller_bus):
+        """
+        Waits for the registry to activate the caller and for its client to connect to the tcp service
+        """
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not any(pool['size'] for pool in caller_bus.pool_stats().values()):
+            if time.monotonic() > deadline:
+                raise TimeoutError('the caller was not connected to the services in time')
+            yield from asyncio.sleep(0.05)
+
+    @asyncio.coroutine
+    def call(self, protocol, data):
+        if protocol == 'tcp':
+            return (yield from self.tcp_client.echo(data))
+        response = yield from self.http_client.echo(data.encode())
+        body = yield from response.read()
+        return body.decode()
+
+    @asyncio.coroutine
+    def stop(self):
+        for bus in self._buses:
+            bus.http_bus.close()
+        for server in self._servers:
+            server.close()
+            yield from server.wait_closed()
+
+
+def _percentile(values, percent):
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+@asyncio.coroutine
+def _caller(topology, protocol, data, n, latencies):
+    for _ in range(n):
+        start = time.perf_counter()
+        result = yield from topology.call(protocol, data)
+        latencies.append(time.perf_counter() - start)
+        if len(result) != len(data):
+            raise AssertionError('{} echoed {} bytes out of {}'.format(protocol, len(result), len(data)))
+
+
+@asyncio.coroutine
+def measure(topology, protocol, size, n, concurrency):
+    data = 'x' * size
+    yield from asyncio.gather(*[_caller(topology, protocol, data, WARMUP // concurrency + 1, [])
+                                for _ in range(concurrency)])
+    latencies = []
+    start = time.perf_counter()
+    yield from asyncio.gather(*[_caller(topology, protocol, data, n // concurrency, latencies)
+                                for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {'protocol': protocol, 'payload_bytes': size, 'concurrency': concurrency, 'requests': len(latencies),
+            'requests_per_sec': int(len(latencies) / elapsed),
+            'p50_usec': int(_percentile(latencies, 50) * 1e6), 'p99_usec': int(_percentile(latencies, 99) * 1e6)}
+
+
+@asyncio.coroutine
+def run(n, sizes, concurrencies, loop):
+    topology = Topology(loop)
+    yield from topology.start()
+    try:
+        results = []
+        for protocol in ('tcp', 'http'):
+            for size in sizes:
+                for concurrency in concurrencies:
+                    results.append((yield from measure(topology, protocol, size, n, concurrency)))
+        return results
+    finally:
+        yield from topology.stop()
+
+
+def _key(result):
+    return result['protocol'], result['payload_bytes'], result['concurrency']
+
+
+def compare(baseline, results, tolerance):
+    """
+    :return: the changes of every result from the baseline result of the same protocol, payload size and
+             concurrency, marked as regressions when beyond tolerance in the worse direction
+    """
+    baseline = {_key(result): result for result in baseline}
+    changes = []
+    for result in results:
+        base = baseline.get(_key(result))
+        if base is None:
+            continue
+        for metric, worse in (('requests_per_sec', -1), ('p50_usec', 1), ('p99_usec', 1)):
+            change = (result[metric] - base[metric]) / base[metric] if base[metric] else 0
+            changes.append({'protocol': result['protocol'], 'payload_bytes': result['payload_bytes'],
+                            'concurrency': result['concurrency'], 'metric': metric, 'baseline': base[metric],
+                            'current': result[metric], 'change': round(change, 3),
+                            'regression': change * worse > tolerance})
+    return changes
+
+
+def _ints(value):
+    return [int(part) for part in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.e2e', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per protocol, size and concurrency')
+    parser.add_argument('--sizes', type=_ints, default=[64, 1024, 16384], help='payload sizes in bytes')
+    parser.add_argument('--concurrency', type=_ints, default=[1, 16, 64], help='requests in flight at once')
+    parser.add_argument('--output', help='file to save the results to, to compare later runs against')
+    parser.add_argument('--compare', help='file of baseline results saved with --output')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='fraction a metric may get worse by')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('stats').setLevel(logging.WARNING)
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run(args.requests, args.sizes, args.concurrency, loop))
+    report = {'benchmark': 'e2e', 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            report['comparison'] = compare(json.load(f)['results'], results, args.tolerance)
+        regressions = [change for change in report['comparison'] if change['regression']]
+        report['regressions'] = len(regressions)
+    print(json.dumps(report, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares packets/sec decoded by TrellioProtocol with the json stream framing and the length prefixed framing,
+the latter once per registered codec
+
+usage: python -m benchmarks.framing [packets] [chunk_size]
+"""
+import json
+import logging
+import sys
+import time
+from unittest import mock
+
+from trellio.codec import JSON_CODEC, available_codecs, get_codec
+from trellio.jsonprotocol import TrellioProtocol, JSON_FRAMING, LENGTH_FRAMING
+
+
+class _CountingHandler:
+    def __init__(self):
+        self.count = 0
+
+    def receive(self, packet, protocol, transport):
+        self.count += 1
+
+
+def _sample_packet(i):
+    return {'pid': 'e4b0b4cbfa6a4a2ab5e3f4f7a9b7e3c1', 'app': None, 'name': 'user_service', 'version': '1',
+            'entity': str(i), 'endpoint': 'get_user', 'type': 'request', 'from': '0f8fad5bd9cb469fa165',
+            'payload': {'request_id': 'a2d1c6e8b0d24f5d', 'user_id': i, 'fields': ['name', 'email', 'phone'],
+                        'filters': {'active': True, 'org_ids': [1, 2, 3, 4]}}}
+
+
+def _protocol(framing, codec, handler):
+    protocol = TrellioProtocol(handler)
+    protocol._framing = framing
+    protocol._codec = get_codec(codec)
+    return protocol
+
+
+def _stream(framing, codec, packets):
+    protocol = _protocol(framing, codec, _CountingHandler())
+    start = time.perf_counter()
+    stream = b''.join(protocol._make_frame(packet) for packet in packets)
+    return stream, time.perf_counter() - start
+
+
+def run(framing, codec, n, chunk_size):
+    stream, encode_time = _stream(framing, codec, [_sample_packet(i) for i in range(n)])
+    handler = _CountingHandler()
+    protocol = _protocol(framing, codec, handler)
+    protocol.connection_made(mock.Mock())
+    protocol._awaiting = None
+    chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+    start = time.perf_counter()
+    for chunk in chunks:
+        protocol.data_received(chunk)
+    elapsed = time.perf_counter() - start
+    assert handler.count == n
+    return {'framing': framing, 'codec': codec, 'packets': n, 'bytes': len(stream),
+            'encode_packets_per_sec': int(n / encode_time), 'decode_seconds': round(elapsed, 4),
+            'packets_per_sec': int(n / elapsed)}
+
+
+def main(n=20000, chunk_size=64 * 1024):
+    logging.getLogger().setLevel(logging.WARNING)
+    results = [run(JSON_FRAMING, JSON_CODEC, n, chunk_size)]
+    results.extend(run(LENGTH_FRAMING, codec, n, chunk_size) for codec in available_codecs())
+    print(json.dumps({'benchmark': 'framing', 'chunk_size': chunk_size, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
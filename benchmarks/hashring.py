@@ -0,0 +1,41 @@
+"""
+Resolve latency and memory of entity routing through RegistryClient at a million distinct entities
+
+usage: python -m benchmarks.hashring [entities] [nodes]
+"""
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+from trellio.registry_client import RegistryClient
+
+
+def main(n=1000000, nodes=8):
+    logging.getLogger().setLevel(logging.WARNING)
+    client = RegistryClient(mock.Mock(), '127.0.0.1', 4500)
+    for i in range(nodes):
+        client.cache_instance('user_service', 1, '127.0.0.1', 4000 + i, 'node{}'.format(i), 'tcp')
+    entities = ['user-{}'.format(i) for i in range(n)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for entity in entities:
+        client.resolve('user_service', 1, entity, 'tcp')
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    counts = {}
+    for entity in entities[:100000]:
+        node_id = client.resolve('user_service', 1, entity, 'tcp')[2]
+        counts[node_id] = counts.get(node_id, 0) + 1
+    print(json.dumps({'benchmark': 'hashring', 'entities': n, 'nodes': nodes,
+                      'resolve_usec': round(elapsed / n * 1e6, 3), 'peak_memory_bytes': peak,
+                      'max_node_share': round(max(counts.values()) / sum(counts.values()), 4)}, indent=2))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
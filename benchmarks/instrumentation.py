@@ -0,0 +1,70 @@
+"""
+Per request cost of what the @api and http route decorators add around a handler: stats, deadline, middleware
+pipeline and logging, with the debug loggers disabled as in production. Exits with status 1 when it is over budget.
+
+usage: python -m benchmarks.instrumentation [requests] [budget_usec]
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+from unittest import mock
+
+from aiohttp.web import Response
+
+from trellio import TCPService, HTTPService, api, get
+
+RESPONSE = Response()
+
+
+def _echo(self, data):
+    return data
+
+
+def _route(self, request):
+    return RESPONSE
+
+
+class _TCPService(TCPService):
+    echo = api(_echo)
+
+
+class _HTTPService(HTTPService):
+    echo = get('/echo')(_route)
+
+
+@asyncio.coroutine
+def _time(call, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        yield from call()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+@asyncio.coroutine
+def run(n):
+    tcp_service = _TCPService('bench', '1')
+    http_service = _HTTPService('bench', '1', '127.0.0.1', 0)
+    request = mock.Mock(GET={})
+    handler, route = asyncio.coroutine(_echo), asyncio.coroutine(_route)
+    baseline_tcp = yield from _time(lambda: handler(tcp_service, data='x'), n)
+    tcp = yield from _time(lambda: tcp_service.echo(request_id='r', entity=None, from_id='n', data='x'), n)
+    baseline_http = yield from _time(lambda: route(http_service, request), n)
+    http = yield from _time(lambda: http_service.echo(request), n)
+    return {'tcp_usec': round(tcp - baseline_tcp, 2), 'http_usec': round(http - baseline_http, 2)}
+
+
+def main(n=100000, budget=25):
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('stats').setLevel(logging.WARNING)
+    loop = asyncio.get_event_loop()
+    result = loop.run_until_complete(run(n))
+    result.update({'benchmark': 'instrumentation', 'requests': n, 'budget_usec': budget})
+    print(json.dumps(result, indent=2))
+    if max(result['tcp_usec'], result['http_usec']) > budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,84 @@
+"""
+Compares request/response latency between TrellioProtocol peers over loopback tcp and over a unix socket
+
+usage: python -m benchmarks.transport [requests] [concurrency] [json|length]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from trellio.jsonprotocol import TrellioProtocol, LENGTH_FRAMING
+
+
+class _EchoHandler:
+    def receive(self, packet, protocol, transport):
+        protocol.send(packet)
+
+
+class _ClientHandler:
+    def __init__(self):
+        self.pending = {}
+
+    def receive(self, packet, protocol, transport):
+        self.pending.pop(packet['request_id']).set_result(None)
+
+
+def _percentile(values, percent):
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+@asyncio.coroutine
+def _requests(protocol, handler, ids, latencies):
+    for request_id in ids:
+        future = asyncio.Future()
+        handler.pending[request_id] = future
+        start = time.perf_counter()
+        protocol.send({'type': 'request', 'request_id': request_id, 'payload': {'user_id': request_id}})
+        yield from future
+        latencies.append(time.perf_counter() - start)
+
+
+@asyncio.coroutine
+def run(transport, framing, n, concurrency, loop):
+    handler = _ClientHandler()
+    server_factory = lambda: TrellioProtocol(_EchoHandler())  # noqa
+    client_factory = lambda: TrellioProtocol(handler, framing=framing)  # noqa
+    if transport == 'unix':
+        path = os.path.join(tempfile.mkdtemp(), 'trellio.sock')
+        server = yield from loop.create_unix_server(server_factory, path)
+        client_transport, protocol = yield from loop.create_unix_connection(client_factory, path)
+    else:
+        server = yield from loop.create_server(server_factory, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client_transport, protocol = yield from loop.create_connection(client_factory, '127.0.0.1', port)
+
+    latencies = []
+    ids = list(range(n))
+    start = time.perf_counter()
+    yield from asyncio.gather(*[_requests(protocol, handler, ids[i::concurrency], latencies)
+                                for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    client_transport.close()
+    server.close()
+    yield from server.wait_closed()
+
+    latencies.sort()
+    return {'transport': transport, 'framing': framing, 'requests': n, 'concurrency': concurrency,
+            'requests_per_sec': int(n / elapsed),
+            'p50_usec': int(_percentile(latencies, 50) * 1e6), 'p99_usec': int(_percentile(latencies, 99) * 1e6),
+            'mean_usec': int(sum(latencies) / n * 1e6)}
+
+
+def main(n=10000, concurrency=1, framing=LENGTH_FRAMING):
+    logging.getLogger().setLevel(logging.WARNING)
+    loop = asyncio.get_event_loop()
+    results = [loop.run_until_complete(run(transport, framing, n, concurrency, loop)) for transport in ('tcp', 'unix')]
+    print(json.dumps({'benchmark': 'transport', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]] + sys.argv[3:4])
@@ -41,7 +41,7 @@ with open('trellio/__init__.py', 'rb') as i:
 
 setup(
     name='trellio',
-    packages=find_packages(exclude=['examples', 'tests']),
+    packages=find_packages(exclude=['examples', 'tests', 'benchmarks']),
     version=version,
     description='Python3 asyncio based micro-framework for micro-service architecture',
     author='Abhishek Verma, Nirmal Singh',
@@ -49,5 +49,6 @@ setup(
     url='https://github.com/artificilabs/trellio.git',
     keywords=['asyncio', 'microservice', 'microframework', 'aiohttp'],
     package_data={'requirements': ['*.txt']},
-    install_requires=install_requires
+    install_requires=install_requires,
+    extras_require={'msgpack': ['msgpack']}
 )
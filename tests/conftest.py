@@ -1,9 +1,20 @@
+import asyncio
+
 import pytest
 
 from trellio.registry import Registry, Repository
 from .factories import ServiceFactory, EndpointFactory
 
 
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+
 @pytest.fixture
 def registry():
     r = Registry(ip='192.168.1.1', port=4001, repository=Repository())
@@ -0,0 +1,64 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from trellio import TCPService, TCPServiceClient, ServiceOverloaded, api
+from trellio.bus import TCPBus
+
+
+class GatedService(TCPService):
+    gate = None
+
+    @api(max_concurrency=1, max_queue=1)
+    def gated(self):
+        yield from self.gate
+
+    @api
+    def free(self):
+        return 'free'
+
+
+class OverloadClient(TCPServiceClient):
+    def __init__(self):
+        super(OverloadClient, self).__init__('gated', '1')
+
+
+def request_packet(endpoint, request_id):
+    return {'type': 'request', 'name': 'gated', 'version': '1', 'entity': None, 'from': 'n1',
+            'endpoint': endpoint, 'payload': {'request_id': request_id}}
+
+
+def test_requests_beyond_queue_are_rejected(loop):
+    GatedService.gate = asyncio.Future(loop=loop)
+    bus = TCPBus(mock.Mock())
+    bus.tcp_host = GatedService('gated', '1', max_concurrency=10)
+    bus.build_endpoint_table()
+    protocol = mock.Mock()
+
+    for request_id in ('r1', 'r2', 'r3'):
+        bus._request_receiver(request_packet('gated', request_id), protocol)
+    bus._request_receiver(request_packet('free', 'r4'), protocol)
+    loop.run_until_complete(asyncio.sleep(0.01, loop=loop))
+
+    payloads = {call[0][0]['payload']['request_id']: call[0][0]['payload'] for call in protocol.send.call_args_list}
+    assert set(payloads) == {'r3', 'r4'}
+    assert payloads['r3']['overloaded'] and payloads['r4']['result'] == 'free'
+    stats = bus.admission_stats()
+    assert stats['gated']['active'] == 1 and stats['gated']['queue_depth'] == 1 and stats['gated']['rejected'] == 1
+    assert stats['gated/1']['active'] == 2 and stats['gated/1']['rejected'] == 0
+
+    GatedService.gate.set_result(None)
+    loop.run_until_complete(asyncio.sleep(0.01, loop=loop))
+    assert {'r1', 'r2'} <= {call[0][0]['payload']['request_id'] for call in protocol.send.call_args_list}
+    assert bus.admission_stats()['gated']['active'] == 0 and bus.admission_stats()['gated']['queued'] == 1
+
+
+def test_overloaded_response_raises_service_overloaded(loop):
+    client = OverloadClient()
+    client.tcp_bus = mock.Mock()
+    future = client._send_request(None, 'gated', None, {'request_id': 'r1'}, timeout=10)
+    client._process_response({'type': 'response', 'payload': {'request_id': 'r1', 'error': 'Service overloaded',
+                                                              'failed': True, 'overloaded': True}})
+    with pytest.raises(ServiceOverloaded):
+        loop.run_until_complete(future)
@@ -0,0 +1,92 @@
+from unittest import mock
+
+from trellio import TCPService, api
+from trellio.api_cache import APICache, MISSING, invalidate, cache_stats, make_key
+from trellio.utils.stats import Aggregator
+
+
+class LookupService(TCPService):
+    calls = 0
+
+    @api(cache_ttl=60, cache_size=2)
+    def lookup_user(self, user_id, fields=None):
+        LookupService.calls += 1
+        return {'user_id': user_id, 'fields': fields}
+
+
+class OtherLookupService(TCPService):
+    calls = 0
+
+    @api(cache_ttl=60)
+    def lookup_user(self, user_id):
+        OtherLookupService.calls += 1
+        return user_id
+
+
+CACHE_NAME = __name__ + '.LookupService.lookup_user'
+
+
+def call(loop, service, **params):
+    response = loop.run_until_complete(service.lookup_user(request_id='r1', entity=None, from_id='n1', **params))
+    return response['payload']['result']
+
+
+def test_cached_results_skip_the_handler(loop):
+    service = LookupService('lookup', '1')
+    LookupService.calls = 0
+    assert call(loop, service, user_id=1, fields=['name']) == call(loop, service, fields=['name'], user_id=1)
+    assert LookupService.calls == 1
+
+    invalidate('lookup_user', user_id=1, fields=['name'])
+    call(loop, service, user_id=1, fields=['name'])
+    assert LookupService.calls == 2
+    assert cache_stats()[CACHE_NAME]['hits'] == 1
+    assert Aggregator.dump_stats()['api_cache'][CACHE_NAME]['misses'] == 2
+    invalidate('lookup_user')
+
+
+def test_endpoints_of_the_same_name_have_their_own_caches(loop):
+    services = LookupService('lookup', '1'), OtherLookupService('other', '1')
+    LookupService.calls = OtherLookupService.calls = 0
+    for _ in range(2):
+        for service in services:
+            call(loop, service, user_id=1)
+    assert LookupService.calls == OtherLookupService.calls == 1
+
+    invalidate('OtherLookupService.lookup_user')
+    for service in services:
+        call(loop, service, user_id=1)
+    assert (LookupService.calls, OtherLookupService.calls) == (1, 2)
+    invalidate('lookup_user')
+    for service in services:
+        call(loop, service, user_id=1)
+    assert (LookupService.calls, OtherLookupService.calls) == (2, 3)
+    invalidate('lookup_user')
+
+
+def test_keys_tell_types_apart():
+    assert len({make_key({'a': 1}), make_key({'a': True}), make_key({'a': 1.0})}) == 3
+    assert make_key({'a': 1, 'b': [1]}) != make_key({'a': 1, 'b': [True]})
+
+
+def test_lru_and_ttl():
+    cache = APICache('test', ttl=10, size=2)
+    with mock.patch('trellio.api_cache.time.monotonic', return_value=0):
+        cache.put(make_key({'a': 1}), 1)
+        cache.put(make_key({'a': 2}), 2)
+        cache.get(make_key({'a': 1}))
+        cache.put(make_key({'a': 3}), 3)
+        assert cache.get(make_key({'a': 2})) is MISSING and cache.get(make_key({'a': 1})) == 1
+    with mock.patch('trellio.api_cache.time.monotonic', return_value=11):
+        assert cache.get(make_key({'a': 1})) is MISSING
+    assert cache.stats()['evictions'] == 1
+
+
+def test_callers_mutating_results_leave_the_cache_alone():
+    cache = APICache('test', ttl=10)
+    key = make_key({'a': 1})
+    result = {'names': ['a']}
+    cache.put(key, result)
+    result['names'].append('b')
+    cache.get(key)['names'].append('c')
+    assert cache.get(key) == {'names': ['a']}
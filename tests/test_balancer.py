@@ -0,0 +1,50 @@
+from unittest import mock
+
+from trellio.balancer import (LoadTracker, RoundRobinBalancer, LeastOutstandingBalancer, PowerOfTwoBalancer,
+                              EWMALatencyBalancer)
+from trellio.registry_client import RegistryClient
+
+NODES = [('127.0.0.1', 4000 + i, 'node{}'.format(i), 'tcp') for i in range(3)]
+
+
+def test_round_robin():
+    balancer = RoundRobinBalancer()
+    chosen = [balancer.choose(NODES, LoadTracker())[2] for _ in range(6)]
+    assert sorted(chosen) == sorted(['node0', 'node1', 'node2'] * 2)
+
+
+def test_least_outstanding():
+    load = LoadTracker()
+    load.start('node0')
+    load.start('node2')
+    assert LeastOutstandingBalancer().choose(NODES, load)[2] == 'node1'
+
+
+def test_power_of_two_avoids_busiest_node():
+    load = LoadTracker()
+    for _ in range(5):
+        load.start('node0')
+    balancer = PowerOfTwoBalancer()
+    assert all(balancer.choose(NODES, load)[2] != 'node0' for _ in range(50))
+
+
+def test_ewma_latency():
+    load = LoadTracker()
+    with mock.patch('trellio.balancer.time.monotonic', side_effect=[0, 1, 0, 0.01, 0, 0.01]):
+        for node_id in ('node0', 'node1', 'node2'):
+            load.finish(node_id, load.start(node_id))
+    balancer = EWMALatencyBalancer()
+    assert all(balancer.choose(NODES, load)[2] != 'node0' for _ in range(50))
+
+
+def test_candidates_follow_deregistration():
+    client = RegistryClient(mock.Mock(), '127.0.0.1', 4500)
+    for host, port, node_id, service_type in NODES:
+        client.cache_instance('echo', 1, host, port, node_id, service_type)
+    node_id = client.resolve('echo', 1, 'user1', 'tcp')[2]
+    assert client.resolve('echo', 1, 'user1', 'tcp', RoundRobinBalancer())[2] == node_id
+
+    client._handle_deregistration({'params': {'name': 'echo', 'version': 1, 'node_id': node_id}})
+    remaining = [node for node in NODES if node[2] != node_id]
+    assert client._candidates[('echo/1', 'tcp')] == remaining
+    assert client.resolve('echo', 1, 'user1', 'tcp') in remaining
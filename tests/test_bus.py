@@ -0,0 +1,142 @@
+import asyncio
+from unittest import mock
+
+from trellio import TCPService, TCPServiceClient, HTTPServiceClient, TCPView, api, request
+from trellio.balancer import RoundRobinBalancer
+from trellio.bus import TCPBus
+from trellio.jsonprotocol import TrellioProtocol
+from trellio.registry_client import RegistryClient
+from trellio.utils.helpers import host_identity
+
+
+class EchoService(TCPService):
+    @api
+    def echo(self, data):
+        return data
+
+
+class EchoView(TCPView):
+    @api
+    def echo(self, data):
+        return 'view'
+
+    @api
+    def reverse(self, data):
+        return data[::-1]
+
+
+def request_packet(endpoint, **payload):
+    payload['request_id'] = 'r1'
+    return {'type': 'request', 'name': 'echo', 'version': '1', 'entity': None, 'from': 'n1',
+            'endpoint': endpoint, 'payload': payload}
+
+
+def make_bus():
+    bus = TCPBus(mock.Mock())
+    bus.tcp_host = EchoService('echo', '1')
+    bus.tcp_host.tcp_views = [EchoView()]
+    bus.build_endpoint_table()
+    return bus
+
+
+def dispatch(bus, packet):
+    protocol = mock.Mock()
+    bus._request_receiver(packet, protocol)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    return protocol.send.call_args[0][0]['payload']
+
+
+def test_service_apis_take_precedence_over_views():
+    bus = make_bus()
+    assert dispatch(bus, request_packet('echo', data='abc'))['result'] == 'abc'
+    assert dispatch(bus, request_packet('reverse', data='abc'))['result'] == 'cba'
+
+
+def test_unknown_endpoint_gets_error_response():
+    payload = dispatch(make_bus(), request_packet('missing'))
+    assert payload['failed'] and payload['request_id'] == 'r1'
+    assert 'missing' in payload['error']
+
+
+def test_requests_are_not_read_while_responses_are_not(loop):
+    protocol = TrellioProtocol(make_bus())
+    transport = mock.Mock()
+    with mock.patch('asyncio.get_event_loop'):
+        protocol.connection_made(transport)
+    protocol.pause_writing()
+    protocol.on_element(request_packet('echo', data='abc'))
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert transport.pause_reading.called and protocol.pending == 1
+
+    protocol.resume_writing()
+    protocol._send_q.flush()
+    assert transport.resume_reading.called and protocol.pending == 0
+
+
+class EchoClient(TCPServiceClient):
+    def __init__(self):
+        super(EchoClient, self).__init__('echo', '1')
+
+    @request
+    def echo(self, data):
+        return locals()
+
+
+def test_requests_to_local_service_skip_the_socket(loop):
+    bus = make_bus()
+    client = EchoClient()
+    client.tcp_bus = bus
+    data = ['abc']
+    with mock.patch.object(bus, 'send') as send:
+        assert loop.run_until_complete(client.echo(data)) is data
+        client._local_copy = True
+        result = loop.run_until_complete(client.echo(data))
+    assert result == data and result is not data
+    assert not send.called and not client._pending_requests
+
+
+def test_same_host_nodes_are_reached_over_unix_socket(loop):
+    registry_client = RegistryClient(loop, '127.0.0.1', 4500)
+    addresses = [{'host': '10.0.0.2', 'port': 4000, 'node_id': 'n2', 'type': 'tcp',
+                  'transport': {'unix_path': '/tmp/echo.sock', 'host_id': host_identity()}},
+                 {'host': '10.0.0.3', 'port': 4000, 'node_id': 'n3', 'type': 'tcp',
+                  'transport': {'unix_path': '/tmp/echo.sock', 'host_id': 'elsewhere'}}]
+    registry_client.cache_vendors([{'name': 'echo', 'version': '1', 'addresses': addresses}])
+    bus = TCPBus(registry_client)
+    client = EchoClient()
+
+    with mock.patch('trellio.bus.ConnectionPool') as pool_class:
+        bus._connect_to_client('10.0.0.2', 'n2', 4000, 'tcp', client)
+        bus._connect_to_client('10.0.0.3', 'n3', 4000, 'tcp', client)
+    unix_connect, tcp_connect = [call[0][1] for call in pool_class.call_args_list]
+    assert unix_connect.func == loop.create_unix_connection and unix_connect.args[1] == '/tmp/echo.sock'
+    assert tcp_connect.func == loop.create_connection and tcp_connect.args[1:] == ('10.0.0.3', 4000)
+
+
+class EchoHTTPClient(HTTPServiceClient):
+    def __init__(self):
+        super(EchoHTTPClient, self).__init__('echo', '1')
+
+
+def test_tcp_clients_keep_their_balancer_next_to_an_http_client(loop):
+    registry_client = mock.Mock(connect=asyncio.coroutine(lambda: None))
+    registry_client.resolve.return_value = ('10.0.0.2', 4000, 'n2', 'tcp')
+    bus = make_bus()
+    bus._registry_client = registry_client
+    tcp_client, http_client = EchoClient(), EchoHTTPClient()
+    tcp_client._balancer, http_client._balancer = RoundRobinBalancer(), RoundRobinBalancer()
+    bus.tcp_host.clients = [tcp_client, http_client]
+    with mock.patch('trellio.bus.Aggregator'):
+        loop.run_until_complete(bus.connect())
+    assert bus._get_node_id_for_packet(request_packet('echo')) == 'n2'
+    assert registry_client.resolve.call_args[1]['balancer'] is tcp_client.balancer
+
+
+def test_deregistered_nodes_lose_their_pools():
+    client = RegistryClient(mock.Mock(), '127.0.0.1', 4500)
+    client.bus = TCPBus(client)
+    pool = mock.Mock()
+    client.bus._client_pools['node0'] = pool
+    client._handle_deregistration({'params': {'name': 'echo', 'version': 1, 'node_id': 'node0'}})
+    assert pool.close.called and client.bus.pool_stats() == {}
@@ -0,0 +1,91 @@
+import asyncio
+from unittest import mock
+
+from trellio import connection_pool
+from trellio.connection_pool import ConnectionPool
+
+
+class FakeProtocol:
+    pending = 0
+
+    def __init__(self):
+        self.closed = False
+
+    def is_connected(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+async def connect():
+    return None, FakeProtocol()
+
+
+async def refused():
+    raise ConnectionRefusedError
+
+
+def filled_pool(min_size=1, max_size=3):
+    pool = ConnectionPool('node', connect, min_size, max_size)
+    asyncio.get_event_loop().run_until_complete(pool.fill())
+    return pool
+
+
+def send(pool, n):
+    futures = []
+    for _ in range(n):
+        future = asyncio.Future()
+        pool.track(pool.acquire(), future)
+        futures.append(future)
+    return futures
+
+
+def test_least_outstanding_connection_is_picked():
+    pool = filled_pool(min_size=2)
+    send(pool, 3)
+    counts = sorted(pool._outstanding.values())
+    assert counts == [1, 2]
+
+
+def test_pool_grows_and_shrinks_with_load():
+    loop = asyncio.get_event_loop()
+    pool = filled_pool()
+    with mock.patch.object(connection_pool, 'GROW_THRESHOLD', 2), \
+            mock.patch.object(connection_pool, 'SHRINK_THRESHOLD', 1):
+        futures = send(pool, 3)
+        loop.run_until_complete(asyncio.sleep(0))
+        assert pool.stats()['size'] == 2 and pool.stats()['grown'] == 1
+
+        for future in futures:
+            future.set_result(None)
+        loop.run_until_complete(asyncio.sleep(0))
+        assert pool.stats()['size'] == 1 and pool.stats()['shrunk'] == 1
+        assert pool.stats()['outstanding'] == 0
+
+
+def test_disconnected_protocols_are_pruned():
+    pool = filled_pool(min_size=2)
+    pool.protocols[0].close()
+    assert pool.acquire() is pool.protocols[0]
+    assert pool.stats()['size'] == 1
+
+
+def test_failed_refill_is_logged():
+    loop = asyncio.get_event_loop()
+    pool = filled_pool()
+    pool._connect = refused
+    pool.protocols[0].close()
+    with mock.patch.object(pool, 'logger') as logger:
+        assert pool.acquire() is None
+        loop.run_until_complete(asyncio.sleep(0))
+    assert logger.error.call_count == 2  # the connection and the refill
+    assert pool._refill.done()
+
+
+def test_closed_pool_closes_its_connections():
+    pool = filled_pool(min_size=2)
+    protocols = pool.protocols
+    pool.close()
+    assert all(protocol.closed for protocol in protocols)
+    assert pool.stats()['size'] == 0 and pool.acquire() is None
@@ -0,0 +1,48 @@
+import os
+import threading
+
+import pytest
+
+from trellio import TCPService, api
+from trellio.executors import ExecutorPool, PROCESS, register_instance, get_pool, pool_stats
+
+
+class ReportService(TCPService):
+    @api(executor='thread', pool='test_reports')
+    def thread_report(self, rows):
+        return threading.current_thread().name, sum(rows)
+
+    @api(executor='process', pool='test_process_reports')
+    def process_report(self, rows):
+        return os.getpid(), self.name, sum(rows)
+
+
+def test_api_runs_in_thread_pool(loop):
+    service = ReportService('reports', '1')
+    response = loop.run_until_complete(service.thread_report(request_id='r1', entity=None, from_id='n1', rows=[1, 2]))
+
+    thread_name, total = response['payload']['result']
+    assert total == 3 and thread_name != threading.current_thread().name
+    assert pool_stats()['test_reports']['completed'] == 1
+    get_pool('test_reports').shutdown()
+
+
+def test_api_runs_in_process_pool(loop):
+    service = ReportService('reports', '1')
+    register_instance(service)
+    pool = get_pool('test_process_reports', PROCESS)
+    try:
+        response = loop.run_until_complete(service.process_report(request_id='r1', entity=None, from_id='n1',
+                                                                  rows=[1, 2, 3]))
+    finally:
+        pool.shutdown()
+
+    pid, name, total = response['payload']['result']
+    assert pid != os.getpid() and name == 'reports' and total == 6
+
+
+def test_invalid_executor_options():
+    with pytest.raises(ValueError):
+        ExecutorPool('bad', executor='fiber')
+    with pytest.raises(TypeError):
+        api(executor='thread')(lambda self: (yield))
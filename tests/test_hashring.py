@@ -0,0 +1,24 @@
+from trellio.hashring import HashRing
+
+NODES = [('127.0.0.1', 4000 + i, 'node{}'.format(i), 'tcp') for i in range(4)]
+
+
+def test_empty_ring():
+    assert HashRing().get('user1') is None
+
+
+def test_entities_spread_over_nodes():
+    ring = HashRing(NODES)
+    counts = {}
+    for entity in range(10000):
+        node_id = ring.get(entity)[2]
+        counts[node_id] = counts.get(node_id, 0) + 1
+    assert len(ring) == 4
+    assert min(counts.values()) > 1500
+
+
+def test_adding_a_node_moves_few_entities():
+    before, after = HashRing(NODES), HashRing(NODES + [('127.0.0.1', 4004, 'node4', 'tcp')])
+    moved = [entity for entity in range(10000) if before.get(entity) != after.get(entity)]
+    assert all(after.get(entity)[2] == 'node4' for entity in moved)
+    assert 1000 < len(moved) < 3000
@@ -0,0 +1,44 @@
+import random
+
+from trellio.utils.histogram import BUCKETS, Histogram
+from trellio.utils.stats import StatUnit
+
+
+def test_percentiles_are_within_bucket_precision():
+    values = [random.expovariate(1 / 50) for _ in range(20000)]
+    histogram = Histogram(resolution=0.01)
+    for value in values:
+        histogram.update(value)
+    values.sort()
+    for percent in (50, 90, 99, 99.9):
+        exact = values[int(len(values) * percent / 100 + 0.5) - 1]
+        assert abs(histogram.percentile(percent) - exact) <= exact / 32 + 0.01
+    assert histogram.min == values[0] and histogram.max == values[-1]
+    assert histogram.percentile(100) == values[-1]
+
+
+def test_merged_histograms_count_both():
+    first, second, both = Histogram(), Histogram(), Histogram()
+    for value in range(1, 1000):
+        (first if value % 2 else second).update(value)
+        both.update(value)
+    snapshot = first.snapshot()
+    assert snapshot.merge(second).to_dict() == both.to_dict() and snapshot.count == 999
+    assert first.count == 500
+
+
+def test_merged_buckets_stay_apart():
+    buckets = [2 ** 62 + index for index in range(BUCKETS)]
+    merged = Histogram.from_buckets(buckets, 0, 0, 0).merge(Histogram.from_buckets(buckets, 0, 0, 0))
+    assert list(merged._counts) == [2 * count for count in buckets]
+
+
+def test_stat_units_report_percentiles_per_sub_unit():
+    first, second = StatUnit('total'), StatUnit('total')
+    for unit, value in ((first, 10), (first, 20), (second, 1000)):
+        unit.update(value, success=value < 1000)
+        unit.sub.setdefault('tcp', StatUnit('tcp')).update(value, success=True)
+    d = first.snapshot().merge(second).to_dict()
+    assert (d['count'], d['success_count'], d['min'], d['max'], d['p50']) == (3, 2, 10, 1000, 20)
+    assert d['sub']['tcp']['p999'] == 1000
+    assert first.count == 2
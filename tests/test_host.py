@@ -0,0 +1,46 @@
+import socket
+from unittest import mock
+
+import pytest
+
+from trellio.host import Host
+
+
+def test_supervisor_restarts_crashed_workers():
+    def wait():
+        status = statuses.pop(0)
+        Host._stopping = status[1] == 0  # stopped after the crashed worker was replaced
+        return status
+
+    statuses = [(101, 256), (102, 0), (103, 0)]
+    with mock.patch.object(Host, 'workers', 2), mock.patch.object(Host, '_worker_pids', {}), \
+            mock.patch('trellio.host.os.fork', side_effect=[101, 102, 103]) as fork, \
+            mock.patch('trellio.host.os.wait', side_effect=wait), mock.patch('trellio.host.signal.signal'), \
+            mock.patch('trellio.host.time.sleep'), mock.patch('trellio.host.Aggregator.share'):
+        Host._supervise()
+
+    assert fork.call_count == 3
+    Host._stopping = False
+
+
+def test_reuse_port_only_with_workers():
+    assert Host._reuse_port_kwargs() == {}
+    with mock.patch.object(Host, 'workers', 4):
+        assert Host._reuse_port_kwargs() == {'reuse_port': True}
+
+
+def test_only_unix_sockets_are_removed(tmpdir):
+    path = tmpdir.join('service.sock')
+    Host._remove_unix_socket(str(path))  # nothing there
+
+    path.write('not a socket')
+    with pytest.raises(FileExistsError):
+        Host._remove_unix_socket(str(path))
+    assert path.check()
+
+    path.remove()
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(str(path))
+    sock.close()
+    Host._remove_unix_socket(str(path))
+    assert not path.check()
@@ -0,0 +1,44 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from aiohttp import web
+
+from trellio.balancer import LoadTracker
+from trellio.bus import HTTPBus
+from trellio.exceptions import ClientNotFoundError
+
+
+def test_requests_reuse_connections(loop):
+    peers = []
+
+    @asyncio.coroutine
+    def handler(request):
+        peers.append(request.transport.get_extra_info('peername'))
+        return web.Response(text=request.query['service'])
+
+    app = web.Application(loop=loop)
+    app.router.add_get('/users', handler)
+    server = loop.run_until_complete(loop.create_server(app.make_handler(), '127.0.0.1', 0))
+    port = server.sockets[0].getsockname()[1]
+    registry_client = mock.Mock(load=LoadTracker())
+    registry_client.resolve.return_value = ('127.0.0.1', port, 'node1', 'http')
+    bus = HTTPBus(registry_client)
+
+    @asyncio.coroutine
+    def send():
+        response = yield from bus.send_http_request(None, 'users', '1', 'get', None, {'path': '/users'})
+        return (yield from response.text())
+
+    assert [loop.run_until_complete(send()) for _ in range(3)] == ['users'] * 3
+    assert len(set(peers)) == 1
+    assert registry_client.load.outstanding('node1') == 0
+    bus.close()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+
+
+def test_unresolved_service_raises(loop):
+    bus = HTTPBus(mock.Mock(resolve=mock.Mock(return_value=None)))
+    with pytest.raises(ClientNotFoundError):
+        loop.run_until_complete(bus.send_http_request(None, 'users', '1', 'get', None, {'path': '/'}))
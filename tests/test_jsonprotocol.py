@@ -0,0 +1,184 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+
+from trellio.codec import JSON_CODEC, MSGPACK_CODEC
+from trellio.jsonprotocol import TrellioProtocol, JSON_FRAMING, LENGTH_FRAMING, OLD_PEER_TTL
+from trellio.pubsub import Publisher, Subscriber
+
+
+def connected_protocol(framing=JSON_FRAMING, codec=JSON_CODEC, peer=None):
+    handler = mock.Mock()
+    transport = mock.Mock()
+    protocol = TrellioProtocol(handler, framing=framing, codec=codec, peer=peer)
+    with mock.patch('asyncio.get_event_loop'):
+        protocol.connection_made(transport)
+    return protocol, handler, transport
+
+
+def written(transport):
+    data = []
+    for name, args, _ in transport.method_calls:
+        if name == 'write':
+            data.append(args[0])
+        elif name == 'writelines':
+            data.extend(args[0])
+    return b''.join(data)
+
+
+def flushed(protocol):
+    protocol._send_q.flush()
+    return written(protocol._transport)
+
+
+def received_packets(handler):
+    return [call[1]['packet'] for call in handler.receive.call_args_list]
+
+
+def test_json_framing_with_old_peer():
+    protocol, handler, transport = connected_protocol()
+    protocol.data_received(b'{"type": "request", "pid": 1},{"type": "req')
+    protocol.data_received(b'uest", "pid": 2},')
+
+    assert protocol.framing == JSON_FRAMING
+    assert [p['pid'] for p in received_packets(handler)] == [1, 2]
+
+
+def test_length_framing_handshake():
+    client, client_handler, client_transport = connected_protocol(LENGTH_FRAMING)
+    server, server_handler, server_transport = connected_protocol()
+
+    client.send({'type': 'request', 'pid': 1})
+    assert client.framing == JSON_FRAMING  # request is held till the handshake completes
+
+    handshake = flushed(client)
+    server.data_received(handshake)
+    assert server.framing == LENGTH_FRAMING
+    client.data_received(written(server_transport))
+    assert client.framing == LENGTH_FRAMING
+
+    client.send({'type': 'request', 'pid': 2})
+    frames = flushed(client)[len(handshake):]
+    for i in range(len(frames)):  # deliver byte by byte to exercise partial frames
+        server.data_received(frames[i:i + 1])
+
+    assert [p['pid'] for p in received_packets(server_handler)] == [1, 2]
+
+
+def test_length_framing_fallback_on_timeout():
+    client, handler, transport = connected_protocol(LENGTH_FRAMING)
+    client.send({'type': 'request', 'pid': 1})
+    client._on_handshake_timeout()
+
+    assert client.framing == JSON_FRAMING
+    assert flushed(client).endswith(b'{"type": "request", "pid": 1},')
+
+
+def test_peers_not_answering_the_handshake_are_remembered():
+    client, handler, transport = connected_protocol(LENGTH_FRAMING, peer=('10.0.0.9', 4000))
+    client._on_handshake_timeout()
+
+    client, handler, transport = connected_protocol(LENGTH_FRAMING, peer=('10.0.0.9', 4000))
+    client.send({'type': 'request', 'pid': 1})
+    assert flushed(client) == b'{"type": "request", "pid": 1},'  # no offer, nothing held
+    client, handler, transport = connected_protocol(LENGTH_FRAMING, peer=('10.0.0.8', 4000))
+    assert written(transport).startswith(b'{"type": "handshake"')
+
+    with mock.patch('trellio.jsonprotocol.time.monotonic', return_value=time.monotonic() + OLD_PEER_TTL):
+        client, handler, transport = connected_protocol(LENGTH_FRAMING, peer=('10.0.0.9', 4000))
+    assert written(transport).startswith(b'{"type": "handshake"')
+
+
+def test_codec_negotiation():
+    pytest.importorskip('msgpack')
+    client, client_handler, client_transport = connected_protocol(LENGTH_FRAMING, MSGPACK_CODEC)
+    server, server_handler, server_transport = connected_protocol()
+
+    server.data_received(written(client_transport))
+    client.data_received(written(server_transport))
+    assert client.codec == server.codec == MSGPACK_CODEC
+
+    client.send({'type': 'request', 'payload': {'ids': [1, 2, 3]}})
+    server.data_received(flushed(client).split(b'},', 1)[1])
+    assert received_packets(server_handler) == [{'type': 'request', 'payload': {'ids': [1, 2, 3]}}]
+
+
+def test_codec_falls_back_to_json():
+    client, client_handler, client_transport = connected_protocol(LENGTH_FRAMING, 'unknown')
+    server, server_handler, server_transport = connected_protocol()
+
+    server.data_received(written(client_transport))
+    client.data_received(written(server_transport))
+    assert client.codec == server.codec == JSON_CODEC
+    assert client.framing == server.framing == LENGTH_FRAMING
+
+
+def test_coalesced_writes():
+    protocol, handler, transport = connected_protocol()
+    for pid in range(3):
+        protocol.send({'type': 'request', 'pid': pid})
+    protocol._send_q.flush()
+
+    assert transport.writelines.call_count == 1
+    assert len(transport.writelines.call_args[0][0]) == 3
+
+
+def test_backpressure():
+    loop = asyncio.new_event_loop()
+    protocol, handler, transport = connected_protocol()
+    protocol.pause_writing()
+    protocol.send({'type': 'request', 'pid': 1})
+    drain = asyncio.ensure_future(protocol.drain(), loop=loop)
+    loop.run_until_complete(asyncio.sleep(0, loop=loop))
+
+    assert protocol.pending == 1 and not drain.done()
+    assert flushed(protocol) == b''
+
+    protocol.resume_writing()
+    loop.run_until_complete(drain)
+    assert flushed(protocol) == b'{"type": "request", "pid": 1},'
+    loop.close()
+
+
+def test_reading_is_held_while_writing_is_paused():
+    protocol, handler, transport = connected_protocol()
+    protocol.hold_reading()
+    assert not transport.pause_reading.called
+
+    protocol.pause_writing()
+    protocol.hold_reading()
+    protocol.hold_reading()
+    assert transport.pause_reading.call_count == 1
+
+    protocol.resume_writing()
+    assert transport.resume_reading.call_count == 1
+    protocol.pause_writing()
+    protocol.resume_writing()
+    assert transport.resume_reading.call_count == 1
+
+
+def test_close_writes_out_queued_packets():
+    protocol, handler, transport = connected_protocol()
+    protocol.pause_writing()
+    protocol.send({'type': 'response', 'pid': 1})
+    protocol.close()
+    assert written(transport) == b'{"type": "response", "pid": 1},]' and transport.close.called
+
+
+def test_close_waits_for_the_handshake():
+    client, handler, transport = connected_protocol(LENGTH_FRAMING)
+    client.send({'type': 'request', 'pid': 1})
+    client.close()
+    assert not transport.close.called
+
+    client._on_handshake_timeout()
+    assert written(transport).endswith(b'{"type": "request", "pid": 1},]') and transport.close.called
+
+
+def test_pubsub_rejects_unknown_codecs():
+    with pytest.raises(ValueError, match=JSON_CODEC):
+        Publisher('pub', '1', 'localhost', 6379, codec='unknown')
+    with pytest.raises(ValueError, match=JSON_CODEC):
+        Subscriber('sub', '1', codec='unknown')
@@ -0,0 +1,78 @@
+import asyncio
+import sys
+import time
+from unittest import mock
+
+import pytest
+from aiohttp.web import Response
+
+from trellio import HTTPService, TCPService, api, get
+from trellio.bus import TCPBus
+from trellio.loop_monitor import LoopMonitor, endpoint_of
+
+
+class SlowService(TCPService):
+    @api
+    def crunch(self, seconds):
+        time.sleep(seconds)
+        return 'done'
+
+
+def current_endpoint():
+    frame, frames = sys._getframe(1), []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return endpoint_of(frames)
+
+
+class PageService(HTTPService):
+    @get('/page')
+    def page(self, request):
+        return Response(text=current_endpoint())
+
+
+@pytest.fixture
+def monitor(loop):
+    monitor = LoopMonitor(interval=0.01, slow_threshold=0.05, loop=loop)
+    monitor.start()
+    yield monitor
+    monitor.stop()
+
+
+def test_lag_is_sampled(loop, monitor):
+    loop.run_until_complete(asyncio.sleep(0.1))
+    stats = monitor.stats()
+    assert stats['samples'] >= 5
+    assert stats['slow_steps'] == 0 and stats['offenders'] == {}
+    assert set(stats['lag']) == {'min', 'max', 'average', 'p50', 'p90', 'p99', 'p999'}
+
+
+def test_blocking_callback_is_reported(loop, monitor):
+    def block():
+        time.sleep(0.2)
+
+    loop.call_later(0.02, block)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    stats = monitor.stats()
+    assert stats['slow_steps'] == 1
+    assert stats['offenders'] == {'block': 1}
+    assert stats['lag']['max'] >= 150
+
+
+def test_blocking_endpoint_is_attributed(loop, monitor):
+    bus = TCPBus(mock.Mock())
+    bus.tcp_host = SlowService('slow', '1')
+    bus.build_endpoint_table()
+    responses = []
+    loop.call_soon(bus.dispatch, {'type': 'request', 'name': 'slow', 'version': '1', 'entity': None, 'from': 'n1',
+                                  'endpoint': 'crunch', 'payload': {'request_id': 'r1', 'seconds': 0.2}},
+                   responses.append)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert responses[0]['payload']['result'] == 'done'
+    assert monitor.stats()['offenders'] == {'tcp crunch': 1}
+
+
+def test_only_handlers_run_by_trellio_are_endpoints(loop):
+    assert loop.run_until_complete(PageService('pages', '1').page(mock.Mock())).text == 'http page'
+    assert current_endpoint() is None
@@ -0,0 +1,42 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+from trellio import HTTPService
+from trellio.metrics import iter_metrics
+from trellio.utils.stats import Aggregator
+
+
+def test_exposition_covers_requests_latency_and_sources():
+    for time_taken in (3, 40, 40):
+        Aggregator.update_stats(endpoint='get_user', status='successful', time_taken=time_taken, server_type='tcp')
+    Aggregator.register_source('pools', lambda: {'node"1': {'size': 2, 'healthy': True}, 'nodes': 1})
+    lines = ''.join(iter_metrics()).splitlines()
+    labels = 'server_type="tcp",endpoint="get_user"'
+    assert 'trellio_requests_total{{{},status="successful"}} 3'.format(labels) in lines
+    assert 'trellio_request_duration_milliseconds_bucket{{{},le="5"}} 1'.format(labels) in lines
+    assert 'trellio_request_duration_milliseconds_bucket{{{},le="50"}} 3'.format(labels) in lines
+    assert 'trellio_request_duration_milliseconds_sum{{{}}} 83'.format(labels) in lines
+    assert 'trellio_pools_size{name="node\\"1"} 2' in lines and 'trellio_pools_nodes 1' in lines
+    assert not any('healthy' in line for line in lines)
+
+
+def test_metrics_route(loop):
+    service = HTTPService('metrics', '1', '127.0.0.1', 0)
+    app = web.Application(loop=loop)
+    app.router.add_get('/metrics', service.metrics)
+    server = loop.run_until_complete(loop.create_server(app.make_handler(), '127.0.0.1', 0))
+    port = server.sockets[0].getsockname()[1]
+
+    @asyncio.coroutine
+    def scrape():
+        with aiohttp.ClientSession(loop=loop) as session:
+            response = yield from session.get('http://127.0.0.1:{}/metrics'.format(port))
+            return response.headers['Content-Type'], (yield from response.text())
+
+    content_type, body = loop.run_until_complete(scrape())
+    assert content_type.startswith('text/plain; version=0.0.4')
+    assert '# TYPE trellio_in_flight_requests gauge' in body
+    server.close()
+    loop.run_until_complete(server.wait_closed())
@@ -0,0 +1,100 @@
+from unittest import mock
+
+from aiohttp.web import Response
+
+from trellio import TCPService, HTTPService, HTTPView, api, get
+from trellio.middleware import http_pipeline, api_pipeline
+
+
+class Auth:
+    middleware_info = 'auth'
+
+    def pre_request(self, service, request):
+        if 'token' not in request.GET:
+            raise ValueError('no token')
+
+    def pre_api(self, service, endpoint, params):
+        if params.get('user') == 'blocked':
+            return 'denied'
+
+
+class Audit:
+    def __init__(self):
+        self.seen = []
+
+    def post_api(self, service, endpoint, params, result):
+        self.seen.append((endpoint, result))
+
+
+class EchoService(TCPService):
+    @api
+    def echo(self, user):
+        return user
+
+
+class EchoHTTPService(HTTPService):
+    @get('/echo')
+    def echo(self, request):
+        return Response(text='echo')
+
+
+class EchoView(HTTPView):
+    @get('/echo')
+    def echo(self, request):
+        return Response(text='echo')
+
+
+def test_pipelines_skip_middlewares_without_hooks():
+    auth, audit = Auth(), Audit()
+    assert [m for m, _ in http_pipeline([auth, audit]).pre] == [auth]
+    assert not http_pipeline([audit])
+    pipeline = api_pipeline([auth, audit])
+    assert [m for m, _ in pipeline.pre] == [auth] and [m for m, _ in pipeline.post] == [audit]
+
+
+def test_api_pipeline(loop):
+    audit = Audit()
+    service = EchoService('echo', '1')
+    service.api_pipeline = api_pipeline([Auth(), audit])
+
+    def call(user):
+        return loop.run_until_complete(service.echo(request_id='r', entity=None, from_id='n', user=user))
+
+    assert call('blocked')['payload']['result'] == 'denied'
+    assert call('alice')['payload']['result'] == 'alice'
+    assert audit.seen == [('echo', 'denied'), ('echo', 'alice')]
+
+
+def test_http_pipeline(loop):
+    service = EchoHTTPService('echo', '1', '127.0.0.1', 0)
+    service.middlewares = [Auth()]
+    response = loop.run_until_complete(service.echo(mock.Mock(GET={})))
+    assert response.status == 400 and b'auth' in response.body
+    assert loop.run_until_complete(service.echo(mock.Mock(GET={'token': 't'}))).text == 'echo'
+
+
+def test_http_pipeline_follows_view_middlewares(loop):
+    view = EchoView()
+    assert loop.run_until_complete(view.echo(mock.Mock(GET={}))).text == 'echo'
+    view.middlewares = [Auth()]
+    assert loop.run_until_complete(view.echo(mock.Mock(GET={}))).status == 400
+    view.middlewares = []
+    assert loop.run_until_complete(view.echo(mock.Mock(GET={}))).text == 'echo'
+
+
+class AuthedService(EchoService):
+    middlewares = [Auth()]
+
+
+def test_middlewares_are_compiled_when_set(loop):
+    audit = Audit()
+    service = EchoService('echo', '1')
+    assert not service.api_pipeline
+    service.middlewares = [audit]
+    assert [m for m, _ in service.api_pipeline.post] == [audit] and not service.http_pipeline
+    loop.run_until_complete(service.echo(request_id='r', entity=None, from_id='n', user='alice'))
+    assert audit.seen == [('echo', 'alice')]
+
+    service = AuthedService('echo', '1')  # listed in the class body
+    result = loop.run_until_complete(service.echo(request_id='r', entity=None, from_id='n', user='blocked'))
+    assert result['payload']['result'] == 'denied'
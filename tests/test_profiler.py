@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from trellio import HTTPService, TCPService, api
+from trellio.bus import TCPBus
+from trellio.profiler import SamplingProfiler
+
+
+class ProfiledService(TCPService):
+    def __init__(self, profiler):
+        super(ProfiledService, self).__init__('profiled', '1')
+        self.profiler = profiler
+
+    @api
+    def work(self):
+        self.profiler.sample()
+        return 'done'
+
+
+def spin(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_samples_carry_the_endpoint_served(loop):
+    profiler = SamplingProfiler()
+    bus = TCPBus(mock.Mock())
+    bus.tcp_host = ProfiledService(profiler)
+    bus.build_endpoint_table()
+    responses = []
+    bus.dispatch({'type': 'request', 'name': 'profiled', 'version': '1', 'entity': None, 'from': 'n1',
+                  'endpoint': 'work', 'payload': {'request_id': 'r1'}}, responses.append)
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert responses[0]['payload']['result'] == 'done'
+    stacks = profiler.collapsed().splitlines()
+    assert profiler.samples == 1
+    assert any(';[tcp work];' in line and ';work (' in line for line in stacks)
+
+
+@pytest.fixture
+def server(loop):
+    app = web.Application(loop=loop)
+    app.router.add_get('/_profile', HTTPService('profiled', '1', '127.0.0.1', 0, admin_token='secret').profile)
+    server = loop.run_until_complete(loop.create_server(app.make_handler(), '127.0.0.1', 0))
+    yield 'http://127.0.0.1:{}/_profile'.format(server.sockets[0].getsockname()[1])
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+
+
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def fetch(loop, *urls, headers=ADMIN):
+    @asyncio.coroutine
+    def get(session, url):
+        response = yield from session.get(url, headers=headers)
+        return response.status, (yield from response.text())
+
+    @asyncio.coroutine
+    def get_all():
+        with aiohttp.ClientSession(loop=loop) as session:
+            return (yield from asyncio.gather(*(get(session, url) for url in urls), loop=loop))
+
+    return loop.run_until_complete(get_all())
+
+
+def test_profile_route_returns_collapsed_stacks(loop, server):
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,), name='spinner')
+    thread.start()
+    try:
+        responses = dict(fetch(loop, server + '?seconds=0.2', server + '?seconds=0.2'))
+    finally:
+        stop.set()
+        thread.join()
+    assert sorted(responses) == [200, 409]  # one profile at a time
+    body = responses[200]
+    stacks = [line.rsplit(' ', 1) for line in body.splitlines()]
+    assert any(stack.split(';')[1] == 'spinner' and 'spin (' in stack for stack, _ in stacks)
+    assert all(int(count) > 0 for _, count in stacks)
+
+
+def test_profile_route_checks_its_arguments(loop, server):
+    assert [status for status, _ in fetch(loop, server + '?seconds=0', server + '?seconds=x',
+                                          server + '?seconds=1000')] == [400, 400, 400]
+
+
+def test_profile_route_is_admin_only(loop, server):
+    assert fetch(loop, server + '?seconds=0.01', headers=None)[0][0] == 403  # loopback alone is not enough
+    assert fetch(loop, server + '?seconds=0.01', headers={'X-Admin-Token': 'guess'})[0][0] == 403
+    assert fetch(loop, server + '?seconds=0.01', headers={'X-Admin-Token': 'sécret'})[0][0] == 403
+    assert fetch(loop, server + '?seconds=0.01')[0][0] == 200
+
+
+def test_loopback_is_trusted_only_when_asked_to():
+    def request(host):
+        transport = mock.Mock(get_extra_info=mock.Mock(return_value=(host, 4242)))
+        return mock.Mock(headers={}, transport=transport)
+
+    assert not HTTPService('profiled', '1', admin_token='secret').is_admin(request('127.0.0.1'))
+    trusting = HTTPService('profiled', '1', trust_loopback=True)
+    assert trusting.is_admin(request('127.0.0.1')) and trusting.is_admin(request('::1'))
+    assert not trusting.is_admin(request('10.0.0.1'))
@@ -0,0 +1,39 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from trellio.pubsub import PubSub
+
+
+class Published(Exception):
+    pass
+
+
+def connected_pubsub(*published):
+    subscriber = mock.Mock(subscribe=asyncio.coroutine(lambda channels: None),
+                           next_published=mock.Mock(side_effect=[asyncio.coroutine(lambda: each)()
+                                                                 for each in published] + [Published()]))
+    connection = mock.Mock(publish=mock.Mock(side_effect=asyncio.coroutine(lambda channel, payload: None)),
+                           start_subscribe=asyncio.coroutine(lambda: subscriber))
+    pubsub = PubSub('127.0.0.1', 6379)
+    pubsub._conn = connection
+    pubsub._get_conn = asyncio.coroutine(lambda: connection)
+    return pubsub, connection
+
+
+def test_str_payloads_are_published_utf8_encoded(loop):
+    pubsub, connection = connected_pubsub()
+    assert loop.run_until_complete(pubsub.publish('svc/1/event', 'é'))
+    assert loop.run_until_complete(pubsub.publish('svc/1/event', b'\x00'))
+    assert [call[0] for call in connection.publish.call_args_list] == [(b'svc/1/event', 'é'.encode()),
+                                                                       (b'svc/1/event', b'\x00')]
+
+
+@pytest.mark.parametrize('raw, payload', [(False, 'é'), (True, 'é'.encode())])
+def test_handlers_get_str_payloads_unless_raw(loop, raw, payload):
+    pubsub, _ = connected_pubsub(mock.Mock(channel=b'svc/1/event', value='é'.encode()))
+    handler = mock.Mock()
+    with pytest.raises(Published):
+        loop.run_until_complete(pubsub.subscribe(['svc/1/event'], handler, raw=raw))
+    handler.assert_called_once_with('svc/1/event', payload)
@@ -0,0 +1,49 @@
+import asyncio
+from unittest import mock
+
+from trellio import TCPServiceClient, request
+
+
+class LookupClient(TCPServiceClient):
+    def __init__(self):
+        super(LookupClient, self).__init__('lookup', '1')
+
+    @request(coalesce=True)
+    def get_user(self, user_id):
+        return locals()
+
+    @request(cache_ttl=10)
+    def get_config(self, name):
+        return locals()
+
+
+def respond(client, packet, result):
+    client._process_response({'payload': {'request_id': packet['payload']['request_id'], 'result': result}})
+
+
+def test_concurrent_identical_requests_share_one_request(loop):
+    client = LookupClient()
+    client.tcp_bus = mock.Mock(local_bus=mock.Mock(return_value=None))
+    futures = [client.get_user(1), client.get_user(1), client.get_user(2)]
+    assert client.tcp_bus.send.call_count == 2
+    futures[0].cancel()
+    respond(client, client.tcp_bus.send.call_args_list[0][0][0], 'one')
+    respond(client, client.tcp_bus.send.call_args_list[1][0][0], 'two')
+    assert loop.run_until_complete(asyncio.gather(*futures[1:])) == ['one', 'two']
+    assert not client._in_flight
+    client.get_user(1)
+    assert client.tcp_bus.send.call_count == 3
+
+
+def test_successful_responses_are_cached(loop):
+    client = LookupClient()
+    client.tcp_bus = mock.Mock(local_bus=mock.Mock(return_value=None))
+    future = client.get_config('a')
+    respond(client, client.tcp_bus.send.call_args[0][0], {'value': 1})
+    assert loop.run_until_complete(future) == {'value': 1}
+    assert loop.run_until_complete(client.get_config('a')) == {'value': 1}
+    assert client.tcp_bus.send.call_count == 1
+    client._response_caches['get_config'].invalidate()
+    client.get_config('a')
+    assert client.tcp_bus.send.call_count == 2
+    assert client.response_cache_stats()['get_config']['hits'] == 1
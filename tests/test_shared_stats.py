@@ -0,0 +1,57 @@
+import os
+
+from trellio.utils.shared_stats import SERIES_WORDS, WORD, SharedStats
+
+
+def test_workers_stats_are_merged_on_read():
+    shared = SharedStats(workers=2, series=4)
+    pid = os.fork()
+    if pid == 0:
+        shared.attach(1)
+        shared.update('tcp', 'get_user', 'successful', 10, True)
+        shared.update('http', 'home', 200, 500, True)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    shared.attach(0)
+    shared.update('tcp', 'get_user', 'successful', 30, True)
+    shared.update('tcp', 'get_user', 'timeout', 1000, False)
+
+    tree = shared.stat_tree().to_dict()
+    assert (tree['count'], tree['success_count'], tree['max']) == (4, 3, 1000)
+    endpoint = tree['sub']['tcp']['sub']['get_user']
+    assert (endpoint['count'], endpoint['min'], endpoint['p50']) == (3, 10, 30)
+    assert endpoint['sub']['successful']['count'] == 2
+    assert tree['sub']['http']['sub']['home']['sub'][200]['p99'] == 500
+
+
+def test_restarted_worker_keeps_its_series():
+    shared = SharedStats(workers=1, series=2)
+    shared.attach(0)
+    shared.update('tcp', 'a', 'successful', 1, True)
+    shared.attach(0)  # as a worker started in place of a dead one does
+    shared.update('tcp', 'a', 'successful', 1, True)
+    shared.update('tcp', 'b', 'successful', 1, True)
+    shared.update('tcp', 'c', 'successful', 1, True)
+    tree = shared.stat_tree().to_dict()
+    assert tree['sub']['tcp']['sub']['a']['count'] == 2 and 'c' not in tree['sub']['tcp']['sub']
+    assert shared.stats()['dropped'] == 1
+
+
+def test_dropped_keys_leave_no_hole():
+    shared = SharedStats(workers=1, series=4)
+    shared.attach(0)
+    for endpoint in ('a', 'x' * 200, 'b'):
+        shared.update('tcp', endpoint, 'successful', 1, True)
+    assert sorted(shared.stat_tree().to_dict()['sub']['tcp']['sub']) == ['a', 'b']
+    assert shared.stats()['series'] == 2 and shared.stats()['dropped'] == 1
+    shared.attach(0)
+    shared.update('tcp', 'c', 'successful', 1, True)
+    assert sorted(shared.stat_tree().to_dict()['sub']['tcp']['sub']) == ['a', 'b', 'c']
+
+
+def test_keys_being_written_are_skipped():
+    shared = SharedStats(workers=1, series=2)
+    shared.attach(0)
+    shared.update('tcp', 'a', 'successful', 1, True)
+    shared._mmap[SERIES_WORDS * WORD:SERIES_WORDS * WORD + 5] = b'["tcp'  # a key cut short
+    assert list(shared.stat_tree().to_dict()['sub']['tcp']['sub']) == ['a']
@@ -0,0 +1,115 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from trellio import TCPServiceClient, api, TCPService
+from trellio.timing_wheel import TimingWheel, Deadline, get_wheel
+
+
+class FakeLoop:
+    def __init__(self):
+        self.now = 0
+        self.call_at = mock.Mock()
+
+    def time(self):
+        return self.now
+
+    def run_until(self, now, wheel):
+        while self.now < now:
+            self.now = round(self.now + 0.1, 1)
+            wheel._advance()
+
+
+def test_timers_fire_in_order_without_firing_early():
+    loop = FakeLoop()
+    wheel = TimingWheel(tick=0.1, slots=8, loop=loop)
+    fired = []
+    for delay in (0.35, 2.0, 0.05):
+        wheel.call_later(delay, lambda delay=delay: fired.append((delay, loop.now)))
+    loop.run_until(3, wheel)
+
+    assert [delay for delay, _ in fired] == [0.05, 0.35, 2.0]
+    assert all(delay <= at <= delay + 0.1 for delay, at in fired)
+    assert len(wheel) == 0
+
+
+def test_callbacks_rearming_themselves_fire_within_a_tick():
+    loop = FakeLoop()
+    wheel = TimingWheel(tick=0.1, slots=8, loop=loop)
+    fired = []
+
+    def rearm():
+        fired.append(loop.now)
+        if len(fired) < 3:
+            wheel.call_later(0.05, rearm)
+
+    wheel.call_later(0.05, rearm)
+    loop.run_until(1, wheel)
+
+    assert len(fired) == 3
+    assert all(0.05 <= later - at <= 0.2 for at, later in zip(fired, fired[1:]))  # not a revolution later
+    assert len(wheel) == 0
+
+
+def test_callbacks_rearming_themselves_a_revolution_later_fire_in_time():
+    loop = FakeLoop()
+    wheel = TimingWheel(tick=0.1, slots=8, loop=loop)
+    fired = []
+
+    def rearm():
+        fired.append(loop.now)
+        if len(fired) < 3:
+            wheel.call_later(0.8, rearm)  # lands in the slot being expired
+
+    wheel.call_later(0.05, rearm)
+    loop.run_until(3, wheel)
+
+    assert len(fired) == 3
+    assert all(0.8 <= later - at <= 1.0 for at, later in zip(fired, fired[1:]))  # not two revolutions later
+
+
+def test_cancel():
+    loop = FakeLoop()
+    wheel = TimingWheel(tick=0.1, slots=8, loop=loop)
+    callback = mock.Mock()
+    timer = wheel.call_later(1, callback)
+    timer.cancel()
+    loop.run_until(2, wheel)
+
+    assert not callback.called and len(wheel) == 0
+    assert loop.call_at.return_value.cancel.called
+
+
+class TimeoutClient(TCPServiceClient):
+    def __init__(self):
+        super(TimeoutClient, self).__init__('timeout_test', '1')
+
+
+class SlowService(TCPService):
+    @api(timeout=0.1)
+    def slow(self):
+        yield from asyncio.sleep(10)
+
+
+def test_api_deadline(loop):
+    service = SlowService('slow', '1')
+    response = loop.run_until_complete(service.slow(request_id='r1', entity=None, from_id='n1'))
+
+    assert response['payload']['failed']
+    with pytest.raises(RuntimeError):
+        with Deadline(1, loop=loop):
+            pass
+
+
+def test_timed_out_request_leaves_pending_requests(loop):
+    client = TimeoutClient()
+    client.tcp_bus = mock.Mock()
+    future = client._send_request(None, 'echo', None, {'request_id': 'r1'}, timeout=0.1)
+    assert 'r1' in client._pending_requests
+
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(future)
+    loop.run_until_complete(asyncio.sleep(0, loop=loop))
+    assert 'r1' not in client._pending_requests and len(get_wheel(loop)) == 0
+    client._process_response({'type': 'response', 'payload': {'request_id': 'r1', 'result': 1}})
@@ -0,0 +1,124 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from aiohttp.web import Response
+
+from trellio import HTTPService, TCPService, TCPServiceClient, api, get, request
+from trellio.bus import TCPBus
+from trellio.jsonprotocol import TrellioProtocol
+from trellio.tracing import MemorySink, Span, configure_tracing, context_from_headers, current_span
+
+
+class BackClient(TCPServiceClient):
+    def __init__(self):
+        super(BackClient, self).__init__('back', '1')
+
+    @request
+    def lookup(self, key):
+        return locals()
+
+
+class BackService(TCPService):
+    @api
+    def lookup(self, key):
+        return key.upper()
+
+
+class FrontService(TCPService):
+    @api
+    def handle(self, key):
+        result = yield from BackClient().lookup(key)
+        return result
+
+
+class PageService(HTTPService):
+    @get('/page')
+    def page(self, request):
+        return Response()
+
+
+@pytest.fixture
+def sink():
+    sink = MemorySink()
+    yield sink
+    configure_tracing()
+
+
+def make_bus(service):
+    bus = TCPBus(mock.Mock())
+    bus.tcp_host = service
+    bus.build_endpoint_table()
+    return bus
+
+
+def test_spans_follow_requests_across_services(loop, sink):
+    exporter = configure_tracing(sink)
+    front = make_bus(FrontService('front', '1'))
+    make_bus(BackService('back', '1'))  # the bus front's requests are handed to in this process
+    BackClient().tcp_bus = front
+    responses = []
+    front.dispatch({'type': 'request', 'name': 'front', 'version': '1', 'entity': None, 'from': 'n1',
+                    'endpoint': 'handle', 'payload': {'request_id': 'r1', 'key': 'a'}}, responses.append)
+    loop.run_until_complete(asyncio.sleep(0.01))
+    exporter.flush()
+
+    assert responses[0]['payload']['result'] == 'A'
+    spans = {span['name']: span for span in sink.spans}
+    root, client, served = spans['handle'], spans['back.lookup'], spans['lookup']
+    assert root['parent_id'] is None and client['parent_id'] == root['span_id']
+    assert served['parent_id'] == client['span_id']
+    assert root['trace_id'] == client['trace_id'] == served['trace_id']
+    assert set(served['timings']) == {'queue', 'handler'}
+
+
+def test_served_span_records_serialization(loop, sink):
+    exporter = configure_tracing(sink)
+    bus = make_bus(BackService('back', '1'))
+    protocol = TrellioProtocol(bus)
+    with mock.patch('asyncio.get_event_loop'):
+        protocol.connection_made(mock.Mock())
+    bus._request_receiver({'type': 'request', 'name': 'back', 'version': '1', 'entity': None, 'from': 'n1',
+                           'endpoint': 'lookup', 'payload': {'request_id': 'r1', 'key': 'a'}}, protocol)
+    loop.run_until_complete(asyncio.sleep(0.01))
+    exporter.flush()
+    assert sink.spans == []  # finished once the response is encoded
+
+    protocol._send_q.flush()
+    exporter.flush()
+    assert set(sink.spans[0]['timings']) == {'queue', 'handler', 'send_queue', 'serialization'}
+
+
+def test_spans_are_exported_in_batches_of_sampled_traces(loop, sink):
+    exporter = configure_tracing(sink, batch_size=2)
+    Span('a', 'server').finish()
+    assert not sink.spans and exporter.stats()['buffered'] == 1
+    Span('b', 'server').finish()
+    Span('c', 'server', sampled=False).finish()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert [span['name'] for span in sink.spans] == ['a', 'b']
+    assert exporter.stats() == {'buffered': 0, 'exported': 2, 'dropped': 0}
+
+
+def test_context_in_http_headers(sink):
+    configure_tracing(sink)
+    span = Span('a', 'client', sampled=False)
+    assert context_from_headers(span.headers()) == {'trace_id': span.trace_id, 'span_id': span.span_id,
+                                                    'sampled': False}
+    assert context_from_headers({}) is None
+
+
+def test_http_span_is_forgotten_after_its_request(loop, sink):
+    exporter = configure_tracing(sink)
+    service = PageService('page', '1', '127.0.0.1', 0)
+
+    @asyncio.coroutine
+    def keep_alive_connection():
+        for _ in range(2):
+            yield from service.page(mock.Mock(headers={}, GET={}))
+        return current_span()
+
+    assert loop.run_until_complete(keep_alive_connection()) is None
+    exporter.flush()
+    assert [span['name'] for span in sink.spans] == ['page', 'page']
@@ -18,7 +18,7 @@ except ImportError:
     logger.warning('uvloop is not install, event loop will be set to default asyncio loop')
 
 from .conf_manager import *
-from .exceptions import RequestException, TrellioServiceError, TrellioServiceException  # noqa
+from .exceptions import RequestException, ServiceOverloaded, TrellioServiceError, TrellioServiceException  # noqa
 from .host import Host  # noqa
 from .management import *
 from .pubsub import Publisher, Subscriber
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from collections import deque
+
+DEFAULT_MAX_QUEUE = 100  # requests waiting for a slot when a limiter is given only a concurrency limit
+
+
+class Limiter:
+    """
+    Concurrency limit with a bounded wait queue for requests to a service or an endpoint. Requests take a slot or
+    a place in the queue with admit() as they arrive, so that they are rejected right away once the queue is full,
+    and give it back with leave() once done.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue=None, loop=None):
+        self._name = name
+        self._max_concurrency = max_concurrency
+        self._max_queue = DEFAULT_MAX_QUEUE if max_queue is None else max_queue
+        self._loop = loop
+        self._active = 0
+        self._waiters = deque()
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._queue_time = 0
+        self._max_queue_time = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    @property
+    def max_queue(self):
+        return self._max_queue
+
+    def admit(self):
+        """
+        :return: a future done once the request holds a slot, None when the request is rejected
+        """
+        waiter = asyncio.Future(loop=self._loop)
+        if self._active < self._max_concurrency:
+            self._active += 1
+            waiter.set_result(None)
+        elif len(self._waiters) < self._max_queue:
+            self._queued += 1
+            self._waiters.append((waiter, time.monotonic()))
+        else:
+            self._rejected += 1
+            return None
+        self._admitted += 1
+        return waiter
+
+    def leave(self, waiter):
+        """
+        Gives back the slot or the place in the queue taken by admit()
+        """
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters = deque(each for each in self._waiters if each[0] is not waiter)
+            return
+        while self._waiters:
+            next_waiter, queued_at = self._waiters.popleft()
+            if not next_waiter.done():
+                queue_time = time.monotonic() - queued_at
+                self._queue_time += queue_time
+                self._max_queue_time = max(self._max_queue_time, queue_time)
+                next_waiter.set_result(None)  # the slot is handed over
+                return
+        self._active -= 1
+
+    def stats(self):
+        return {'active': self._active, 'queue_depth': len(self._waiters), 'max_concurrency': self._max_concurrency,
+                'max_queue': self._max_queue, 'admitted': self._admitted, 'queued': self._queued,
+                'rejected': self._rejected,
+                'average_queue_time': int(self._queue_time / self._queued * 1000) if self._queued else 0,
+                'max_queue_time': int(self._max_queue_time * 1000)}
+
+
+def admit(limiters):
+    """
+    Admits a request to every limiter or to none of them
+    :return: list of (limiter, waiter) tuples to pass to run_admitted, None when a limiter rejects the request
+    """
+    admissions = []
+    for limiter in limiters:
+        waiter = limiter.admit()
+        if waiter is None:
+            for admitted, admitted_waiter in admissions:
+                admitted.leave(admitted_waiter)
+            return None
+        admissions.append((limiter, waiter))
+    return admissions
+
+
+@asyncio.coroutine
+def run_admitted(admissions, coro):
+    """
+    Runs coro once it holds a slot of every limiter it was admitted to
+    """
+    try:
+        for _, waiter in admissions:
+            if not waiter.done():
+                yield from waiter
+        return (yield from coro)
+    finally:
+        coro.close()  # no-op once it has run, avoids a never awaited warning when cancelled while queued
+        for limiter, waiter in admissions:
+            limiter.leave(waiter)
@@ -0,0 +1,118 @@
+"""
+LRU caches with a ttl for results of @api endpoints marked with cache_ttl, one per endpoint function, named
+module.Class.endpoint.
+
+Handlers and Subscriber callbacks drop stale results with invalidate(endpoint, **params), or every result of an
+endpoint with invalidate(endpoint), endpoint being the full name or its end, like Class.endpoint or endpoint, in
+which case the caches of every endpoint it ends are invalidated. TCPServiceClient uses the same cache for its
+short lived response caches.
+
+Results are copied into the cache and out of it on every hit unless immutable, so that callers mutating a result,
+which requests served in process get as it is, can't change what the cache answers others with.
+"""
+import json
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+from .utils.jsonencoder import TrellioEncoder
+from .utils.stats import Aggregator
+
+DEFAULT_CACHE_SIZE = 1024
+
+MISSING = object()
+IMMUTABLE = (str, bytes, int, float, bool, type(None))
+
+_caches = []
+
+
+def make_key(params: dict):
+    """
+    :return: a hashable key equal for equal params whatever their order, telling apart equal values of different
+             types like 1, 1.0 and True
+    """
+    key = tuple(sorted((name, type(value), value) for name, value in params.items()))
+    try:
+        hash(key)
+    except TypeError:  # lists or dicts among the params
+        key = json.dumps(params, sort_keys=True, cls=TrellioEncoder)
+    return key
+
+
+class APICache:
+    def __init__(self, endpoint, ttl, size=DEFAULT_CACHE_SIZE):
+        self._endpoint = endpoint
+        self._ttl = ttl
+        self._size = size
+        self._entries = OrderedDict()  # key -> (expiry, result), least recently used first
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def endpoint(self):
+        return self._endpoint
+
+    def get(self, key):
+        """
+        :param key: see make_key
+        :return: the cached result, MISSING if there is none or it expired
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._hits += 1
+                result = entry[1]
+                return result if isinstance(result, IMMUTABLE) else deepcopy(result)
+            del self._entries[key]
+        self._misses += 1
+        return MISSING
+
+    def put(self, key, result):
+        if not isinstance(result, IMMUTABLE):
+            result = deepcopy(result)
+        self._entries[key] = (time.monotonic() + self._ttl, result)
+        if len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        return {'size': len(self._entries), 'max_size': self._size, 'ttl': self._ttl, 'hits': self._hits,
+                'misses': self._misses, 'evictions': self._evictions}
+
+
+def get_cache(endpoint, ttl, size=None) -> APICache:
+    """
+    :param endpoint: full name of the endpoint function, module.Class.endpoint
+    :return: a new cache for the endpoint, registered for invalidation and stats
+    """
+    if not _caches:
+        Aggregator.register_source('api_cache', cache_stats)
+    cache = APICache(endpoint, ttl, size or DEFAULT_CACHE_SIZE)
+    _caches.append(cache)
+    return cache
+
+
+def _matches(cache, endpoint):
+    return cache.endpoint == endpoint or cache.endpoint.endswith('.' + endpoint)
+
+
+def invalidate(endpoint, **params):
+    """
+    Drops the cached result of endpoint for params, or all its cached results when no params are given
+    """
+    key = make_key(params) if params else None
+    for cache in _caches:
+        if _matches(cache, endpoint):
+            cache.invalidate(key)
+
+
+def cache_stats():
+    return {cache.endpoint: cache.stats() for cache in _caches}
@@ -0,0 +1,109 @@
+import random
+import time
+from collections import defaultdict
+
+EWMA_DECAY = 0.3  # weight of the latest latency sample in a node's moving average
+
+
+class LoadTracker:
+    """
+    Keeps outstanding requests and an exponentially weighted moving average of latency for every node,
+    fed by the buses and read by balancers
+    """
+
+    def __init__(self):
+        self._outstanding = defaultdict(int)
+        self._latency = {}
+
+    def outstanding(self, node_id):
+        return self._outstanding.get(node_id, 0)
+
+    def latency(self, node_id):
+        """
+        :return: moving average latency in seconds, None for a node without completed requests
+        """
+        return self._latency.get(node_id)
+
+    def start(self, node_id):
+        self._outstanding[node_id] += 1
+        return time.monotonic()
+
+    def finish(self, node_id, start_time):
+        self._outstanding[node_id] = max(self._outstanding[node_id] - 1, 0)
+        sample = time.monotonic() - start_time
+        average = self._latency.get(node_id)
+        self._latency[node_id] = sample if average is None else average + EWMA_DECAY * (sample - average)
+
+    def track(self, node_id, future):
+        """
+        Counts a request as outstanding on node_id till its future is done
+        """
+        start_time = self.start(node_id)
+        future.add_done_callback(lambda _: self.finish(node_id, start_time))
+
+    def forget(self, node_id):
+        self._outstanding.pop(node_id, None)
+        self._latency.pop(node_id, None)
+
+
+class Balancer:
+    """
+    Strategy picking the node a request is sent to, service clients take an instance as their balancer
+    """
+
+    def choose(self, candidates: list, load: LoadTracker):
+        """
+        :param candidates: non empty list of (host, port, node_id, service_type) tuples
+        :param load: tracker with outstanding requests and latencies of the nodes
+        :return: one of the candidates
+        """
+        raise NotImplementedError
+
+
+class RandomBalancer(Balancer):
+    def choose(self, candidates, load):
+        return random.choice(candidates)
+
+
+class RoundRobinBalancer(Balancer):
+    def __init__(self):
+        self._next = 0
+
+    def choose(self, candidates, load):
+        self._next += 1
+        return candidates[self._next % len(candidates)]
+
+
+class LeastOutstandingBalancer(Balancer):
+    def choose(self, candidates, load):
+        offset = random.randrange(len(candidates))  # don't always favour the first node on ties
+        ordered = candidates[offset:] + candidates[:offset]
+        return min(ordered, key=lambda node: load.outstanding(node[2]))
+
+
+class PowerOfTwoBalancer(Balancer):
+    """
+    Compares two random nodes and picks the one with fewer outstanding requests
+    """
+
+    def _cost(self, node, load):
+        return load.outstanding(node[2])
+
+    def choose(self, candidates, load):
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if self._cost(first, load) <= self._cost(second, load) else second
+
+
+class EWMALatencyBalancer(PowerOfTwoBalancer):
+    """
+    Power of two choices on latency average times outstanding requests, nodes without latency samples yet
+    are preferred so that they get some
+    """
+
+    def _cost(self, node, load):
+        latency = load.latency(node[2])
+        if latency is None:
+            return 0
+        return latency * (load.outstanding(node[2]) + 1)
@@ -2,19 +2,29 @@ import asyncio
 import logging
 from asyncio.coroutines import iscoroutine, coroutine
 from functools import partial
+from types import MappingProxyType
 
 import aiohttp
 from again.utils import unique_hex
 from retrial.retrial.retry import retry
 
+from .admission import Limiter, admit, run_admitted
+from .connection_pool import ConnectionPool
 from .exceptions import ClientNotFoundError, ClientDisconnected
 from .packet import ControlPacket, MessagePacket
 from .protocol_factory import get_trellio_protocol
 from .services import TCPServiceClient, HTTPServiceClient
+from .tracing import CLIENT, SERVER, start_span, set_current_span, tracing_enabled
+from .utils.helpers import host_identity
+from .utils.stats import Aggregator
 
 HTTP = 'http'
 TCP = 'tcp'
 
+DEFAULT_HTTP_LIMIT_PER_NODE = 32
+DEFAULT_HTTP_KEEPALIVE_TIMEOUT = 30
+DEFAULT_HTTP_TIMEOUT = 300
+
 
 def _retry_for_pub(result):
     return not result
@@ -25,16 +35,55 @@ def _retry_for_exception(_):
 
 
 class HTTPBus:
-    def __init__(self, registry_client):
+    """
+    Sends requests of HTTPServiceClients through a long lived session, so that connections to every node are kept
+    alive and reused rather than opened for each request
+    """
+
+    def __init__(self, registry_client, limit_per_node=DEFAULT_HTTP_LIMIT_PER_NODE,
+                 keepalive_timeout=DEFAULT_HTTP_KEEPALIVE_TIMEOUT, conn_timeout=None, read_timeout=None,
+                 timeout=DEFAULT_HTTP_TIMEOUT):
+        """
+        :param limit_per_node: connections open at once to a node, further requests wait for one to be released
+        :param keepalive_timeout: seconds an idle connection is kept open
+        :param conn_timeout: seconds to wait for a connection to be established
+        :param read_timeout: seconds to wait for data from a node
+        :param timeout: seconds a request may take altogether
+        """
         self._registry_client = registry_client
-
-    def send_http_request(self, app: str, service: str, version: str, method: str, entity: str, params: dict):
+        self._limit_per_node = limit_per_node
+        self._keepalive_timeout = keepalive_timeout
+        self._conn_timeout = conn_timeout
+        self._read_timeout = read_timeout
+        self._timeout = timeout
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self._limit_per_node, use_dns_cache=True,
+                                             keepalive_timeout=self._keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, conn_timeout=self._conn_timeout,
+                                                  read_timeout=self._read_timeout)
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def send_http_request(self, app: str, service: str, version: str, method: str, entity: str, params: dict,
+                          balancer=None):
         """
         A convenience method that allows you to send a well formatted http request to another service
         """
-        host, port, node_id, service_type = self._registry_client.resolve(service, version, entity, HTTP)
+        node = self._registry_client.resolve(service, version, entity, HTTP, balancer=balancer)
+        if not node:
+            raise ClientNotFoundError()
+        host, port, node_id, service_type = node
 
-        url = 'http://{}:{}{}'.format(host, port, params.pop('path'))
+        path = params.pop('path')
+        url = 'http://{}:{}{}'.format(host, port, path)
 
         http_keys = ['data', 'headers', 'cookies', 'auth', 'allow_redirects', 'compress', 'chunked']
         kwargs = {k: params[k] for k in http_keys if k in params}
@@ -47,20 +96,40 @@ class HTTPBus:
         query_params['version'] = version
         query_params['service'] = service
 
-        response = yield from aiohttp.request(method, url, params=query_params, **kwargs)
+        span = start_span('{} {}'.format(method.upper(), path), CLIENT)
+        if span is not None:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **span.headers())
+        start_time = self._registry_client.load.start(node_id)
+        error = None
+        try:
+            response = yield from self.session.request(method, url, params=query_params, timeout=self._timeout,
+                                                       **kwargs)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._registry_client.load.finish(node_id, start_time)
+            if span is not None:
+                span.finish(error)
         return response
 
 
 class TCPBus:
+    _local_buses = {}  # (name, version) -> bus of the tcp service hosted in this process
+
     def __init__(self, registry_client):
         registry_client.conn_handler = self
         self._registry_client = registry_client
-        self._client_protocols = {}
+        self._client_pools = {}
         self._pingers = {}
         self._node_clients = {}
         self._service_clients = []
+        self._balancers = {}
         self.tcp_host = None
         self.http_host = None
+        self.http_bus = None
+        self._endpoints = MappingProxyType({})
+        self._limiters = MappingProxyType({})
         self._host_id = unique_hex()
         self._ronin = False
         self._registered = False
@@ -69,6 +138,8 @@ class TCPBus:
     def _create_service_clients(self):
         futures = []
         for sc in self._service_clients:
+            if not isinstance(sc, TCPServiceClient):  # an http client of the same service must not get its nodes
+                continue
             for host, port, node_id, service_type in self._registry_client.get_all_addresses(*sc.properties):
                 if service_type == 'tcp':
                     self._node_clients[node_id] = sc
@@ -81,13 +152,27 @@ class TCPBus:
         for client in clients:
             if isinstance(client, (TCPServiceClient, HTTPServiceClient)):
                 client.tcp_bus = self
+            if isinstance(client, HTTPServiceClient):
+                client.http_bus = self.http_bus
         self._service_clients = clients
+        self._balancers = {}  # keyed by transport too, a service may have both a tcp and an http client
+        for client in clients:
+            if isinstance(client, TCPServiceClient):
+                self._balancers[(TCP,) + client.properties] = client.balancer
+            elif isinstance(client, HTTPServiceClient):
+                self._balancers[(HTTP,) + client.properties] = client.balancer
+        Aggregator.register_source('tcp_pools', self.pool_stats)
+        Aggregator.register_source('registry_cache', self._registry_client.cache_stats)
         yield from self._registry_client.connect()
 
     def register(self):
         if self.tcp_host:
+            transport = None
+            if self.tcp_host.unix_path:
+                transport = {'unix_path': self.tcp_host.unix_path, 'host_id': host_identity()}
             self._registry_client.register(self.tcp_host.host, self.tcp_host.port, self.tcp_host.name,
-                                           self.tcp_host.version, self.tcp_host.node_id, self.tcp_host.clients, 'tcp')
+                                           self.tcp_host.version, self.tcp_host.node_id, self.tcp_host.clients, 'tcp',
+                                           transport)
         if self.http_host:
             self._registry_client.register(self.http_host.host, self.http_host.port, self.http_host.name,
                                            self.http_host.version, self.http_host.node_id, self.http_host.clients,
@@ -99,8 +184,9 @@ class TCPBus:
             self._registered = True
 
     def new_instance(self, service, version, host, port, node_id, type):
-        sc = next(sc for sc in self._service_clients if sc.name == service and sc.version == version)
         if type == 'tcp':
+            sc = next(sc for sc in self._service_clients
+                      if isinstance(sc, TCPServiceClient) and sc.name == service and sc.version == version)
             self._node_clients[node_id] = sc
             asyncio.ensure_future(self._connect_to_client(host, node_id, port, type, sc))
 
@@ -115,17 +201,24 @@ class TCPBus:
     # @retry((ClientDisconnected, ClientNotFoundError))
     @retry(should_retry_for_result=lambda x: not x, should_retry_for_exception=lambda x: True, timeout=None,
            max_attempts=5, multiplier=2)
+    @coroutine
     def _request_sender(self, packet: dict):
         """
         Sends a request to a server from a ServiceClient
         auto dispatch method called from self.send()
         """
         node_id = self._get_node_id_for_packet(packet)
-        client_protocol = self._client_protocols.get(node_id)
+        pool = self._client_pools.get(node_id)
+        client_protocol = pool.acquire() if pool else None
         if node_id and client_protocol:
+            yield from client_protocol.drain()  # wait while the server isn't keeping up with our writes
             if client_protocol.is_connected():
                 packet['to'] = node_id
                 client_protocol.send(packet)
+                future = self._node_clients[node_id]._pending_requests.get(packet['payload']['request_id'])
+                if future is not None and not future.done():
+                    pool.track(client_protocol, future)
+                    self._registry_client.load.track(node_id, future)
                 return True
             else:
                 self._logger.error('Client protocol is not connected for packet %s', packet)
@@ -133,26 +226,37 @@ class TCPBus:
         else:
             # No node found to send request
             self._logger.error('Out of %s, Client Not found for packet %s, restarting server...',
-                               self._client_protocols.keys(), packet)
+                               self._client_pools.keys(), packet)
             raise ClientNotFoundError()
 
     def _connect_to_client(self, host, node_id, port, service_type, service_client):
-        future = asyncio.ensure_future(
-            asyncio.get_event_loop().create_connection(partial(get_trellio_protocol, service_client), host, port,
-                                                       ssl=service_client._ssl_context))
-        future.add_done_callback(
-            partial(self._service_client_connection_callback, self._node_clients[node_id], node_id, service_type))
-        return future
-
-    def _service_client_connection_callback(self, sc, node_id, service_type, future):
-        _, protocol = future.result()
-        # TODO : handle pinging
-        # if service_type == TCP:
-        #     pinger = Pinger(self, asyncio.get_event_loop())
-        #     self._pingers[node_id] = pinger
-        #     pinger.register_tcp_service(protocol, node_id)
-        #     asyncio.ensure_future(pinger.start_ping())
-        self._client_protocols[node_id] = protocol  # stores connection(sockets)
+        pool = self._client_pools.get(node_id)
+        if pool is None:
+            unix_path = self._registry_client.get_unix_path(node_id)
+            protocol_factory = partial(get_trellio_protocol, service_client, framing=service_client.framing,
+                                       codec=service_client.codec, peer=unix_path or (host, port))
+            if unix_path and not service_client.ssl_context:  # same host, skip the tcp stack
+                connect = partial(asyncio.get_event_loop().create_unix_connection, protocol_factory, unix_path)
+            else:
+                connect = partial(asyncio.get_event_loop().create_connection, protocol_factory, host, port,
+                                  ssl=service_client.ssl_context)
+            # TODO : handle pinging
+            pool = ConnectionPool(node_id, connect, service_client.min_connections, service_client.max_connections)
+            self._client_pools[node_id] = pool  # stores connections(sockets)
+        return pool.fill()
+
+    def remove_node(self, node_id):
+        """
+        Drops the connection pool of a node that deregistered, closing its connections
+        """
+        pool = self._client_pools.pop(node_id, None)
+        if pool is not None:
+            pool.close()
+        self._node_clients.pop(node_id, None)
+        self._pingers.pop(node_id, None)
+
+    def pool_stats(self):
+        return {node_id: pool.stats() for node_id, pool in self._client_pools.items()}
 
     @staticmethod
     def _create_json_service_name(app, service, version):
@@ -168,7 +272,8 @@ class TCPBus:
 
     def _get_node_id_for_packet(self, packet):
         service, version, entity = packet['name'], packet['version'], packet['entity']
-        node = self._registry_client.resolve(service, version, entity, TCP)
+        node = self._registry_client.resolve(service, version, entity, TCP,
+                                             balancer=self._balancers.get((TCP, service, version)))
         return node[2] if node else None
 
     def handle_ping_timeout(self, node_id):
@@ -178,7 +283,7 @@ class TCPBus:
         self._logger.info('service client props {}'.format(service_props))
         if service_props is not None:
             host, port, _node_id, _type = service_props
-            asyncio.ensure_future(self._connect_to_client(host, _node_id, port, _type))
+            asyncio.ensure_future(self._connect_to_client(host, _node_id, port, _type, self._node_clients[_node_id]))
 
     def receive(self, packet: dict, protocol, transport):
         if packet['type'] == 'ping':
@@ -194,34 +299,113 @@ class TCPBus:
             else:
                 self._logger.warning('wrongly routed packet: ', packet)
 
+    def build_endpoint_table(self):
+        """
+        Compiles the endpoint -> bound api table requests are dispatched from, Host calls it whenever a tcp service
+        or tcp views are attached. Apis of the service take precedence over views, earlier views over later ones.
+        Concurrency limits of the service and its apis are compiled along into per endpoint limiters.
+        """
+        endpoints = {}
+        limiters = {}
+        if self.tcp_host:
+            for handler in [self.tcp_host] + list(getattr(self.tcp_host, 'tcp_views', [])):
+                for name in dir(type(handler)):
+                    if name not in endpoints and getattr(getattr(type(handler), name, None), 'is_api', False):
+                        endpoints[name] = getattr(handler, name)
+            service_limiter = None
+            if getattr(self.tcp_host, 'max_concurrency', None):
+                service_limiter = Limiter('{}/{}'.format(self.tcp_host.name, self.tcp_host.version),
+                                          self.tcp_host.max_concurrency, self.tcp_host.max_queue)
+            for name, api_fn in endpoints.items():
+                endpoint_limiters = []
+                if getattr(api_fn, 'max_concurrency', None):
+                    endpoint_limiters.append(Limiter(name, api_fn.max_concurrency, api_fn.max_queue))
+                if service_limiter is not None:
+                    endpoint_limiters.append(service_limiter)
+                if endpoint_limiters:
+                    limiters[name] = tuple(endpoint_limiters)
+        self._endpoints = MappingProxyType(endpoints)
+        self._limiters = MappingProxyType(limiters)
+        if self.tcp_host:
+            TCPBus._local_buses[(self.tcp_host.name, self.tcp_host.version)] = self
+        if limiters:
+            Aggregator.register_source('admission', self.admission_stats)
+
+    def admission_stats(self):
+        return {limiter.name: limiter.stats() for limiters in self._limiters.values() for limiter in limiters}
+
+    def _send_error(self, packet, respond, error, **flags):
+        response = self.tcp_host._make_response_packet(request_id=packet['payload']['request_id'],
+                                                       from_id=packet['from'], entity=packet['entity'],
+                                                       result=None, error=error, failed=True)
+        response['payload'].update(flags)
+        respond(response)
+
     def _request_receiver(self, packet, protocol):
-        api_fn = None
-        try:
-            api_fn = getattr(self.tcp_host, packet['endpoint'])
-        except AttributeError:
-            pass
-        if not api_fn:
-            for view in self.tcp_host.tcp_views:
-                _api_fn = None
-                try:
-                    _api_fn = getattr(view, packet['endpoint'])
-                except AttributeError:
-                    pass
-                if _api_fn:
-                    api_fn = _api_fn
-                    break
-        if api_fn.is_api:
-            from_node_id = packet['from']
-            entity = packet['entity']
-            future = asyncio.ensure_future(api_fn(from_id=from_node_id, entity=entity, **packet['payload']))
-
-            def send_result(f):
-                result_packet = f.result()
-                protocol.send(result_packet)
-
-            future.add_done_callback(send_result)
-        else:
-            print('no api found for packet: ', packet)
+        self.dispatch(packet, protocol.send, encoded=True)
+        protocol.hold_reading()  # no more requests are read while the responses are not
+
+    def dispatch(self, packet, respond, encoded=False):
+        """
+        Runs the api a request packet is for and calls respond with the response packet
+
+        :param encoded: respond queues the packet on a connection and takes the span of the request too, to
+                        finish it once the packet is encoded
+        """
+        endpoint = packet['endpoint']
+        api_fn = self._endpoints.get(endpoint)
+        if api_fn is None:
+            self._logger.warning('No api found for endpoint %s', endpoint)
+            self._send_error(packet, respond, 'No api found for endpoint {}'.format(endpoint))
+            return
+        admissions = None
+        limiters = self._limiters.get(endpoint)
+        if limiters:
+            admissions = admit(limiters)
+            if admissions is None:
+                self._logger.warning('Rejecting request to overloaded endpoint %s', endpoint)
+                self._send_error(packet, respond, 'Service overloaded', overloaded=True)
+                return
+        span = start_span(endpoint, SERVER, packet.get('trace')) if tracing_enabled() else None
+        from_node_id = packet['from']
+        entity = packet['entity']
+        coro = api_fn(from_id=from_node_id, entity=entity, **packet['payload'])
+        future = asyncio.ensure_future(run_admitted(admissions, coro) if admissions else coro)
+        if span is not None:
+            set_current_span(span, future)
+
+        def send_result(f):
+            result_packet = f.result()
+            if span is None:
+                respond(result_packet)
+            elif encoded:
+                respond(result_packet, span)  # the send queue records the serialization and finishes the span
+            else:
+                respond(result_packet)
+                span.finish(span.error)
+
+        future.add_done_callback(send_result)
+
+    def local_bus(self, packet):
+        """
+        :return: the bus of the tcp service a request packet is for when that service is hosted in this process
+                 and should serve the request, None otherwise. Requests for an entity stay local only when the
+                 entity maps to the local node.
+        """
+        bus = self._local_buses.get((packet['name'], packet['version']))
+        if bus is not None and packet['entity'] is not None:
+            node = self._registry_client.resolve(packet['name'], packet['version'], packet['entity'], TCP)
+            if node is not None and node[2] != bus.tcp_host.node_id:
+                return None
+        return bus
+
+    def send_local(self, bus, packet, respond):
+        """
+        Hands a request packet straight to the bus of a service hosted in this process, skipping serialization
+        and the socket
+        """
+        packet['from'] = self._host_id
+        bus.dispatch(packet, respond)
 
     def _handle_publish(self, packet, protocol):
         service, version, endpoint, payload, publish_id = (packet['name'], packet['version'], packet['endpoint'],
@@ -0,0 +1,116 @@
+"""
+Registry of codecs used to serialize packets on the bus and payloads on pubsub channels.
+
+json is always available and is what the json stream framing speaks. Binary codecs are only used over
+length prefixed framing and are negotiated per connection, so a peer without them keeps getting json.
+"""
+import datetime
+import json
+import logging
+from collections import OrderedDict
+from time import mktime
+
+from .utils.jsonencoder import TrellioEncoder
+
+logger = logging.getLogger(__name__)
+
+JSON_CODEC = 'json'
+MSGPACK_CODEC = 'msgpack'
+
+
+class Codec:
+    """
+    Base class for codecs, subclasses set a unique name and implement encode and decode
+    """
+    name = None
+    binary = True
+
+    def encode(self, obj) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+        :param data: any bytes like object, frames are handed over as memoryview slices of the receive buffer
+        """
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    name = JSON_CODEC
+    binary = False
+
+    def encode(self, obj):
+        return json.dumps(obj, cls=TrellioEncoder).encode()
+
+    def decode(self, data):
+        return json.loads(str(data, 'utf-8'))
+
+
+def _default(obj):
+    if isinstance(obj, datetime.datetime):
+        return int(mktime(obj.timetuple()))  # same as TrellioEncoder
+    raise TypeError('Object of type {} is not serializable'.format(obj.__class__.__name__))
+
+
+class MsgPackCodec(Codec):
+    """
+    MessagePack through the msgpack package, which uses its C extension when built and its pure python
+    fallback otherwise
+    """
+    name = MSGPACK_CODEC
+
+    def __init__(self):
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+        self._unpack_kwargs = {'raw': False}
+        if msgpack.version >= (1, 0, 0):
+            self._unpack_kwargs['strict_map_key'] = False
+
+    def encode(self, obj):
+        return self._packb(obj, use_bin_type=True, default=_default)
+
+    def decode(self, data):
+        return self._unpackb(data, **self._unpack_kwargs)
+
+
+_codecs = OrderedDict()
+
+
+def register_codec(codec: Codec):
+    """ Makes a codec available for negotiation, later registrations take precedence over earlier ones
+    """
+    _codecs[codec.name] = codec
+    _codecs.move_to_end(codec.name, last=False)
+
+
+def get_codec(name: str) -> Codec:
+    """ The registered codec of that name, raises ValueError listing the available ones when there is none
+    """
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError('Unknown codec {!r}, available codecs are {}'.format(
+            name, ', '.join(available_codecs()))) from None
+
+
+def available_codecs():
+    """ Names of the registered codecs in order of preference
+    """
+    return list(_codecs.keys())
+
+
+def choose_codec(offered):
+    """ Picks the first offered codec that is registered here, json when none is
+    """
+    for name in offered:
+        if name in _codecs:
+            return _codecs[name]
+    return _codecs[JSON_CODEC]
+
+
+register_codec(JSONCodec())
+try:
+    register_codec(MsgPackCodec())
+except ImportError:
+    logger.debug('msgpack is not installed, msgpack codec is unavailable')
@@ -11,6 +11,8 @@ logger = logging.getLogger(__name__)
 
 GLOBAL_CONFIG = {
     "RONIN": False,
+    "WORKERS": 1,
+    "SHARED_NODE_ID": False,
     "HOST_NAME": "",
     "ADMIN_EMAILS": [],
     "SERVICE_NAME": "",
@@ -23,6 +25,7 @@ GLOBAL_CONFIG = {
     "TCP_HOST": "",
     "HTTP_PORT": "",
     "TCP_PORT": "",
+    "TCP_UNIX_PATH": "",
     "SIGNALS": {},
     "MIDDLEWARES": [],
     "APPS": [],
@@ -33,7 +36,12 @@ GLOBAL_CONFIG = {
         "host": "",
         "port": ""
     },
-    "SMTP_SETTINGS": {}
+    "SMTP_SETTINGS": {},
+    "ADMISSION_SETTINGS": {},
+    "EXECUTOR_POOLS": {},
+    "HTTP_CLIENT_SETTINGS": {},
+    "TRACING": {},
+    "LOOP_MONITOR": {}
 }
 
 
@@ -60,10 +68,18 @@ class ConfigHandler:
     tcp_host_key = "TCP_HOST"
     http_port_key = "HTTP_PORT"
     tcp_port_key = "TCP_PORT"
+    tcp_unix_path_key = "TCP_UNIX_PATH"
     database_key = 'DATABASE_SETTINGS'
     ronin_key = "RONIN"
+    workers_key = "WORKERS"
+    shared_node_id_key = "SHARED_NODE_ID"
     smtp_key = 'SMTP_SETTINGS'
     apps_key = 'APPS'
+    admission_key = 'ADMISSION_SETTINGS'
+    executor_pools_key = 'EXECUTOR_POOLS'
+    http_client_key = 'HTTP_CLIENT_SETTINGS'
+    tracing_key = 'TRACING'
+    loop_monitor_key = 'LOOP_MONITOR'
 
     # service_path_key = "SERVICE_PATH"
 
@@ -105,11 +121,18 @@ class ConfigHandler:
             http_port=self.settings[self.http_port_key],
             tcp_host=self.settings[self.tcp_host_key],
             tcp_port=self.settings[self.tcp_port_key],
+            tcp_unix_path=self.settings[self.tcp_unix_path_key],
             registry_host=self.settings[self.reg_host_key],
             registry_port=self.settings[self.reg_port_key],
             pubsub_host=self.settings[self.redis_host_key],
             pubsub_port=self.settings[self.reg_port_key],
-            ronin=self.settings[self.ronin_key]
+            ronin=self.settings[self.ronin_key],
+            workers=self.settings[self.workers_key],
+            shared_node_id=self.settings[self.shared_node_id_key],
+            executor_pools=self.settings[self.executor_pools_key],
+            http_client_settings=self.settings[self.http_client_key],
+            tracing=self.settings[self.tracing_key],
+            loop_monitor=self.settings[self.loop_monitor_key]
         )
 
     def setup_host(self):
@@ -135,8 +158,12 @@ class ConfigHandler:
         if not tcp_service:
             tcp_service = TCPService(host.service_name, host.service_version, host.tcp_host, host.tcp_port)
 
+        if self.settings[self.admission_key]:
+            tcp_service.set_limits(**self.settings[self.admission_key])
+
         self.enable_signals()
-        self.enable_middlewares(http_service=http_service, http_views=http_views)
+        self.enable_middlewares(http_service=http_service, http_views=http_views, tcp_service=tcp_service,
+                                tcp_views=tcp_views)
 
         if http_service:
             # self.register_http_views(http_service)
@@ -270,7 +297,10 @@ class ConfigHandler:
         class_value = getattr(module, class_name)
         return module, class_value
 
-    def enable_middlewares(self, http_service=None, http_views=()):
+    def enable_middlewares(self, http_service=None, http_views=(), tcp_service=None, tcp_views=()):
+        """
+        Instantiates the configured middlewares and compiles their hooks into the pipelines of the services and views
+        """
         middlewares = self.settings[self.middleware_key] or []
         middle_cls = []
         for i in middlewares:
@@ -280,10 +310,9 @@ class ConfigHandler:
             else:
                 middle_cls.append(class_value())
 
-        if http_service:
-            http_service.middlewares = middle_cls
-        for view in http_views:
-            view.middlewares = middle_cls
+        for handler in [http_service, tcp_service] + list(http_views) + list(tcp_views):
+            if handler:
+                handler.middlewares = middle_cls  # compiles their pipelines
 
     def enable_signals(self):
         '''
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from functools import partial
+
+GROW_THRESHOLD = 32  # in flight requests on the least loaded connection before another one is opened
+SHRINK_THRESHOLD = 8  # average in flight requests per connection below which an idle connection is closed
+
+
+class ConnectionPool:
+    """
+    Connections from a service client to one node of a service. Requests go to the connection with the
+    least outstanding requests, the pool opens connections while all of them are busy and closes idle ones
+    once load drops, staying between min_size and max_size connections.
+    """
+
+    def __init__(self, node_id, connect, min_size=1, max_size=4):
+        """
+        :param connect: coroutine function opening a new connection, returns a (transport, protocol) tuple
+        """
+        self._node_id = node_id
+        self._connect = connect
+        self._min_size = max(min_size, 1)
+        self._max_size = max(max_size, self._min_size)
+        self._protocols = []
+        self._outstanding = {}
+        self._connecting = 0
+        self._closed = False
+        self._refill = None
+        self._requests = 0
+        self._grown = 0
+        self._shrunk = 0
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def node_id(self):
+        return self._node_id
+
+    @property
+    def protocols(self):
+        return list(self._protocols)
+
+    def fill(self):
+        """
+        Opens connections till the pool has min_size of them
+        :return: a future done once they are open
+        """
+        missing = self._min_size - len(self._protocols) - self._connecting
+        return asyncio.gather(*[self._open() for _ in range(missing)])
+
+    def _open(self):
+        self._connecting += 1
+        future = asyncio.ensure_future(self._connect())
+        future.add_done_callback(self._on_open)
+        return future
+
+    def _on_open(self, future):
+        self._connecting -= 1
+        if future.cancelled() or future.exception() is not None:
+            self.logger.error('Could not connect to node %s: %r', self._node_id,
+                              None if future.cancelled() else future.exception())
+            return
+        _, protocol = future.result()
+        if self._closed:
+            protocol.close()
+            return
+        self._protocols.append(protocol)
+        self._outstanding[protocol] = 0
+
+    def _prune(self):
+        if all(protocol.is_connected() for protocol in self._protocols):
+            return
+        for protocol in [protocol for protocol in self._protocols if not protocol.is_connected()]:
+            self._protocols.remove(protocol)
+            self._outstanding.pop(protocol, None)
+        if not self._protocols and not self._connecting and not self._closed:
+            self._refill = self.fill()
+            self._refill.add_done_callback(self._on_refilled)
+
+    def _on_refilled(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error('Could not reconnect to node %s: %r', self._node_id, future.exception())
+
+    def acquire(self):
+        """
+        :return: the connected protocol with the least outstanding requests, None if there is none
+        """
+        self._prune()
+        if not self._protocols:
+            return None
+        protocol = min(self._protocols, key=self._outstanding.__getitem__)
+        if (self._outstanding[protocol] >= GROW_THRESHOLD and
+                len(self._protocols) + self._connecting < self._max_size):
+            self._grown += 1
+            self._open()
+        return protocol
+
+    def track(self, protocol, future):
+        """
+        Counts a request sent on protocol as outstanding till its future is done
+        """
+        if protocol in self._outstanding:
+            self._requests += 1
+            self._outstanding[protocol] += 1
+            future.add_done_callback(partial(self._release, protocol))
+
+    def _release(self, protocol, _):
+        if protocol not in self._outstanding:
+            return
+        self._outstanding[protocol] -= 1
+        if (self._outstanding[protocol] == 0 and len(self._protocols) > self._min_size and
+                sum(self._outstanding.values()) <= (len(self._protocols) - 1) * SHRINK_THRESHOLD):
+            self._shrunk += 1
+            self._protocols.remove(protocol)
+            self._outstanding.pop(protocol)
+            protocol.close()
+
+    def close(self):
+        """
+        Closes the connections of the pool, for a node that left
+        """
+        self._closed = True
+        if self._refill is not None:
+            self._refill.cancel()
+        for protocol in self._protocols:
+            protocol.close()
+        self._protocols = []
+        self._outstanding = {}
+
+    def stats(self):
+        outstanding = list(self._outstanding.values())
+        return {'size': len(self._protocols), 'connecting': self._connecting,
+                'outstanding': sum(outstanding), 'max_outstanding': max(outstanding, default=0),
+                'send_queue': sum(protocol.pending for protocol in self._protocols),
+                'requests': self._requests, 'grown': self._grown, 'shrunk': self._shrunk}
@@ -0,0 +1,35 @@
+"""
+Facts about the serving process that per request instrumentation attaches to what it logs or exports. Host.run
+builds the context once per process, so that requests don't look the hostname or the process title up again.
+"""
+import socket
+
+
+class RequestContext:
+    __slots__ = ('hostname', 'service_name', 'node_id')
+
+    def __init__(self, hostname, service_name='', node_id=None):
+        self.hostname = hostname
+        self.service_name = service_name
+        self.node_id = node_id
+
+    def to_dict(self):
+        return {'hostname': self.hostname, 'service_name': self.service_name, 'node_id': self.node_id}
+
+
+_context = None
+
+
+def set_request_context(service_name='', node_id=None) -> RequestContext:
+    global _context
+    _context = RequestContext(socket.gethostname(), service_name, node_id)
+    return _context
+
+
+def request_context() -> RequestContext:
+    """
+    :return: the context of this process, one with only the hostname when Host hasn't run
+    """
+    if _context is None:
+        return set_request_context()
+    return _context
@@ -37,3 +37,10 @@ class ClientDisconnected(ClientException):
 
 class AlreadyRegistered(Exception):
     pass
+
+
+class ServiceOverloaded(RequestException):
+    """
+    Raised for requests a service rejected without processing them because its queue was full.
+    These can safely be retried, preferably after a backoff or on another node.
+    """
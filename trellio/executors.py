@@ -0,0 +1,179 @@
+"""
+Thread and process pools that @api and http handlers marked with an executor are run in, so that cpu bound
+handlers don't stall the event loop.
+
+Pools are created by Host from its executor settings, or on first use with default sizes. Process pools fork
+their processes when they start, handlers run there against the copy of their service or view made at that time,
+which is why Host registers services and views before starting the pools.
+"""
+import asyncio
+import inspect
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .utils.stats import Aggregator
+
+THREAD = 'thread'
+PROCESS = 'process'
+EXECUTORS = (THREAD, PROCESS)
+
+_pools = OrderedDict()
+_functions = {}  # handlers of process pools by key, registered when decorated so that pool processes have them
+_instances = {}  # services and views process pool handlers are bound to, by class
+
+
+def _key(obj):
+    return '{}.{}'.format(obj.__module__, obj.__qualname__)
+
+
+def _timed(func, *args, **kwargs):
+    started = time.monotonic()  # system wide on linux, comparable with the time of submission in the parent
+    result = func(*args, **kwargs)
+    return started, time.monotonic(), result
+
+
+def _call_registered(function_key, instance_key, args, kwargs):
+    if instance_key not in _instances:
+        raise RuntimeError('{} was not registered before its process pool started'.format(instance_key))
+    return _functions[function_key](_instances[instance_key], *args, **kwargs)
+
+
+class ExecutorPool:
+    """
+    A named thread or process pool with queue and utilization metrics
+    """
+
+    def __init__(self, name, executor=THREAD, max_workers=None):
+        if executor not in EXECUTORS:
+            raise ValueError('executor must be one of {}'.format(', '.join(EXECUTORS)))
+        self._name = name
+        self._executor = executor
+        if max_workers is None:
+            max_workers = (os.cpu_count() or 1) * (1 if executor == PROCESS else 5)
+        self._max_workers = max_workers
+        self._pool = None
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._queue_time = 0
+        self._busy_time = 0
+        self._started_at = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def executor(self):
+        return self._executor
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def start(self):
+        if self._pool is None:
+            pool_class = ProcessPoolExecutor if self._executor == PROCESS else ThreadPoolExecutor
+            self._pool = pool_class(max_workers=self._max_workers)
+            self._started_at = time.monotonic()
+            if self._executor == PROCESS:
+                self._pool.submit(int).result()  # forks the processes now rather than on the first request
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+    @asyncio.coroutine
+    def run(self, func, instance, args=(), kwargs=None):
+        """
+        Runs func(instance, *args, **kwargs) in the pool
+        """
+        self.start()
+        kwargs = kwargs or {}
+        submitted = time.monotonic()
+        if self._executor == PROCESS:
+            future = self._pool.submit(_timed, _call_registered, _key(func), _key(type(instance)), args, kwargs)
+        else:
+            future = self._pool.submit(_timed, func, instance, *args, **kwargs)
+        self._submitted += 1
+        try:
+            started, finished, result = yield from asyncio.wrap_future(future)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._completed += 1
+        self._queue_time += started - submitted
+        self._busy_time += finished - started
+        return result
+
+    def stats(self):
+        outstanding = self._submitted - self._completed
+        done = self._completed - self._failed
+        uptime = time.monotonic() - self._started_at if self._started_at else 0
+        return {'executor': self._executor, 'max_workers': self._max_workers,
+                'active': min(outstanding, self._max_workers),
+                'queue_depth': max(outstanding - self._max_workers, 0),
+                'submitted': self._submitted, 'completed': self._completed, 'failed': self._failed,
+                'average_queue_time': int(self._queue_time / done * 1000) if done else 0,
+                'utilization': round(self._busy_time / (uptime * self._max_workers), 4) if uptime else 0}
+
+
+def check_executor(func, executor):
+    """
+    Validates the executor option of a handler decorator, registering func if it runs in process pools
+    """
+    if executor is None:
+        return
+    if executor not in EXECUTORS:
+        raise ValueError('executor must be one of {}'.format(', '.join(EXECUTORS)))
+    if asyncio.iscoroutinefunction(func) or inspect.isgeneratorfunction(func):
+        raise TypeError('{} must be a plain function to run in an executor'.format(func.__qualname__))
+    if executor == PROCESS:
+        _functions[_key(func)] = func
+
+
+def register_instance(instance):
+    _instances[_key(type(instance))] = instance
+
+
+def configure_pools(settings: dict):
+    """
+    :param settings: pool name -> {'executor': 'thread' or 'process', 'max_workers': int}
+    """
+    for name, options in settings.items():
+        _add_pool(ExecutorPool(name, **options))
+
+
+def _add_pool(pool):
+    if not _pools:
+        Aggregator.register_source('executors', pool_stats)
+    _pools[pool.name] = pool
+    return pool
+
+
+def get_pool(name, executor=THREAD) -> ExecutorPool:
+    """
+    :return: the pool called name, created with default size for executor if it isn't configured
+    """
+    pool = _pools.get(name)
+    if pool is None:
+        pool = _add_pool(ExecutorPool(name, executor))
+    return pool
+
+
+def start_pools():
+    for pool in _pools.values():
+        pool.start()
+
+
+def shutdown_pools(wait=True):
+    for pool in _pools.values():
+        pool.shutdown(wait=wait)
+
+
+def pool_stats():
+    return {name: pool.stats() for name, pool in _pools.items()}
@@ -0,0 +1,37 @@
+from bisect import bisect
+from hashlib import md5
+
+VIRTUAL_NODES = 160  # points per node on the ring, more points spread entities more evenly
+
+
+def _hash(key):
+    return int.from_bytes(md5(str(key).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping entities to nodes without remembering any entity. Every node is placed on the
+    ring at VIRTUAL_NODES points and an entity goes to the node owning the first point after its hash, so
+    adding or removing one of N nodes only moves about 1/N of the entities.
+    """
+
+    def __init__(self, nodes=(), virtual_nodes=VIRTUAL_NODES):
+        """
+        :param nodes: (host, port, node_id, service_type) tuples, placed on the ring by node_id
+        """
+        self._virtual_nodes = virtual_nodes
+        points = sorted((_hash('{}#{}'.format(node[2], i)), node) for node in nodes for i in range(virtual_nodes))
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    def __len__(self):
+        return len(self._nodes) // self._virtual_nodes
+
+    def get(self, entity):
+        """
+        :return: the node entity maps to, None on an empty ring
+        """
+        if not self._nodes:
+            return None
+        index = bisect(self._hashes, _hash(entity))
+        return self._nodes[index if index < len(self._nodes) else 0]
@@ -2,12 +2,19 @@ import asyncio
 import logging
 import os
 import signal
+import stat
+import time
 import warnings
 from functools import partial
 
+from again.utils import unique_hex
 from aiohttp.web import Application
 
-from .bus import TCPBus
+from . import executors
+from .bus import TCPBus, HTTPBus
+from .context import set_request_context
+from .loop_monitor import LoopMonitor
+from .tracing import configure_tracing, flush_tracing
 from .protocol_factory import get_trellio_protocol
 from .pubsub import Publisher, Subscriber
 from .registry_client import RegistryClient
@@ -15,8 +22,11 @@ from .services import HTTPService, TCPService
 from .signals import ServiceReady
 from .utils.decorators import deprecated
 from .utils.log import setup_logging
+from .utils.shared_stats import SharedStats
 from .utils.stats import Stats, Aggregator
 
+WORKER_RESTART_DELAY = 1  # seconds the supervisor waits before replacing a worker that died
+
 
 class Host:
     """Serves as a static entry point and provides the boilerplate required to host and run a trellio Service.
@@ -38,8 +48,15 @@ class Host:
     http_port = None
     tcp_host = None
     tcp_port = None
+    tcp_unix_path = None  # unix socket the tcp service also listens on for clients on the same host
     ssl_context = None
     ronin = False  # If true, the trellio service runs solo without a registry
+    workers = 1  # processes serving the services, more than one are forked and bind with SO_REUSEPORT
+    shared_node_id = False  # If true, all workers register under the same node id instead of one each, see configure
+    executor_pools = {}  # pool name -> {'executor': 'thread' or 'process', 'max_workers': int}
+    http_client_settings = {}  # HTTPBus options, e.g. limit_per_node, keepalive_timeout, timeout
+    tracing = {}  # configure_tracing options, e.g. path, sample_rate, tracing is off without a path
+    loop_monitor = {}  # LoopMonitor options, e.g. interval, slow_threshold, False turns the monitor off
 
     _host_id = None
     _tcp_service = None
@@ -50,13 +67,19 @@ class Host:
     _http_views = []
     _logger = logging.getLogger(__name__)
     _smtp_handler = None
+    _worker_pids = {}
+    _stopping = False
+    _loop_monitor = None
 
     @classmethod
     def configure(cls, host_name: str = '', service_name: str = '', service_version='',
                   http_host: str = '127.0.0.1', http_port: int = 8000,
                   tcp_host: str = '127.0.0.1', tcp_port: int = 8001, ssl_context=None,
                   registry_host: str = "0.0.0.0", registry_port: int = 4500,
-                  pubsub_host: str = "0.0.0.0", pubsub_port: int = 6379, ronin: bool = False):
+                  pubsub_host: str = "0.0.0.0", pubsub_port: int = 6379, ronin: bool = False,
+                  workers: int = 1, shared_node_id: bool = False, executor_pools: dict = None,
+                  tcp_unix_path: str = None, http_client_settings: dict = None, tracing: dict = None,
+                  loop_monitor=None):
         """ A convenience method for providing registry and pubsub(redis) endpoints
 
         :param host_name: Used for process name
@@ -64,6 +87,16 @@ class Host:
         :param registry_port: Port for trellio-registry; default = 4500
         :param pubsub_host: IP Address for pubsub component, usually redis; default = 0.0.0.0
         :param pubsub_port: Port for pubsub component; default= 6379
+        :param workers: Worker processes to fork, each with its own event loop; default = 1
+        :param shared_node_id: Register all workers as one node instead of one node each; default = False.
+                               The registry pings a node over one connection, which reaches a single worker.
+                               Should that worker die the registry deregisters the node, taking every worker
+                               away from consumers until the replacement worker registers again.
+        :param executor_pools: Sizes of the pools handlers with an executor run in, by pool name
+        :param tcp_unix_path: Unix socket path to serve the TCP service on as well, for clients on the same host
+        :param http_client_settings: Connection limits and timeouts of requests sent by HTTP service clients
+        :param tracing: File spans are exported to and the fraction of traces sampled, see trellio.tracing
+        :param loop_monitor: Event loop lag sampling interval and slow callback threshold, False to turn it off
         :return: None
         """
         Host.host_name = host_name
@@ -79,6 +112,13 @@ class Host:
         Host.pubsub_port = pubsub_port
         Host.ssl_context = ssl_context
         Host.ronin = ronin
+        Host.workers = int(workers or 1)
+        Host.shared_node_id = shared_node_id
+        Host.executor_pools = executor_pools or {}
+        Host.tcp_unix_path = tcp_unix_path or None
+        Host.http_client_settings = http_client_settings or {}
+        Host.tracing = tracing or {}
+        Host.loop_monitor = loop_monitor if loop_monitor is not None else {}
 
     @classmethod
     def get_http_service(cls):
@@ -165,6 +205,9 @@ class Host:
             instance.host = Host
             views_instances.append(instance)
         cls._tcp_views.extend(views_instances)
+        if cls._tcp_service:
+            cls._tcp_service.tcp_views = cls._tcp_views
+            cls._tcp_service.tcp_bus.build_endpoint_table()
 
     @classmethod
     def attach_publisher(cls, publisher: Publisher):
@@ -189,12 +232,109 @@ class Host:
             cls._set_host_id()
             cls._setup_logging()
             cls._set_process_name()
-            cls._set_signal_handlers()
-            cls._start_pubsub()
-            cls._start_server()
+            if cls.workers > 1:
+                cls._supervise()
+            else:
+                cls._serve()
         else:
             cls._logger.error('No services to host')
 
+    @classmethod
+    def _serve(cls):
+        cls._set_request_context()
+        if cls.tracing:
+            configure_tracing(**cls.tracing)
+        Aggregator.periodic_aggregated_stats_logger()
+        cls._start_loop_monitor()
+        cls._start_executors()
+        cls._set_signal_handlers()
+        cls._start_pubsub()
+        cls._start_server()
+
+    @classmethod
+    def _set_request_context(cls):
+        service = cls._tcp_service or cls._http_service
+        set_request_context(cls.service_name, service.node_id if service else None)
+
+    @classmethod
+    def _start_loop_monitor(cls):
+        if cls.loop_monitor is not False:
+            cls._loop_monitor = LoopMonitor(**cls.loop_monitor)
+            cls._loop_monitor.start()
+
+    @classmethod
+    def _start_executors(cls):
+        for instance in [cls._tcp_service, cls._http_service] + cls._tcp_views + cls._http_views:
+            if instance:
+                executors.register_instance(instance)
+        executors.configure_pools(cls.executor_pools)
+        executors.start_pools()
+
+    @classmethod
+    def _supervise(cls):
+        """ Forks the workers and replaces the ones that die till SIGINT or SIGTERM, which is passed on to them
+        """
+        signal.signal(signal.SIGINT, cls._stop_workers)
+        signal.signal(signal.SIGTERM, cls._stop_workers)
+        Aggregator.share(SharedStats(cls.workers))
+        for worker in range(cls.workers):
+            cls._spawn_worker(worker)
+        cls._logger.info('Supervising %s workers, pid %s: send SIGINT or SIGTERM to exit.', cls.workers, os.getpid())
+        while cls._worker_pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker = cls._worker_pids.pop(pid, None)
+            if worker is not None and not cls._stopping:
+                cls._logger.error('Worker %s with pid %s exited with status %s, restarting it', worker, pid, status)
+                time.sleep(WORKER_RESTART_DELAY)
+                cls._spawn_worker(worker)
+
+    @classmethod
+    def _stop_workers(cls, signum, _):
+        cls._logger.info('got signal %s - stopping workers', signum)
+        cls._stopping = True
+        for pid in cls._worker_pids:
+            os.kill(pid, signum)
+
+    @classmethod
+    def _spawn_worker(cls, worker):
+        if cls._stopping:
+            return
+        pid = os.fork()
+        if pid:
+            cls._worker_pids[pid] = worker
+            return
+        status = 1
+        try:
+            cls._run_worker(worker)
+            status = 0
+        except Exception:
+            cls._logger.exception('Worker %s failed', worker)
+        finally:
+            os._exit(status)
+
+    @classmethod
+    def _run_worker(cls, worker):
+        """ Runs in a forked worker, which must not share the event loop or the buses of the supervisor
+        """
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        cls._worker_pids = {}
+        Aggregator._shared.attach(worker)
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        for service in (cls._tcp_service, cls._http_service):
+            if service:
+                if not cls.shared_node_id:
+                    service._node_id = unique_hex()
+                cls._set_bus(service)
+        if cls._tcp_service and (cls._tcp_service.unix_path or cls.tcp_unix_path):
+            # unix sockets can't be shared like the tcp port
+            cls._tcp_service.unix_path = '{}.{}'.format(cls._tcp_service.unix_path or cls.tcp_unix_path, worker)
+        cls._logger.info('Worker %s started with pid %s', worker, os.getpid())
+        cls._serve()
+
     @classmethod
     def _set_process_name(cls):
         from setproctitle import setproctitle
@@ -216,19 +356,46 @@ class Host:
             ssl_context = cls._tcp_service.ssl_context
             host_ip, host_port = cls._tcp_service.socket_address
             task = asyncio.get_event_loop().create_server(partial(get_trellio_protocol, cls._tcp_service.tcp_bus),
-                                                          host_ip, host_port, ssl=ssl_context)
+                                                          host_ip, host_port, ssl=ssl_context,
+                                                          **cls._reuse_port_kwargs())
             result = asyncio.get_event_loop().run_until_complete(task)
             return result
 
+    @classmethod
+    def _create_unix_server(cls):
+        if cls._tcp_service and (cls._tcp_service.unix_path or cls.tcp_unix_path):
+            cls._tcp_service.unix_path = path = cls._tcp_service.unix_path or cls.tcp_unix_path
+            cls._remove_unix_socket(path)  # left behind by a previous run
+            task = asyncio.get_event_loop().create_unix_server(
+                partial(get_trellio_protocol, cls._tcp_service.tcp_bus), path)
+            return asyncio.get_event_loop().run_until_complete(task)
+
+    @staticmethod
+    def _remove_unix_socket(path):
+        """ Removes the unix socket at path if there is one, refusing to remove any other kind of file
+        """
+        try:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError('{} is not a unix socket, not removing it'.format(path))
+            os.remove(path)
+        except FileNotFoundError:  # never created, or removed by the supervisor or another worker
+            pass
+
     @classmethod
     def _create_http_server(cls):
         if cls._http_service or cls._http_views:
             host_ip, host_port = cls.http_host, cls.http_port
             ssl_context = cls.ssl_context
             handler = cls._make_aiohttp_handler()
-            task = asyncio.get_event_loop().create_server(handler, host_ip, host_port, ssl=ssl_context)
+            task = asyncio.get_event_loop().create_server(handler, host_ip, host_port, ssl=ssl_context,
+                                                          **cls._reuse_port_kwargs())
             return asyncio.get_event_loop().run_until_complete(task)
 
+    @classmethod
+    def _reuse_port_kwargs(cls):
+        # workers bind the same ports and the kernel spreads connections among them
+        return {'reuse_port': True} if cls.workers > 1 else {}
+
     @classmethod
     def _make_aiohttp_handler(cls):
         app = Application(loop=asyncio.get_event_loop())
@@ -265,6 +432,7 @@ class Host:
     @classmethod
     def _start_server(cls):
         tcp_server = cls._create_tcp_server()
+        unix_server = cls._create_unix_server()
         http_server = cls._create_http_server()
         if not cls.ronin:
             if cls._tcp_service:
@@ -273,6 +441,8 @@ class Host:
                 #     asyncio.get_event_loop().run_until_complete(cls._http_service.tcp_bus.connect())
         if tcp_server:
             cls._logger.info('Serving TCP on {}'.format(tcp_server.sockets[0].getsockname()))
+        if unix_server:
+            cls._logger.info('Serving TCP on unix socket {}'.format(cls._tcp_service.unix_path))
         if http_server:
             cls._logger.info('Serving HTTP on {}'.format(http_server.sockets[0].getsockname()))
         cls._logger.info("Event loop running forever, press CTRL+C to interrupt.")
@@ -288,10 +458,23 @@ class Host:
                 tcp_server.close()
                 asyncio.get_event_loop().run_until_complete(tcp_server.wait_closed())
 
+            if unix_server:
+                unix_server.close()
+                asyncio.get_event_loop().run_until_complete(unix_server.wait_closed())
+                cls._remove_unix_socket(cls._tcp_service.unix_path)
+
             if http_server:
                 http_server.close()
                 asyncio.get_event_loop().run_until_complete(http_server.wait_closed())
 
+            for service in (cls._tcp_service, cls._http_service):
+                if service and service.http_bus:
+                    service.http_bus.close()
+
+            if cls._loop_monitor:
+                cls._loop_monitor.stop()
+            executors.shutdown_pools(wait=False)
+            flush_tracing()
             asyncio.get_event_loop().close()
 
     @classmethod
@@ -308,14 +491,18 @@ class Host:
     def _set_bus(cls, service):
         registry_client = RegistryClient(asyncio.get_event_loop(), cls.registry_host, cls.registry_port)
         tcp_bus = TCPBus(registry_client)
+        tcp_bus.http_bus = HTTPBus(registry_client, **cls.http_client_settings)
         registry_client.conn_handler = tcp_bus
         # pubsub_bus = PubSubBus(cls.pubsub_host, cls.pubsub_port, registry_client)  # , cls._tcp_service._ssl_context)
         registry_client.bus = tcp_bus
         if isinstance(service, TCPService):
+            service.tcp_views = cls._tcp_views
             tcp_bus.tcp_host = service
+            tcp_bus.build_endpoint_table()
         if isinstance(service, HTTPService):
             tcp_bus.http_host = service
         service.tcp_bus = tcp_bus
+        service.http_bus = tcp_bus.http_bus
         # service.pubsub_bus = pubsub_bus
 
     @classmethod
@@ -327,4 +514,3 @@ class Host:
             logger.addHandler(cls._smtp_handler)
         Stats.service_name = cls.service_name
         Aggregator._service_name = cls.service_name
-        Aggregator.periodic_aggregated_stats_logger()
@@ -1,31 +1,150 @@
 import asyncio
 import json
 import logging
+import struct
+import time
 
 from jsonstreamer import ObjectStreamer
 
+from .codec import JSON_CODEC, choose_codec, get_codec
 from .sendqueue import SendQueue
 from .utils.jsonencoder import TrellioEncoder
 
+JSON_FRAMING = 'json'  # comma separated elements of a streamed json array
+LENGTH_FRAMING = 'length'  # every packet prefixed with its byte length
+FRAMINGS = (JSON_FRAMING, LENGTH_FRAMING)
+
+HANDSHAKE_TIMEOUT = 2
+OLD_PEER_TTL = 600  # seconds a peer that didn't answer a framing offer is sent json framing without offering again
+MAX_FRAME_LENGTH = 64 * 1024 * 1024
+WRITE_HIGH_WATER = 256 * 1024  # bytes buffered in the transport before writing is paused
+WRITE_LOW_WATER = 64 * 1024  # bytes buffered in the transport when writing is resumed
+
+_HANDSHAKE = 'handshake'
+_HANDSHAKE_ACK = 'handshake_ack'
+_LENGTH_HEADER = struct.Struct('!I')
+
+_old_peers = {}  # address -> when the peer didn't answer a framing offer
+
+
+def _make_handshake(handshake_type, params):
+    # handshakes are flat json objects written as the very first element of a connection, the fixed key order
+    # lets the receiving side recognise them from the leading bytes without involving the json streamer
+    body = ''.join(', "{}": "{}"'.format(key, value) for key, value in sorted(params.items()))
+    return '{{"type": "{}"{}}},'.format(handshake_type, body).encode()
+
+
+def _parse_handshake(data, handshake_type):
+    """
+    :return: (params, consumed_bytes) for a complete handshake, None if more data is needed and
+             False if data is not a handshake of the given type
+    """
+    prefix = '{{"type": "{}"'.format(handshake_type).encode()
+    if len(data) < len(prefix):
+        return None if prefix.startswith(bytes(data)) else False
+    if not data.startswith(prefix):
+        return False
+    end = data.find(b'},')
+    if end == -1:
+        return None
+    params = json.loads(data[:end + 1].decode())
+    return params, end + 2
+
 
 class JSONProtocol(asyncio.Protocol):
     logger = logging.getLogger(__name__)
 
-    def __init__(self):
+    def __init__(self, framing=JSON_FRAMING, codec=JSON_CODEC, high_water=WRITE_HIGH_WATER,
+                 low_water=WRITE_LOW_WATER, peer=None):
+        """
+        :param peer: address of the peer a client connects to, peers that didn't answer a framing offer are
+                     remembered by it so that further connections don't wait for the handshake to time out
+        """
         self._send_q = None
         self._connected = False
+        self._paused = False
+        self._reading_held = False
+        self._drain_waiters = []
+        self._high_water = high_water
+        self._low_water = low_water
         self._transport = None
         self._obj_streamer = None
         self._pending_data = []
+        self._framing = JSON_FRAMING
+        self._codec = get_codec(JSON_CODEC)
+        self._offered_framing = framing
+        self._offered_codec = codec
+        self._peer = peer
+        self._awaiting = None
+        self._close_after_handshake = False
+        self._handshake_buffer = bytearray()
+        self._handshake_timer = None
+        self._frame_buffer = bytearray()
 
-    @staticmethod
-    def _make_frame(packet):
-        string = json.dumps(packet, cls=TrellioEncoder) + ','
-        return string.encode()
+    def _make_frame(self, packet):
+        if self._framing == LENGTH_FRAMING:
+            data = self._codec.encode(packet)
+            return _LENGTH_HEADER.pack(len(data)) + data
+        return json.dumps(packet, cls=TrellioEncoder).encode() + b','
 
     def is_connected(self):
         return self._connected
 
+    @property
+    def framing(self):
+        return self._framing
+
+    @property
+    def codec(self):
+        return self._codec.name
+
+    def _can_send(self):
+        return self._connected and not self._paused and self._awaiting != _HANDSHAKE_ACK
+
+    def pause_writing(self):
+        self._paused = True
+        self.logger.debug('Writing paused for %s', self._transport.get_extra_info('peername'))
+
+    def resume_writing(self):
+        self._paused = False
+        if self._reading_held:
+            self._reading_held = False
+            self._transport.resume_reading()
+        self._wake_drain_waiters()
+        self._send_q.send()
+
+    def _wake_drain_waiters(self):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @property
+    def pending(self):
+        """
+        number of packets waiting in the send queue
+        """
+        return len(self._send_q) if self._send_q else 0
+
+    async def drain(self):
+        """
+        Returns once the transport can take more data, producers await it to slow down while the peer is
+        not reading instead of queueing without limit
+        """
+        if self._paused and self._connected:
+            waiter = asyncio.Future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+    def hold_reading(self):
+        """
+        Stops reading from the peer while writing is paused and resumes with writing, servers call it so a peer
+        that keeps sending requests without reading the responses is not served more of them
+        """
+        if self._paused and self._connected and not self._reading_held:
+            self._reading_held = True
+            self._transport.pause_reading()
+
     def _write_pending_data(self):
         for packet in self._pending_data:
             frame = self._make_frame(packet)
@@ -39,10 +158,89 @@ class JSONProtocol(asyncio.Protocol):
             self._transport.send = self._transport.write
         except:
             pass
-        self._send_q = SendQueue(transport, self.is_connected)
+        try:
+            transport.set_write_buffer_limits(high=self._high_water, low=self._low_water)
+        except (AttributeError, NotImplementedError):
+            pass
+        self._send_q = SendQueue(transport, self._can_send, pre_process_func=self._make_frame)
         self.set_streamer()
+        if self._offered_framing != JSON_FRAMING and not self._is_old_peer():
+            self._offer_framing()
+        else:
+            self._awaiting = _HANDSHAKE  # a peer may still offer a framing as its first element
         self._send_q.send()
 
+    def _offer_framing(self):
+        # packets are held in the send queue till the peer acknowledges, old peers never answer so fall back to
+        # json framing on timeout
+        self._awaiting = _HANDSHAKE_ACK
+        codecs = [self._offered_codec]
+        if self._offered_codec != JSON_CODEC:
+            codecs.append(JSON_CODEC)
+        self._transport.write(_make_handshake(_HANDSHAKE, {'framing': self._offered_framing,
+                                                           'codecs': ','.join(codecs)}))
+        self._handshake_timer = asyncio.get_event_loop().call_later(HANDSHAKE_TIMEOUT, self._on_handshake_timeout)
+
+    def _is_old_peer(self):
+        found = _old_peers.get(self._peer)
+        if found is None:
+            return False
+        if time.monotonic() - found < OLD_PEER_TTL:
+            return True
+        del _old_peers[self._peer]  # offer again, the peer may have been upgraded
+        return False
+
+    def _on_handshake_timeout(self):
+        if self._awaiting == _HANDSHAKE_ACK:
+            self.logger.info('No handshake from %s, using json framing', self._transport.get_extra_info('peername'))
+            if self._peer is not None:
+                _old_peers[self._peer] = time.monotonic()
+            self._complete_handshake(JSON_FRAMING)
+
+    def _handshake_received(self, byte_data):
+        self._handshake_buffer.extend(byte_data)
+        try:
+            handshake = _parse_handshake(self._handshake_buffer, self._awaiting)
+        except ValueError:
+            self.logger.exception('Invalid handshake received')
+            handshake = False
+        if handshake is None:
+            return
+        if handshake is False:
+            self._complete_handshake(JSON_FRAMING)
+            return
+        params, consumed = handshake
+        framing = params.get('framing', JSON_FRAMING)
+        if framing not in FRAMINGS:
+            framing = JSON_FRAMING
+        del self._handshake_buffer[:consumed]
+        if self._awaiting == _HANDSHAKE:
+            codec = choose_codec(params.get('codecs', JSON_CODEC).split(','))
+            if framing == JSON_FRAMING:
+                codec = get_codec(JSON_CODEC)  # binary codecs need length prefixed frames
+            self._transport.write(_make_handshake(_HANDSHAKE_ACK, {'framing': framing, 'codec': codec.name}))
+        else:
+            codec = choose_codec([params.get('codec', JSON_CODEC)])
+        self._complete_handshake(framing, codec)
+
+    def _complete_handshake(self, framing, codec=None):
+        if self._handshake_timer is not None:
+            self._handshake_timer.cancel()
+            self._handshake_timer = None
+        self._awaiting = None
+        self._framing = framing
+        if codec is not None:
+            self._codec = codec
+        pending = bytes(self._handshake_buffer)
+        self._handshake_buffer.clear()
+        if self._close_after_handshake:
+            self.close()
+            return
+        if self._connected:
+            self._send_q.send()
+        if pending:
+            self._consume(pending)
+
     def set_streamer(self):
         self._obj_streamer = ObjectStreamer()
         self._obj_streamer.auto_listen(self, prefix='on_')
@@ -50,18 +248,37 @@ class JSONProtocol(asyncio.Protocol):
 
     def connection_lost(self, exc):
         self._connected = False
+        self._wake_drain_waiters()
+        if self._handshake_timer is not None:
+            self._handshake_timer.cancel()
         self.logger.info('Peer closed %s', self._transport.get_extra_info('peername'))
 
-    def send(self, packet):
-        frame = self._make_frame(packet)
-        self._send_q.send(frame)
-        self.logger.debug('Data sent: %s', frame.decode())
+    def send(self, packet, span=None):
+        """
+        :param span: span of the request packet answers, finished once the packet is encoded
+        """
+        self._send_q.send(packet, span)
+        self.logger.debug('Data sent: %s', packet)
 
     def close(self):
-        self._transport.write(']'.encode())  # end the json array
+        if self._awaiting == _HANDSHAKE_ACK and self._connected:
+            self._close_after_handshake = True  # queued packets are framed the way the peer agrees to
+            return
+        self._send_q.flush(force=True)  # written even while paused, the transport buffers them before closing
+        if self._framing == JSON_FRAMING:
+            self._transport.write(']'.encode())  # end the json array
         self._transport.close()
 
     def data_received(self, byte_data):
+        if self._awaiting is not None:
+            self._handshake_received(byte_data)
+        else:
+            self._consume(byte_data)
+
+    def _consume(self, byte_data):
+        if self._framing == LENGTH_FRAMING:
+            self._consume_frames(byte_data)
+            return
         string_data = byte_data.decode()
         self.logger.debug('Data received: %s', string_data)
         try:
@@ -71,6 +288,33 @@ class JSONProtocol(asyncio.Protocol):
             self.logger.exception('Invalid data received')
             self.set_streamer()
 
+    def _consume_frames(self, byte_data):
+        buffer = self._frame_buffer
+        buffer.extend(byte_data)
+        size, offset = len(buffer), 0
+        elements = []
+        with memoryview(buffer) as view:
+            while size - offset >= _LENGTH_HEADER.size:
+                length, = _LENGTH_HEADER.unpack_from(buffer, offset)
+                if length > MAX_FRAME_LENGTH:
+                    break
+                end = offset + _LENGTH_HEADER.size + length
+                if end > size:
+                    break
+                try:
+                    elements.append(self._codec.decode(view[offset + _LENGTH_HEADER.size:end]))
+                except Exception:
+                    self.logger.exception('Invalid frame received')
+                offset = end
+        if offset:
+            del buffer[:offset]
+        if len(buffer) >= _LENGTH_HEADER.size and _LENGTH_HEADER.unpack_from(buffer)[0] > MAX_FRAME_LENGTH:
+            self.logger.error('Frame exceeds %d bytes, closing connection', MAX_FRAME_LENGTH)
+            buffer.clear()
+            self._transport.close()
+        for element in elements:
+            self.on_element(element)
+
     def on_object_stream_start(self):
         raise RuntimeError('Incorrect JSON Streaming Format: expect a JSON Array to start at root, got object')
 
@@ -91,17 +335,26 @@ class JSONProtocol(asyncio.Protocol):
 
 
 class TrellioProtocol(JSONProtocol):
-    def __init__(self, handler):
-        super(TrellioProtocol, self).__init__()
+    def __init__(self, handler, framing=JSON_FRAMING, codec=JSON_CODEC, high_water=WRITE_HIGH_WATER,
+                 low_water=WRITE_LOW_WATER, peer=None):
+        super(TrellioProtocol, self).__init__(framing=framing, codec=codec, high_water=high_water,
+                                              low_water=low_water, peer=peer)
         self._handler = handler
+        self._closed = False
 
     def connection_made(self, transport):
         peer_name = transport.get_extra_info('peername')
         self.logger.info('Connection from %s', peer_name)
         super(TrellioProtocol, self).connection_made(transport)
 
+    def close(self):
+        self._closed = True
+        super(TrellioProtocol, self).close()
+
     def connection_lost(self, exc):
         super(TrellioProtocol, self).connection_lost(exc)
+        if self._closed:  # closed on purpose, e.g. by a connection pool shrinking
+            return
         try:
             self._handler._handle_connection_lost()
         except:
@@ -0,0 +1,155 @@
+"""
+Measures how late the event loop runs callbacks and finds what blocks it.
+
+A sampler scheduled on the loop every interval records how much later than due it ran. A watchdog thread
+checks that the sampler keeps running: once it is late by slow_threshold the loop is stuck in a callback, whose
+stack the watchdog captures. When the loop gets going again the step is logged with its stack, attributed to
+the @api or http endpoint it was serving or else to the innermost trellio function it was in.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from .utils.histogram import Histogram
+from .utils.stats import Aggregator
+
+DEFAULT_INTERVAL = 0.05
+DEFAULT_SLOW_THRESHOLD = 0.1
+STACK_LIMIT = 12  # innermost frames logged for a slow step
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_ASYNCIO_DIR = os.path.dirname(os.path.abspath(asyncio.__file__))
+_handler_runners = {}  # code -> server type, of the functions running the handler of an endpoint
+
+_logger = logging.getLogger(__name__)
+
+
+def _is_library(filename):
+    return filename.startswith(_PACKAGE_DIR) or filename.startswith(_ASYNCIO_DIR)
+
+
+def runs_handlers(server_type):
+    """
+    Marks the generator function endpoint handlers are run from as a coroutine, stacks through it are attributed
+    to the handler it calls
+    """
+    def mark(func):
+        func = asyncio.coroutine(func)  # swaps the code object of func, or wraps it in debug mode
+        _handler_runners[getattr(func, '__wrapped__', func).__code__] = server_type
+        return func
+    return mark
+
+
+def endpoint_of(frames):
+    """
+    :param frames: the frames of a stack, innermost first
+    :return: the @api or http endpoint the stack is serving, like 'tcp get_user', None if it serves none
+    """
+    for index, each in enumerate(frames):
+        server_type = _handler_runners.get(each.f_code)
+        if index and server_type is not None:
+            # the handler is the outermost frame called by the runner outside of trellio and asyncio
+            for inner in frames[index - 1::-1]:
+                if not _is_library(inner.f_code.co_filename):
+                    return '{} {}'.format(server_type, inner.f_code.co_name)
+    return None
+
+
+def attribute(frame):
+    """
+    :return: the endpoint or trellio function the stack of frame is in, with its innermost frames
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    stack = traceback.extract_stack(frames[0], limit=STACK_LIMIT) if frames else []
+    endpoint = endpoint_of(frames)
+    if endpoint is not None:
+        return endpoint, stack
+    for each in frames:
+        code = each.f_code
+        if code.co_filename.startswith(_PACKAGE_DIR):
+            return '{}:{}'.format(os.path.relpath(code.co_filename, os.path.dirname(_PACKAGE_DIR)),
+                                  code.co_name), stack
+    return frames[0].f_code.co_name if frames else 'unknown', stack
+
+
+class LoopMonitor:
+    def __init__(self, interval=DEFAULT_INTERVAL, slow_threshold=DEFAULT_SLOW_THRESHOLD, loop=None):
+        """
+        :param interval: seconds between lag samples
+        :param slow_threshold: seconds a callback may hold the loop before it is reported
+        """
+        self._interval = interval
+        self._slow_threshold = slow_threshold
+        self._loop = loop
+        self._lag = Histogram(resolution=0.1)  # milliseconds
+        self._due = None
+        self._watched = None  # time.monotonic() the next sample is due at, for the watchdog
+        self._handle = None
+        self._thread = None
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._blocked = None  # (attribution, stack) of the step the watchdog caught blocking the loop
+        self._slow_steps = 0
+        self._offenders = Counter()
+
+    def start(self):
+        """
+        Starts sampling, to be called from the thread running the loop
+        """
+        self._loop = self._loop or asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._schedule()
+        self._thread = threading.Thread(target=self._watch, name='trellio-loop-monitor', daemon=True)
+        self._thread.start()
+        Aggregator.register_source('event_loop', self.stats)
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        self._due = self._loop.time() + self._interval
+        self._watched = time.monotonic() + self._interval
+        self._handle = self._loop.call_at(self._due, self._sample)
+
+    def _sample(self):
+        lag = self._loop.time() - self._due
+        self._lag.update(lag * 1000)
+        blocked, self._blocked = self._blocked, None
+        if blocked is not None:
+            self._report(lag, *blocked)
+        self._schedule()
+
+    def _report(self, lag, attribution, stack):
+        self._slow_steps += 1
+        self._offenders[attribution] += 1
+        _logger.warning('Event loop blocked for %d ms by %s\n%s', lag * 1000, attribution,
+                        ''.join(traceback.format_list(stack)))
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self._slow_threshold / 2):
+            due = self._watched
+            if due is None or due == reported or time.monotonic() - due < self._slow_threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                reported = due  # one report per blocking step
+                self._blocked = attribute(frame)
+
+    def stats(self):
+        lag = self._lag.to_dict()
+        lag['average'] = round(self._lag.mean, 3)
+        return {'lag': lag, 'samples': self._lag.count, 'slow_steps': self._slow_steps,
+                'offenders': dict(self._offenders.most_common(10))}
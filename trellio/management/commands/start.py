@@ -7,7 +7,7 @@ from ...management.exceptions import InvalidCMDArguments
 
 class TrellioHostCommand(ManagementCommand):
     '''
-    usage:python trellio.py start_service <config_path> <(optional)service_file_path>
+    usage:python trellio.py start_service <config_path> <(optional)service_file_path> <(optional)workers=N>
     '''
 
     name = 'runserver'
@@ -39,6 +39,8 @@ class TrellioHostCommand(ManagementCommand):
 
     def setup(self):
         self.setup_config()
+        if self.args.get('workers'):
+            self.config_manager.settings[ConfigHandler.workers_key] = int(self.args['workers'])
         self.setup_environment_variables()
         self.config_manager.setup_host()
 
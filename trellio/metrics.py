@@ -0,0 +1,114 @@
+"""
+Aggregator stats in the Prometheus text exposition format, served by HTTPService on /metrics.
+
+Series are written out in chunks, giving the event loop a turn between chunks, so that services with many
+endpoints keep serving requests while they are scraped. Stats sources registered with the Aggregator are
+exposed as gauges named trellio_<source>_<stat>, labelled with the keys they are nested under.
+"""
+import asyncio
+import re
+from numbers import Number
+
+from .utils.stats import Aggregator, Stats
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)  # milliseconds
+CHUNK_SIZE = 500  # lines written before the event loop gets a turn
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _header(name, metric_type, help_text):
+    return '# HELP {0} {2}\n# TYPE {0} {1}\n'.format(name, metric_type, help_text)
+
+
+def _request_lines():
+    tree = Aggregator.stat_tree().sub
+    yield _header('trellio_requests_total', 'counter', 'Requests served by server type, endpoint and status')
+    for server_type, type_unit in list(tree.items()):
+        for endpoint, endpoint_unit in list(type_unit.sub.items()):
+            for status, status_unit in list(endpoint_unit.sub.items()):
+                labels = _labels((('server_type', server_type), ('endpoint', endpoint), ('status', status)))
+                yield 'trellio_requests_total{} {}\n'.format(labels, status_unit.count)
+
+    name = 'trellio_request_duration_milliseconds'
+    yield _header(name, 'histogram', 'Time taken to serve requests by server type and endpoint')
+    for server_type, type_unit in list(tree.items()):
+        for endpoint, endpoint_unit in list(type_unit.sub.items()):
+            histogram = endpoint_unit.histogram
+            labels = (('server_type', server_type), ('endpoint', endpoint))
+            for bound, count in zip(LATENCY_BUCKETS, histogram.cumulative_counts(LATENCY_BUCKETS)):
+                yield '{}_bucket{} {}\n'.format(name, _labels(labels + (('le', bound),)), count)
+            yield '{}_bucket{} {}\n'.format(name, _labels(labels + (('le', '+Inf'),)), histogram.count)
+            yield '{}_sum{} {}\n'.format(name, _labels(labels), histogram.total)
+            yield '{}_count{} {}\n'.format(name, _labels(labels), histogram.count)
+
+
+def _in_flight_lines(clients):
+    yield _header('trellio_in_flight_requests', 'gauge', 'Requests being served by server type')
+    for server_type, stats in (('http', Stats.http_stats), ('tcp', Stats.tcp_stats)):
+        done = stats['total_responses'] + stats['total_errors'] + stats['timedout']
+        yield 'trellio_in_flight_requests{} {}\n'.format(_labels((('server_type', server_type),)),
+                                                         max(stats['total_requests'] - done, 0))
+    yield _header('trellio_client_pending_requests', 'gauge', 'Requests sent by clients awaiting a response')
+    for client in clients:
+        pending = getattr(client, '_pending_requests', None)
+        if pending is not None:
+            labels = _labels((('service', client.name), ('version', client.version)))
+            yield 'trellio_client_pending_requests{} {}\n'.format(labels, len(pending))
+
+
+def _flatten(stats, path=()):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, path + (key,))
+        elif isinstance(value, Number) and not isinstance(value, bool):
+            yield path, key, value
+
+
+def _source_lines():
+    for source, stats in Aggregator.dump_sources().items():
+        series = {}
+        for path, key, value in _flatten(stats):
+            name = _INVALID_NAME_CHARS.sub('_', 'trellio_{}_{}'.format(source, key))
+            labels = (('name', '/'.join(str(part) for part in path)),) if path else ()
+            series.setdefault(name, []).append('{}{} {}\n'.format(name, _labels(labels), value))
+        for name, lines in series.items():
+            yield '# TYPE {} gauge\n'.format(name)
+            yield from lines
+
+
+def iter_metrics(clients=()):
+    """
+    :return: iterator over the lines of the exposition, computed as it is consumed
+    """
+    yield from _request_lines()
+    yield from _in_flight_lines(clients)
+    yield from _source_lines()
+
+
+@asyncio.coroutine
+def write_metrics(response, clients=()):
+    """
+    Writes the exposition to a prepared StreamResponse
+    """
+    chunk = []
+    for line in iter_metrics(clients):
+        chunk.append(line)
+        if len(chunk) >= CHUNK_SIZE:
+            response.write(''.join(chunk).encode())
+            chunk = []
+            yield from response.drain()
+            yield from asyncio.sleep(0)
+    if chunk:
+        response.write(''.join(chunk).encode())
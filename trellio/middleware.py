@@ -0,0 +1,71 @@
+"""
+Middlewares listed in the MIDDLEWARES setting are instances with any of these hooks:
+
+    pre_request(handler, request)                  before an http route, a truthy return is the response
+    post_request(handler, response, request)       after an http route, a truthy return replaces the response
+    pre_api(handler, endpoint, params)             before a tcp @api, a truthy return is the result
+    post_api(handler, endpoint, params, result)    after a tcp @api, a truthy return replaces the result
+
+Hooks run in the order middlewares are listed, pre hooks stop at the first truthy return and so do post hooks.
+
+Services and views compile their middlewares into an http and an api Pipeline as soon as they are assigned, so
+that requests only go through the hooks that exist instead of looking every middleware up again. This holds for
+the ones ConfigHandler.enable_middlewares sets, for ones set in code on the middlewares attribute and for ones
+listed in the class body, which are compiled when the service or view is made.
+"""
+from asyncio import coroutine
+
+
+class Pipeline:
+    def __init__(self, middlewares=(), pre_hook='pre_request', post_hook='post_request'):
+        self._middlewares = tuple(middlewares)
+        self.pre = self._compile(pre_hook)
+        self.post = self._compile(post_hook)
+
+    @property
+    def middlewares(self):
+        return self._middlewares
+
+    def _compile(self, hook):
+        """
+        :return: (middleware, bound coroutine) tuples of the middlewares having hook, in the order they are listed
+        """
+        hooks = []
+        for middleware in self._middlewares:
+            func = getattr(middleware, hook, None)
+            if callable(func):
+                hooks.append((middleware, coroutine(func)))
+        return tuple(hooks)
+
+    def __bool__(self):
+        return bool(self.pre or self.post)
+
+
+def http_pipeline(middlewares=()) -> Pipeline:
+    return Pipeline(middlewares, 'pre_request', 'post_request')
+
+
+def api_pipeline(middlewares=()) -> Pipeline:
+    return Pipeline(middlewares, 'pre_api', 'post_api')
+
+
+EMPTY_HTTP_PIPELINE = http_pipeline()
+EMPTY_API_PIPELINE = api_pipeline()
+
+
+class MiddlewareHost:
+    """
+    Base of services and views, keeps http_pipeline and api_pipeline compiled from the middlewares attribute
+    """
+    middlewares = []
+    http_pipeline = EMPTY_HTTP_PIPELINE
+    api_pipeline = EMPTY_API_PIPELINE
+
+    def __init__(self):
+        self.middlewares = self.middlewares  # compiles the ones listed in the class body
+
+    def __setattr__(self, name, value):
+        super(MiddlewareHost, self).__setattr__(name, value)
+        if name == 'middlewares':
+            super(MiddlewareHost, self).__setattr__('http_pipeline', http_pipeline(value or ()))
+            super(MiddlewareHost, self).__setattr__('api_pipeline', api_pipeline(value or ()))
@@ -36,7 +36,8 @@ class _Packet:
 
 class ControlPacket(_Packet):
     @classmethod
-    def registration(cls, ip: str, port: int, node_id, name: str, version: str, dependencies, service_type: str):
+    def registration(cls, ip: str, port: int, node_id, name: str, version: str, dependencies, service_type: str,
+                     transport: dict = None):
         v = [{'name': dependency.name, 'version': dependency.version} for dependency in dependencies]
 
         params = {'name': name,
@@ -46,6 +47,8 @@ class ControlPacket(_Packet):
                   'node_id': node_id,
                   'dependencies': v,
                   'type': service_type}
+        if transport:
+            params['transport'] = transport  # e.g. unix socket path and host identity for same host clients
 
         packet = {'pid': cls._next_pid(), 'type': 'register', 'params': params}
         return packet
@@ -86,7 +89,8 @@ class ControlPacket(_Packet):
         return packet
 
     @classmethod
-    def activated(cls, instances):
+    def activated(cls, instances, transports=None):
+        transports = transports or {}
         dependencies = []
         for k, v in instances.items():
             dependency = defaultdict(list)
@@ -99,6 +103,8 @@ class ControlPacket(_Packet):
                     'node_id': node,
                     'type': service_type
                 }
+                if node in transports:
+                    dependency_node_packet['transport'] = transports[node]
                 dependency['addresses'].append(dependency_node_packet)
             dependencies.append(dependency)
         params = {
@@ -140,25 +146,31 @@ class ControlPacket(_Packet):
         return packet
 
     @classmethod
-    def new_instance(cls, name, version, host, port, node_id, service_type):
+    def new_instance(cls, name, version, host, port, node_id, service_type, transport=None):
         params = {'name': name, 'version': version, 'host': host, 'port': port, 'node_id': node_id,
                   'service_type': service_type}
-        return {'pid': cls._next_pid(),
-                'type': 'new_instance',
-                'params': params}
+        packet = {'pid': cls._next_pid(),
+                  'type': 'new_instance',
+                  'params': params}
+        if transport:
+            packet['transport'] = transport  # outside params, which older clients unpack as keyword arguments
+        return packet
 
 
 class MessagePacket(_Packet):
     @classmethod
-    def request(cls, name, version, app_name, packet_type, endpoint, params, entity):
-        return {'pid': cls._next_pid(),
-                'app': app_name,
-                'name': name,
-                'version': version,
-                'entity': entity,
-                'endpoint': endpoint,
-                'type': packet_type,
-                'payload': params}
+    def request(cls, name, version, app_name, packet_type, endpoint, params, entity, trace=None):
+        packet = {'pid': cls._next_pid(),
+                  'app': app_name,
+                  'name': name,
+                  'version': version,
+                  'entity': entity,
+                  'endpoint': endpoint,
+                  'type': packet_type,
+                  'payload': params}
+        if trace is not None:
+            packet['trace'] = trace  # span context, outside params which are passed on to the api
+        return packet
 
     @classmethod
     def publish(cls, publish_id, name, version, endpoint, payload):
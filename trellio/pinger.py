@@ -5,6 +5,7 @@ import logging
 from aiohttp import request
 
 from .packet import ControlPacket
+from .timing_wheel import get_wheel
 
 PING_TIMEOUT = 10
 PING_INTERVAL = 5
@@ -53,7 +54,8 @@ class Pinger:
             asyncio.async(self.send_ping(payload=payload))
 
     def _start_timer(self, payload=None):
-        self._timer = self._loop.call_later(self._timeout, functools.partial(self._on_timeout, payload=payload))
+        self._timer = get_wheel(self._loop).call_later(self._timeout,
+                                                       functools.partial(self._on_timeout, payload=payload))
 
     def stop(self):
         if self._timer is not None:
@@ -0,0 +1,115 @@
+"""
+Stack sampling profiler run on a live process, served by HTTPService on /_profile.
+
+A thread wakes up every interval and reads the stacks of the other threads with sys._current_frames, so the
+event loop is only held for as long as it takes to copy one sample. Samples are counted as collapsed stacks,
+one line of semicolon separated frames and a count per distinct stack, which flamegraph.pl and speedscope read.
+Stacks are rooted at the service and thread, and the ones serving an endpoint are grouped under a frame naming it.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from .context import request_context
+from .loop_monitor import endpoint_of
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_SECONDS = 10
+MAX_SECONDS = 300
+
+_lock = threading.Lock()  # one profile at a time, sampling overhead adds up
+_paths = sorted({os.path.abspath(path) for path in sys.path}, key=len, reverse=True)
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _short_path(filename):
+    for path in _paths:
+        if filename.startswith(path + os.sep):
+            return filename[len(path) + 1:]
+    return filename
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        """
+        :param interval: seconds between samples
+        """
+        self._interval = interval
+        self._stacks = Counter()
+        self._names = {}  # code -> frame name, code objects outlive the profile of a running process
+        self.samples = 0
+
+    def _name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            location = '{}:{}'.format(_short_path(code.co_filename), code.co_firstlineno)
+            name = self._names[code] = '{} ({})'.format(code.co_name, location)
+        return name
+
+    def sample(self, ignore=()):
+        """
+        Counts the stacks of the threads running, but for the ones in ignore
+        """
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        root = request_context().service_name or 'trellio'
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in ignore:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            names = [self._name(each.f_code) for each in reversed(frames)]
+            endpoint = endpoint_of(frames)
+            if endpoint is not None:
+                names.insert(0, '[{}]'.format(endpoint))
+            self._stacks[';'.join([root, threads.get(thread_id, str(thread_id))] + names)] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """
+        Samples the other threads for seconds, blocking the calling thread
+        """
+        ignore = (threading.get_ident(),)
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            self.sample(ignore)
+            time.sleep(self._interval)
+
+    def collapsed(self):
+        """
+        :return: the sampled stacks in collapsed format, most sampled first
+        """
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in self._stacks.most_common())
+
+
+@asyncio.coroutine
+def profile(seconds, interval=DEFAULT_INTERVAL, loop=None):
+    """
+    Samples the process from a thread of its own for seconds, raising ProfilerBusy if a profile is running
+
+    :return: the sampled stacks in collapsed format
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy('a profile is already running')
+    loop = loop or asyncio.get_event_loop()
+    profiler = SamplingProfiler(interval)
+    done = asyncio.Future(loop=loop)
+
+    def run():
+        collapsed = ''
+        try:
+            profiler.run(seconds)
+            collapsed = profiler.collapsed()  # formatted here rather than on the event loop
+        finally:
+            _lock.release()
+            loop.call_soon_threadsafe(done.set_result, collapsed)
+
+    threading.Thread(target=run, name='trellio-profiler', daemon=True).start()
+    return (yield from asyncio.shield(done, loop=loop))  # the profile runs its course if the request goes away
@@ -1,5 +1,6 @@
-from .jsonprotocol import TrellioProtocol
+from .codec import JSON_CODEC
+from .jsonprotocol import TrellioProtocol, JSON_FRAMING
 
 
-def get_trellio_protocol(handler):
-    return TrellioProtocol(handler)
+def get_trellio_protocol(handler, framing=JSON_FRAMING, codec=JSON_CODEC, peer=None, **write_limits):
+    return TrellioProtocol(handler, framing=framing, codec=codec, peer=peer, **write_limits)
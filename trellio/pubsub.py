@@ -1,11 +1,11 @@
 import asyncio
-import json
 import logging
 
 import asyncio_redis as redis
+from asyncio_redis.encoders import BytesEncoder
 
+from .codec import JSON_CODEC, get_codec
 from .utils.helpers import Borg
-from .utils.jsonencoder import TrellioEncoder
 
 
 class PubSub:
@@ -33,23 +33,25 @@ class PubSub:
         self._conn = await self._get_conn()
         return self._conn
 
-    async def publish(self, endpoint: str, payload: str):
+    async def publish(self, endpoint: str, payload):
         """
         Publish to an endpoint.
         :param str endpoint: Key by which the endpoint is recognised.
                          Subscribers will use this key to listen to events
-        :param str payload: Payload to publish with the event
+        :param payload: Payload to publish with the event, str is published utf-8 encoded and bytes as they are
         :return: A boolean indicating if the publish was successful
         """
+        if isinstance(payload, str):
+            payload = payload.encode()
         if self._conn is not None:
             try:
-                await self._conn.publish(endpoint, payload)
+                await self._conn.publish(endpoint.encode(), payload)
                 return True
             except redis.Error as e:
                 self._logger.error('Publish failed with error %s', repr(e))
         return False
 
-    async def subscribe(self, endpoints: list, handler):
+    async def subscribe(self, endpoints: list, handler, raw=False):
         """
         Subscribe to a list of endpoints
         :param endpoints: List of endpoints the subscribers is interested to subscribe to
@@ -57,26 +59,32 @@ class PubSub:
         :param handler: The callback to call when a particular event is published.
                         Must take two arguments, a channel to which the event was published
                         and the payload.
+        :param raw: Hand the payload to handler as the bytes published instead of decoding it to str from utf-8
         :return:
         """
         connection = await self._get_conn()
         subscriber = await connection.start_subscribe()
-        await subscriber.subscribe(endpoints)
+        await subscriber.subscribe([endpoint.encode() for endpoint in endpoints])
         while True:
             payload = await subscriber.next_published()
-            handler(payload.channel, payload.value)
+            handler(payload.channel.decode(), payload.value if raw else payload.value.decode())
 
     async def _get_conn(self):
-        return await redis.Connection.create(self._redis_host, self._redis_port, auto_reconnect=True)
+        return await redis.Connection.create(self._redis_host, self._redis_port, encoder=BytesEncoder(),
+                                             auto_reconnect=True)
 
 
 class Publisher(Borg):
-    def __init__(self, service_name, service_version, pubsub_host, pubsub_port):
+    def __init__(self, service_name, service_version, pubsub_host, pubsub_port, codec=JSON_CODEC):
+        """
+        :param codec: name of a registered codec used to encode payloads, subscribers must use the same codec
+        """
         super(Publisher, self).__init__()
         self._service_name = service_name
         self._service_version = service_version
         self._host = pubsub_host
         self._port = pubsub_port
+        self._codec = get_codec(codec)
         self._pubsub_handler = None
 
     @property
@@ -93,18 +101,22 @@ class Publisher(Borg):
 
     def _publish(self, endpoint, payload):
         channel = self._get_pubsub_channel(endpoint)
-        asyncio.async(self._pubsub_handler.publish(channel, json.dumps(payload, cls=TrellioEncoder)))
+        asyncio.async(self._pubsub_handler.publish(channel, self._codec.encode(payload)))
 
     def _get_pubsub_channel(self, endpoint):
         return '/'.join((self.service_name, str(self.service_version), endpoint))
 
 
 class Subscriber:
-    def __init__(self, service_name, service_version, pubsub_host=None, pubsub_port=None):
+    def __init__(self, service_name, service_version, pubsub_host=None, pubsub_port=None, codec=JSON_CODEC):
+        """
+        :param codec: name of the registered codec the publisher encodes payloads with
+        """
         self._service_name = service_name
         self._service_version = service_version
         self._pubsub_host = pubsub_host
         self._pubsub_port = pubsub_port
+        self._codec = get_codec(codec)
         self._pubsub_handler = None
 
     @property
@@ -144,9 +156,9 @@ class Subscriber:
             fn = getattr(self.__class__, each)
             if callable(fn) and getattr(fn, 'is_subscribe', False):
                 subscription_list.append(self._get_pubsub_channel(fn.__name__))
-        await self._pubsub_handler.subscribe(subscription_list, handler=self.subscription_handler)
+        await self._pubsub_handler.subscribe(subscription_list, handler=self.subscription_handler, raw=True)
 
     def subscription_handler(self, channel, payload):
         service, version, endpoint = channel.split('/')
         func = getattr(self, endpoint)
-        asyncio.async(func(**json.loads(payload)))
+        asyncio.async(func(**self._codec.decode(payload)))
@@ -36,6 +36,7 @@ class Repository:
         self._registered_services = defaultdict(lambda: defaultdict(list))
         self._pending_services = defaultdict(list)
         self._service_dependencies = {}
+        self._transports = {}
         self._subscribe_list = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
         self._uptimes = tree()
         self.logger = logging.getLogger(__name__)
@@ -55,6 +56,12 @@ class Repository:
             if not self._service_dependencies.get(service.name):
                 self._service_dependencies[service_name] = service.dependencies
 
+    def set_transport(self, node_id, transport):
+        self._transports[node_id] = transport
+
+    def get_transports(self):
+        return self._transports
+
     def is_pending(self, name, version):
         return self._get_full_service_name(name, version) in self._pending_services
 
@@ -108,6 +115,7 @@ class Repository:
                         thehost = host
                         instances.remove(instance)
                         break
+        self._transports.pop(node_id, None)
         for name, nodes in self._uptimes.items():
             for host, uptimes in nodes.items():
                 if host == thehost and uptimes['node_id'] == node_id:
@@ -257,6 +265,8 @@ class Registry:
         service = Service(params['name'], params['version'], params['dependencies'], params['host'], params['port'],
                           params['node_id'], params['type'])
         self._repository.register_service(service)
+        if params.get('transport'):
+            self._repository.set_transport(params['node_id'], params['transport'])
         self._client_protocols[params['node_id']] = registry_protocol
         if params['node_id'] not in self._service_protocols.keys():
             self._connect_to_service(params['host'], params['port'], params['node_id'], params['type'])
@@ -271,7 +281,8 @@ class Registry:
                 for host, port, node, type in instances:
                     protocol = self._client_protocols[node]
                     protocol.send(ControlPacket.new_instance(
-                        service.name, service.version, service.host, service.port, service.node_id, service.type))
+                        service.name, service.version, service.host, service.port, service.node_id, service.type,
+                        self._repository.get_transports().get(service.node_id)))
 
     def _send_activated_packet(self, name, version, node):
         protocol = self._client_protocols.get(node, None)
@@ -305,7 +316,7 @@ class Registry:
             (dependency['name'], dependency['version']): self._repository.get_versioned_instances(dependency['name'],
                                                                                                   dependency['version'])
             for dependency in dependencies}
-        return ControlPacket.activated(instances)
+        return ControlPacket.activated(instances, self._repository.get_transports())
 
     def _connect_to_service(self, host, port, node_id, service_type):
         if service_type == 'tcp':
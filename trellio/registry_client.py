@@ -1,14 +1,16 @@
 import asyncio
 import logging
-import random
 from collections import defaultdict
 from functools import partial
 
 from retrial.retrial import retry
 
+from .balancer import LoadTracker, RandomBalancer
+from .hashring import HashRing
 from .packet import ControlPacket
 from .pinger import TCPPinger
 from .protocol_factory import get_trellio_protocol
+from .utils.helpers import host_identity
 
 try:
     from uvloop.loop import TCPTransport as Transport
@@ -41,7 +43,11 @@ class RegistryClient:
         self._conn_handler = None
         self._pending_requests = {}
         self._available_services = defaultdict(list)
-        self._assigned_services = defaultdict(lambda: defaultdict(list))
+        self._candidates = {}
+        self._rings = {}
+        self._unix_paths = {}
+        self._default_balancer = RandomBalancer()
+        self.load = LoadTracker()
         self._ssl_context = ssl_context
         self.logger = logging.getLogger(__name__)
 
@@ -53,11 +59,12 @@ class RegistryClient:
     def conn_handler(self, handler):
         self._conn_handler = handler
 
-    def register(self, ip, port, service, version, node_id, vendors, service_type):  # here vendors are tcp/http_clients
+    def register(self, ip, port, service, version, node_id, vendors, service_type,
+                 transport=None):  # here vendors are tcp/http_clients
         self._service = service
         self._version = version
         self._node_ids[service_type] = node_id
-        packet = ControlPacket.registration(ip, port, node_id, service, version, vendors, service_type)
+        packet = ControlPacket.registration(ip, port, node_id, service, version, vendors, service_type, transport)
         self._protocol.send(packet)
 
     def get_instances(self, name, version):
@@ -100,6 +107,7 @@ class RegistryClient:
             self.bus.registration_complete()
         elif packet['type'] == 'new_instance':
             # TODO : once method for both vendors and new instance
+            self._cache_transport(packet['params']['node_id'], packet.get('transport'))
             self.cache_instance(**packet['params'])
             self._handle_new_instance(**packet['params'])
         elif packet['type'] == 'deregister':
@@ -123,29 +131,28 @@ class RegistryClient:
         return None
 
     def get_random_service(self, service_name, service_type):
-        services = self._available_services[service_name]
-        services = [service for service in services if service[3] == service_type]
-        if len(services):
-            return random.choice(services)
+        return self.get_service(service_name, service_type, self._default_balancer)
+
+    def get_service(self, service_name, service_type, balancer):
+        candidates = self._candidates.get((service_name, service_type))
+        if candidates:
+            return balancer.choose(candidates, self.load)
         else:
             return None
 
-    def resolve(self, service: str, version: str, entity: str, service_type: str):
+    def resolve(self, service: str, version: str, entity: str, service_type: str, balancer=None):
+        """
+        :param entity: requests for the same entity stick to one node through a consistent hash ring, the
+                       balancer is not consulted for them
+        :param balancer: Balancer choosing among the nodes of the service, random choice when None
+        :return: (host, port, node_id, service_type) of the node to send to, None if there is none
+        """
         service_name = self._get_full_service_name(service, version)
         if entity is not None:
-            entity_map = self._assigned_services.get(service_name)
-            if entity_map is None:
-                self._assigned_services[service_name] = {}
-            entity_map = self._assigned_services.get(service_name)
-            if entity in entity_map:
-                return entity_map[entity]
-            else:
-                host, port, node_id, service_type = self.get_random_service(service_name, service_type)
-                if node_id is not None:
-                    entity_map[entity] = host, port, node_id, service_type
-                return host, port, node_id, service_type
+            ring = self._rings.get((service_name, service_type))
+            return ring.get(entity) if ring is not None else None
         else:
-            return self.get_random_service(service_name, service_type)
+            return self.get_service(service_name, service_type, balancer or self._default_balancer)
 
     @staticmethod
     def _get_full_service_name(service, version):
@@ -157,28 +164,53 @@ class RegistryClient:
             for address in dependency['addresses']:
                 self._available_services[vendor_name].append(
                     (address['host'], address['port'], address['node_id'], address['type']))
+                self._cache_transport(address['node_id'], address.get('transport'))
+            self._update_candidates(vendor_name)
         self.logger.debug('Connection cache after registration is %s', self._available_services)
 
     def cache_instance(self, name, version, host, port, node_id, service_type):
         vendor = self._get_full_service_name(name, version)
         self._available_services[vendor].append((host, port, node_id, service_type))
+        self._update_candidates(vendor)
         self.logger.debug('Connection cache on getting new instance is %s', self._available_services)
 
+    def _cache_transport(self, node_id, transport):
+        if transport and transport.get('unix_path') and transport.get('host_id') == host_identity():
+            self._unix_paths[node_id] = transport['unix_path']
+
+    def cache_stats(self):
+        return {'services': len(self._available_services),
+                'nodes': sum(len(nodes) for nodes in self._available_services.values()),
+                'candidates': len(self._candidates), 'rings': len(self._rings), 'unix_paths': len(self._unix_paths),
+                'pending_requests': len(self._pending_requests)}
+
+    def get_unix_path(self, node_id):
+        """
+        :return: path of the unix socket of a node on this host, None for nodes only reachable over tcp
+        """
+        return self._unix_paths.get(node_id)
+
+    def _update_candidates(self, vendor):
+        """ Keeps the per type node lists balancers choose from and the entity hash rings in step with the
+        connection cache
+        """
+        by_type = defaultdict(list)
+        for service in self._available_services[vendor]:
+            by_type[service[3]].append(service)
+        for service_type in ('tcp', 'http'):
+            self._candidates[(vendor, service_type)] = by_type[service_type]
+            self._rings[(vendor, service_type)] = HashRing(by_type[service_type])
+
     def _handle_deregistration(self, packet):
         params = packet['params']
         vendor = self._get_full_service_name(params['name'], params['version'])
         node = params['node_id']
-        for each in self._available_services[vendor]:
-            if each[2] == node:
-                self._available_services[vendor].remove(each)
-        entity_map = self._assigned_services.get(vendor)
-        if entity_map is not None:
-            stale_entities = []
-            for entity, node_id in entity_map.items():
-                if node == node_id:
-                    stale_entities.append(entity)
-            for entity in stale_entities:
-                entity_map.pop(entity)
+        self._available_services[vendor] = [each for each in self._available_services[vendor] if each[2] != node]
+        self._update_candidates(vendor)
+        self.load.forget(node)
+        self._unix_paths.pop(node, None)
+        if self.bus is not None:
+            self.bus.remove_node(node)
         self.logger.debug('Connection cache after deregister is %s', self._available_services)
 
     def _handle_subscriber_packet(self, packet):
@@ -1,19 +1,85 @@
+import asyncio
+import logging
+from weakref import WeakSet
+
+from .utils.stats import Aggregator
+
+logger = logging.getLogger(__name__)
+
+_queues = WeakSet()  # send queues of open connections, for stats
+
+
 class SendQueue:
     """
-    Queues packets to send when transport can send
+    Queues packets to send when transport can send, all packets queued within an event loop iteration
+    are written to the transport together with a single writelines call. Spans queued along with packets get
+    the time the packet waited in the queue and took to encode, and are finished.
     """
 
-    def __init__(self, transport, can_send_func=lambda: True, pre_process_func=lambda x: x):
+    def __init__(self, transport, can_send_func=lambda: True, pre_process_func=lambda x: x, loop=None):
         self._q = []
+        self._spans = {}  # index in the queue -> span of the packet
         self._transport = transport
         self._can_send = can_send_func
         self._pre_process = pre_process_func
+        self._loop = loop or asyncio.get_event_loop()
+        self._flush_handle = None
+        _queues.add(self)
+
+    @property
+    def buffered(self):
+        """
+        bytes written to the transport it hasn't sent yet
+        """
+        try:
+            return self._transport.get_write_buffer_size()
+        except (AttributeError, NotImplementedError):
+            return 0
+
+    def __len__(self):
+        return len(self._q)
 
-    def send(self, packet=None):
+    def send(self, packet=None, span=None):
         if packet:
+            if span is not None:
+                self._spans[len(self._q)] = span
             self._q.append(packet)
-        if self._can_send():
-            for each in self._q:
-                each = self._pre_process(each)
-                self._transport.write(each)
+        if self._flush_handle is None and self._q:
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        self.flush()
+
+    def flush(self, force=False):
+        """
+        Writes out queued packets right away if the transport can send, or anyway when forced to
+        """
+        if self._q and (force or self._can_send()):
+            spans = self._spans
+            if spans:
+                self._spans = {}
+            frames = []
+            for index, each in enumerate(self._q):
+                span = spans.get(index) if spans else None
+                if span is not None:
+                    span.mark('send_queue')
+                try:
+                    frames.append(self._pre_process(each))
+                except Exception:
+                    logger.exception('Dropping packet that could not be encoded %s', each)
+                if span is not None:
+                    span.mark('serialization')
+                    span.finish(span.error)
             self._q.clear()
+            self._transport.writelines(frames)
+
+
+def queue_stats():
+    queues = list(_queues)
+    depths = [len(queue) for queue in queues]
+    return {'queues': len(queues), 'queued': sum(depths), 'max_queued': max(depths, default=0),
+            'buffered_bytes': sum(queue.buffered for queue in queues)}
+
+
+Aggregator.register_source('send_queues', queue_stats)
@@ -1,19 +1,31 @@
 import asyncio
+import hmac
+import ipaddress
 import json
 import logging
-import socket
 import time
-from asyncio import iscoroutine, coroutine, wait_for, TimeoutError, Future, get_event_loop, async
+from asyncio import iscoroutine, coroutine, TimeoutError, Future, async
+from copy import deepcopy
 from functools import wraps, partial
 
-import setproctitle
 from again.utils import unique_hex
-from aiohttp.web import Response
+from aiohttp.web import Response, StreamResponse
 from retrial.retrial.retry import retry
 
 from trellio.packet import ControlPacket
-from .exceptions import RequestException, ClientException, TrellioServiceException
+from .exceptions import RequestException, ClientException, ServiceOverloaded, TrellioServiceException
+from .executors import PROCESS, check_executor, get_pool
+from .api_cache import MISSING, DEFAULT_CACHE_SIZE, APICache, get_cache, make_key
+from .codec import JSON_CODEC
+from .context import request_context
+from .jsonprotocol import JSON_FRAMING
+from .loop_monitor import runs_handlers
+from . import metrics, profiler
+from .middleware import EMPTY_API_PIPELINE, EMPTY_HTTP_PIPELINE, MiddlewareHost
 from .packet import MessagePacket
+from .timing_wheel import Deadline, get_wheel
+from .tracing import (CLIENT, SERVER, start_span, current_span, set_current_span, clear_current_span,
+                      context_from_headers, tracing_enabled)
 from .utils.helpers import Singleton  # we need non singleton subclasses
 from .utils.helpers import default_preflight_response
 from .utils.ordered_class_member import OrderedClassMembers
@@ -21,6 +33,10 @@ from .utils.stats import Aggregator, Stats
 from .views import HTTPView
 
 API_TIMEOUT = 60 * 10
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+_logger = logging.getLogger(__name__)
+_stats_logger = logging.getLogger('stats')
 
 
 def publish(func):
@@ -80,12 +96,17 @@ def _get_subscribe_decorator(func):
     return wrapper
 
 
-def request(func=None, timeout=600):
+def request(func=None, timeout=600, coalesce=False, cache_ttl=None, cache_size=None):
     """
     use to request an api call from a specific endpoint
+
+    :param coalesce: identical requests (same endpoint, entity and params) made while one is in flight share its
+                     response instead of being sent again, only for endpoints without side effects
+    :param cache_ttl: seconds successful responses are kept and returned for identical requests, implies coalesce
+    :param cache_size: responses kept in the cache, least recently used ones are evicted first
     """
     if func is None:
-        return partial(request, timeout=timeout)
+        return partial(request, timeout=timeout, coalesce=coalesce, cache_ttl=cache_ttl, cache_size=cache_size)
 
     @wraps(func)
     def wrapper(self, *args, **kwargs):
@@ -93,6 +114,8 @@ def request(func=None, timeout=600):
         self = params.pop('self', None)
         entity = params.pop('entity', None)
         app_name = params.pop('app_name', None)
+        if coalesce or cache_ttl:
+            return self._send_shared_request(app_name, func.__name__, entity, params, timeout, cache_ttl, cache_size)
         request_id = unique_hex()
         params['request_id'] = request_id
         future = self._send_request(app_name, endpoint=func.__name__, entity=entity, params=params, timeout=timeout)
@@ -102,7 +125,8 @@ def request(func=None, timeout=600):
     return wrapper
 
 
-def api(func=None, timeout=API_TIMEOUT):  # incoming
+def api(func=None, timeout=API_TIMEOUT, max_concurrency=None, max_queue=None, executor=None, pool=None,
+        cache_ttl=None, cache_size=None):  # incoming
     """
     provide a request/response api
     receives any requests here and return value is the response
@@ -110,11 +134,20 @@ def api(func=None, timeout=API_TIMEOUT):  # incoming
         - request_id
         - entity (partition/routing key)
         followed by kwargs
+    max_concurrency limits requests to the api running at once, up to max_queue more wait for their turn and
+    the rest are rejected as overloaded
+    executor 'thread' or 'process' runs a cpu bound api in the pool named pool, a pool per executor by default
+    cache_ttl keeps results for that many seconds, up to cache_size of them, and answers requests with the same
+    params from the cache, see trellio.api_cache.invalidate
     """
     if func is None:
-        return partial(api, timeout=timeout)
+        return partial(api, timeout=timeout, max_concurrency=max_concurrency, max_queue=max_queue,
+                       executor=executor, pool=pool, cache_ttl=cache_ttl, cache_size=cache_size)
     else:
-        wrapper = _get_api_decorator(func=func, timeout=timeout)
+        wrapper = _get_api_decorator(func=func, timeout=timeout, executor=executor, pool=pool, cache_ttl=cache_ttl,
+                                     cache_size=cache_size)
+        wrapper.max_concurrency = max_concurrency
+        wrapper.max_queue = max_queue
         return wrapper
 
 
@@ -126,30 +159,57 @@ def apideprecated(func=None, replacement_api=None):
         return wrapper
 
 
-def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=API_TIMEOUT):
+def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=API_TIMEOUT, executor=None, pool=None,
+                       cache_ttl=None, cache_size=None):
+    check_executor(func, executor)
+    cache = get_cache('{}.{}'.format(func.__module__, func.__qualname__), cache_ttl, cache_size) if cache_ttl else None
+    wrapped_func = coroutine(func)
+
     @coroutine
     @wraps(func)
+    @runs_handlers('tcp')
     def wrapper(*args, **kwargs):
-        _logger = logging.getLogger(__name__)
         start_time = int(time.time() * 1000)
         self = args[0]
         rid = kwargs.pop('request_id')
         entity = kwargs.pop('entity')
         from_id = kwargs.pop('from_id')
-        wrapped_func = func
         result = None
         error = None
         failed = False
 
         status = 'successful'
         success = True
-        if not iscoroutine(func):
-            wrapped_func = coroutine(func)
-
         Stats.tcp_stats['total_requests'] += 1
 
+        pipeline = getattr(self, 'api_pipeline', EMPTY_API_PIPELINE)
+        handled = False
+        span = current_span()
+        if span is not None:
+            span.mark('queue')
         try:
-            result = yield from wait_for(wrapped_func(self, **kwargs), timeout)
+            for _, pre_api in pipeline.pre:
+                result = yield from pre_api(self, func.__name__, kwargs)
+                if result:
+                    break
+            else:
+                if cache is not None:
+                    cache_key = make_key(kwargs)
+                    result = cache.get(cache_key)
+                    if result is not MISSING:
+                        status = 'cached'
+                if status != 'cached':
+                    with Deadline(timeout):
+                        if executor:
+                            result = yield from get_pool(pool or executor, executor).run(func, self, kwargs=kwargs)
+                        else:
+                            result = yield from wrapped_func(self, **kwargs)
+                    handled = True
+            for _, post_api in pipeline.post:
+                replacement = yield from post_api(self, func.__name__, kwargs, result)
+                if replacement:
+                    result = replacement
+                    break
 
         except TimeoutError as e:
             Stats.tcp_stats['timedout'] += 1
@@ -174,16 +234,12 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=AP
             _logger.exception('Unhandled exception %s for method %s ', e.__class__.__name__, func.__name__)
         else:
             Stats.tcp_stats['total_responses'] += 1
+            if cache is not None and handled:
+                cache.put(cache_key, result)
+        if span is not None:
+            span.mark('handler')
+            span.error = error
         end_time = int(time.time() * 1000)
-
-        hostname = socket.gethostname()
-        service_name = '_'.join(setproctitle.getproctitle().split('_')[1:-1])
-
-        logd = {
-            'endpoint': func.__name__,
-            'time_taken': end_time - start_time,
-            'hostname': hostname, 'service_name': service_name
-        }
         _logger.debug('Time taken for %s is %d milliseconds', func.__name__, end_time - start_time)
 
         # call to update aggregator, designed to replace the stats module.
@@ -202,6 +258,14 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=AP
     return wrapper
 
 
+def _finish_client_span(span, future):
+    if future.cancelled():
+        span.finish('cancelled')
+    else:
+        exception = future.exception()
+        span.finish(str(exception) if exception else None)
+
+
 def make_request(func, self, args, kwargs, method):
     params = func(self, *args, **kwargs)
     entity = params.pop('entity', None)
@@ -211,47 +275,49 @@ def make_request(func, self, args, kwargs, method):
     return response
 
 
+def _middleware_error(middleware, e):
+    return Response(status=400, content_type='application/json',
+                    body=json.dumps({'error': str(e), 'sector': getattr(middleware, 'middleware_info')}).encode())
+
+
 def _enable_http_middleware(func):  # pre and post http, processing
+    _func = coroutine(func)  # func is a generator object
+
     @wraps(func)
     async def f(self, *args, **kwargs):
-        if hasattr(self, 'middlewares'):
-            for i in self.middlewares:
-                if hasattr(i, 'pre_request'):
-                    pre_request = getattr(i, 'pre_request')
-                    if callable(pre_request):
-                        try:
-                            res = await pre_request(self, *args, **kwargs)  # passing service as first argument
-                            if res:
-                                return res
-                        except Exception as e:
-                            return Response(status=400, content_type='application/json',
-                                            body=json.dumps(
-                                                {'error': str(e), 'sector': getattr(i, 'middleware_info')}).encode())
-        _func = coroutine(func)  # func is a generator object
+        pipeline = getattr(self, 'http_pipeline', EMPTY_HTTP_PIPELINE)
+        for middleware, pre_request in pipeline.pre:
+            try:
+                res = await pre_request(self, *args, **kwargs)  # passing service as first argument
+                if res:
+                    return res
+            except Exception as e:
+                return _middleware_error(middleware, e)
         result = await _func(self, *args, **kwargs)
-        if hasattr(self, 'middlewares'):
-            for i in self.middlewares:
-                if hasattr(i, 'post_request'):
-                    post_request = getattr(i, 'post_request')
-                    if callable(post_request):
-                        try:
-                            res = await post_request(self, result, *args, **kwargs)
-                            if res:
-                                return res
-                        except Exception as e:
-                            return Response(status=400, content_type='application/json',
-                                            body=json.dumps(
-                                                {'error': str(e), 'sector': getattr(i, 'middleware_info')}).encode())
+        for middleware, post_request in pipeline.post:
+            try:
+                res = await post_request(self, result, *args, **kwargs)
+                if res:
+                    return res
+            except Exception as e:
+                return _middleware_error(middleware, e)
 
         return result
 
     return f
 
 
-def get_decorated_fun(method, path, required_params, timeout):
+def get_decorated_fun(method, path, required_params, timeout, executor=None, pool=None):
+    if executor == PROCESS:
+        raise ValueError('http handlers can only run in thread executors, requests are bound to the event loop')
+
     def decorator(func):
+        check_executor(func, executor)
+        wrapped_func = coroutine(func)
+
         @wraps(func)
         @_enable_http_middleware
+        @runs_handlers('http')
         def f(self, *args, **kwargs):
             if isinstance(self, HTTPServiceClient):
                 return (yield from make_request(func, self, args, kwargs, method))
@@ -272,14 +338,17 @@ def get_decorated_fun(method, path, required_params, timeout):
                         return Response(status=400, content_type='application/json', body=json.dumps(res_d).encode())
 
                 t1 = time.time()
-                wrapped_func = func
                 success = True
-                _logger = logging.getLogger()
-
-                if not iscoroutine(func):
-                    wrapped_func = coroutine(func)
+                span = None
+                if tracing_enabled():
+                    span = start_span(func.__name__, SERVER, context_from_headers(args[0].headers))
+                    set_current_span(span)
                 try:
-                    result = yield from wait_for(wrapped_func(self, *args, **kwargs), timeout)
+                    with Deadline(timeout):
+                        if executor:
+                            result = yield from get_pool(pool or executor, executor).run(func, self, args, kwargs)
+                        else:
+                            result = yield from wrapped_func(self, *args, **kwargs)
 
                 except TimeoutError as e:
                     Stats.http_stats['timedout'] += 1
@@ -302,18 +371,15 @@ def get_decorated_fun(method, path, required_params, timeout):
                     raise e
 
                 else:
-                    t2 = time.time()
-                    hostname = socket.gethostname()
-                    service_name = '_'.join(setproctitle.getproctitle().split('_')[1:-1])
                     status = result.status
-
-                    logd = {
-                        'status': result.status,
-                        'time_taken': int((t2 - t1) * 1000),
-                        'type': 'http',
-                        'hostname': hostname, 'service_name': service_name
-                    }
-                    logging.getLogger('stats').debug(logd)
+                    if _stats_logger.isEnabledFor(logging.DEBUG):
+                        context = request_context()
+                        _stats_logger.debug({
+                            'status': result.status,
+                            'time_taken': int((time.time() - t1) * 1000),
+                            'type': 'http',
+                            'hostname': context.hostname, 'service_name': context.service_name
+                        })
                     Stats.http_stats['total_responses'] += 1
                     return result
 
@@ -321,6 +387,10 @@ def get_decorated_fun(method, path, required_params, timeout):
                     t2 = time.time()
                     Aggregator.update_stats(endpoint=func.__name__, status=status, success=success,
                                             server_type='http', time_taken=int((t2 - t1) * 1000))
+                    if span is not None:
+                        span.mark('handler')
+                        span.finish(None if success else str(status))
+                        clear_current_span()  # the task serves the next requests of a keep-alive connection
 
         f.is_http_method = True
         f.method = method
@@ -333,36 +403,36 @@ def get_decorated_fun(method, path, required_params, timeout):
     return decorator
 
 
-def get(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('get', path, required_params, timeout)
+def get(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('get', path, required_params, timeout, executor, pool)
 
 
-def head(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('head', path, required_params, timeout)
+def head(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('head', path, required_params, timeout, executor, pool)
 
 
-def options(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('options', path, required_params, timeout)
+def options(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('options', path, required_params, timeout, executor, pool)
 
 
-def patch(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('patch', path, required_params, timeout)
+def patch(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('patch', path, required_params, timeout, executor, pool)
 
 
-def post(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('post', path, required_params, timeout)
+def post(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('post', path, required_params, timeout, executor, pool)
 
 
-def put(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('put', path, required_params, timeout)
+def put(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('put', path, required_params, timeout, executor, pool)
 
 
-def trace(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('put', path, required_params, timeout)
+def trace(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('put', path, required_params, timeout, executor, pool)
 
 
-def delete(path=None, required_params=None, timeout=API_TIMEOUT):
-    return get_decorated_fun('delete', path, required_params, timeout)
+def delete(path=None, required_params=None, timeout=API_TIMEOUT, executor=None, pool=None):
+    return get_decorated_fun('delete', path, required_params, timeout, executor, pool)
 
 
 class _Service:
@@ -370,9 +440,10 @@ class _Service:
     _REQ_PKT_STR = 'request'
     _RES_PKT_STR = 'response'
 
-    def __init__(self, service_name, service_version):
+    def __init__(self, service_name, service_version, balancer=None):
         self._service_name = service_name.lower()
         self._service_version = str(service_version)
+        self._balancer = balancer
         self._tcp_bus = None
         self._pubsub_bus = None
         self._http_bus = None
@@ -389,36 +460,103 @@ class _Service:
     def properties(self):
         return self.name, self.version
 
+    @property
+    def balancer(self):
+        """
+        Balancer choosing the node of the service a request goes to, random choice when None
+        """
+        return self._balancer
+
     @staticmethod
     def time_future(future: Future, timeout: int):
+        """
+        Fails future with a TimeoutError unless it is done within timeout seconds
+        """
         def timer_callback(f):
             if not f.done() and not f.cancelled():
                 f.set_exception(TimeoutError())
 
-        get_event_loop().call_later(timeout, timer_callback, future)
+        timer = get_wheel().call_later(timeout, timer_callback, future)
+        future.add_done_callback(lambda _: timer.cancel())
+        return timer
 
 
 class TCPServiceClient(Singleton, _Service):
-    def __init__(self, service_name, service_version, ssl_context=None):
+    def __init__(self, service_name, service_version, ssl_context=None, framing=JSON_FRAMING, codec=JSON_CODEC,
+                 min_connections=1, max_connections=4, balancer=None, local_copy=False):
         if not self.has_inited():  # to maintain singleton behaviour
-            super(TCPServiceClient, self).__init__(service_name, service_version)
+            super(TCPServiceClient, self).__init__(service_name, service_version, balancer=balancer)
             self._pending_requests = {}
             self.tcp_bus = None
             self._ssl_context = ssl_context
+            self._framing = framing
+            self._codec = codec
+            self._min_connections = min_connections
+            self._max_connections = max_connections
+            self._local_copy = local_copy
+            self._in_flight = {}
+            self._response_caches = {}
             self.init_done()
 
     @property
     def ssl_context(self):
         return self._ssl_context
 
+    @property
+    def framing(self):
+        """
+        framing offered to the service on connect, 'length' uses length prefixed frames when the service supports
+        them and falls back to the json stream otherwise
+        """
+        return self._framing
+
+    @property
+    def codec(self):
+        """
+        codec offered to the service on connect, binary codecs are used only over length prefixed framing and
+        json is used when the service doesn't have the codec
+        """
+        return self._codec
+
+    @property
+    def min_connections(self):
+        """
+        connections kept open to every node of the service
+        """
+        return self._min_connections
+
+    @property
+    def max_connections(self):
+        """
+        connections a node's pool may grow to while all of its connections are busy
+        """
+        return self._max_connections
+
+    @property
+    def local_copy(self):
+        """
+        requests to the service when it is hosted in the same process call its apis directly, with this set params
+        and results are deep copied so that neither side sees the other mutate them
+        """
+        return self._local_copy
+
     def _send_request(self, app_name, endpoint, entity, params, timeout):
+        span = start_span('{}.{}'.format(self.name, endpoint), CLIENT)
         packet = MessagePacket.request(self.name, self.version, app_name, _Service._REQ_PKT_STR, endpoint, params,
-                                       entity)
+                                       entity, trace=span.context() if span else None)
         future = Future()
+        if span is not None:
+            future.add_done_callback(partial(_finish_client_span, span))
         request_id = params['request_id']
         self._pending_requests[request_id] = future
+        future.add_done_callback(lambda _: self._pending_requests.pop(request_id, None))
+        local_bus = self.tcp_bus.local_bus(packet) if self.tcp_bus else None
         try:
-            self.tcp_bus.send(packet)
+            if local_bus is not None:
+                self.tcp_bus.send_local(local_bus, deepcopy(packet) if self._local_copy else packet,
+                                        self._process_local_response)
+            else:
+                self.tcp_bus.send(packet)
         except ClientException:
             if not future.done() and not future.cancelled():
                 error = 'Client not found'
@@ -428,6 +566,35 @@ class TCPServiceClient(Singleton, _Service):
         _Service.time_future(future, timeout)
         return future
 
+    def _send_shared_request(self, app_name, endpoint, entity, params, timeout, cache_ttl, cache_size):
+        key = (endpoint, entity, make_key(params))
+        cache = None
+        if cache_ttl:
+            cache = self._response_caches.get(endpoint)
+            if cache is None:
+                cache = self._response_caches[endpoint] = APICache(endpoint, cache_ttl,
+                                                                   cache_size or DEFAULT_CACHE_SIZE)
+            result = cache.get(key)
+            if result is not MISSING:
+                future = Future()
+                future.set_result(result)
+                return future
+        future = self._in_flight.get(key)
+        if future is None:
+            params['request_id'] = unique_hex()
+            future = self._send_request(app_name, endpoint=endpoint, entity=entity, params=params, timeout=timeout)
+            self._in_flight[key] = future
+            future.add_done_callback(partial(self._shared_request_done, key, cache))
+        return asyncio.shield(future)  # one caller cancelling mustn't cancel the request for the others
+
+    def _shared_request_done(self, key, cache, future):
+        self._in_flight.pop(key, None)
+        if cache is not None and not future.cancelled() and future.exception() is None:
+            cache.put(key, future.result())
+
+    def response_cache_stats(self):
+        return {endpoint: cache.stats() for endpoint, cache in self._response_caches.items()}
+
     def receive(self, packet: dict, protocol, transport):
         if packet['type'] == 'ping':
             pass
@@ -442,6 +609,9 @@ class TCPServiceClient(Singleton, _Service):
         else:
             print('Invalid packet', packet)
 
+    def _process_local_response(self, packet):
+        self._process_response(deepcopy(packet) if self._local_copy else packet)
+
     def _process_response(self, packet):
         payload = packet['payload']
         request_id = payload['request_id']
@@ -452,12 +622,20 @@ class TCPServiceClient(Singleton, _Service):
             if 'replacement_api' in payload:
                 warning += ', New API: ' + payload['replacement_api']
             logging.getLogger().warning(warning)
-        future = self._pending_requests.pop(request_id)
+        future = self._pending_requests.pop(request_id, None)
+        if future is None:
+            logging.getLogger(__name__).debug('Dropping response to timed out request %s', request_id)
+            return
         if has_result:
             if not future.done() and not future.cancelled():
                 future.set_result(payload['result'])
         elif has_error:
-            if payload.get('failed', False):
+            if payload.get('overloaded', False):
+                exception = ServiceOverloaded(payload['error'])
+                exception.error = payload['error']
+                if not future.done() and not future.cancelled():
+                    future.set_exception(exception)
+            elif payload.get('failed', False):
                 if not future.done() and not future.cancelled():
                     future.set_exception(Exception(payload['error']))
             else:
@@ -480,9 +658,10 @@ class TCPServiceClient(Singleton, _Service):
             self.tcp_bus._registry_client._handle_deregistration(packet)
 
 
-class _ServiceHost(_Service):
+class _ServiceHost(_Service, MiddlewareHost):
     def __init__(self, service_name, service_version, host_ip, host_port):
         super(_ServiceHost, self).__init__(service_name, service_version)
+        MiddlewareHost.__init__(self)
         self._node_id = unique_hex()
         self._ip = host_ip
         self._port = host_port
@@ -514,7 +693,7 @@ class _ServiceHost(_Service):
     def http_bus(self, bus):
         for client in self._clients:
             if isinstance(client, HTTPServiceClient):
-                client._http_bus = self._http_bus
+                client.http_bus = bus
         self._http_bus = bus
 
     # @property
@@ -552,14 +731,47 @@ class _ServiceHost(_Service):
 
 
 class TCPService(_ServiceHost):
-    def __init__(self, service_name, service_version, host_ip=None, host_port=None, ssl_context=None):
+    def __init__(self, service_name, service_version, host_ip=None, host_port=None, ssl_context=None,
+                 max_concurrency=None, max_queue=None, unix_path=None):
         super(TCPService, self).__init__(service_name, service_version, host_ip, host_port)
         self._ssl_context = ssl_context
+        self._unix_path = unix_path
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
 
     @property
     def ssl_context(self):
         return self._ssl_context
 
+    @property
+    def unix_path(self):
+        """
+        path of a unix socket the service listens on besides its tcp port, advertised to clients on the same host
+        """
+        return self._unix_path
+
+    @unix_path.setter
+    def unix_path(self, path):
+        self._unix_path = path
+
+    @property
+    def max_concurrency(self):
+        """
+        requests to all apis of the service running at once, unlimited when None
+        """
+        return self._max_concurrency
+
+    @property
+    def max_queue(self):
+        """
+        requests waiting for their turn once max_concurrency is reached, further ones are rejected as overloaded
+        """
+        return self._max_queue
+
+    def set_limits(self, max_concurrency=None, max_queue=None):
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+
     # def _publish(self, endpoint, payload):
     #     self._pubsub_bus.publish(self.name, self.version, endpoint, payload)
     #
@@ -585,14 +797,26 @@ class TCPService(_ServiceHost):
         return packet
 
 
+def _error_response(status, error):
+    return Response(status=status, content_type='application/json', body=json.dumps({'error': error}).encode())
+
+
 class HTTPService(_ServiceHost, metaclass=OrderedClassMembers):
     def __init__(self, service_name, service_version, host_ip=None, host_port=None, ssl_context=None,
                  allow_cross_domain=True,
-                 preflight_response=default_preflight_response):
+                 preflight_response=default_preflight_response, admin_token=None, trust_loopback=False):
+        """
+        :param admin_token: lets requests sending it in the X-Admin-Token header use admin routes like /_profile,
+                            which are refused to everyone without it
+        :param trust_loopback: serves admin routes to any client on the same host without the token as well, only
+                               for services not behind a reverse proxy on their host
+        """
         super(HTTPService, self).__init__(service_name, service_version, host_ip, host_port)
         self._ssl_context = ssl_context
         self._allow_cross_domain = allow_cross_domain
         self._preflight_response = preflight_response
+        self._admin_token = admin_token.encode() if isinstance(admin_token, str) else admin_token
+        self._trust_loopback = trust_loopback
 
     @property
     def ssl_context(self):
@@ -615,14 +839,61 @@ class HTTPService(_ServiceHost, metaclass=OrderedClassMembers):
         res_d = Aggregator.dump_stats()
         return Response(status=200, content_type='application/json', body=json.dumps(res_d).encode())
 
+    @get('/metrics')
+    def metrics(self, request):
+        response = StreamResponse(headers={'Content-Type': metrics.CONTENT_TYPE})
+        yield from response.prepare(request)
+        yield from metrics.write_metrics(response, self.clients)
+        yield from response.write_eof()
+        return response
+
+    def is_admin(self, request):
+        token = request.headers.get(ADMIN_TOKEN_HEADER)
+        if self._admin_token and token:
+            # compared as bytes, compare_digest takes no str with non ascii characters
+            return hmac.compare_digest(token.encode('utf-8', 'surrogateescape'), self._admin_token)
+        if not self._trust_loopback:
+            return False
+        peername = request.transport.get_extra_info('peername') if request.transport else None
+        if not isinstance(peername, tuple):  # unix socket
+            return peername is not None
+        try:
+            return ipaddress.ip_address(peername[0]).is_loopback
+        except ValueError:
+            return False
+
+    @get('/_profile')
+    def profile(self, request):
+        if not self.is_admin(request):
+            return _error_response(403, 'Admin route')
+        try:
+            seconds = float(request.GET.get('seconds', profiler.DEFAULT_SECONDS))
+        except ValueError:
+            seconds = 0
+        if not 0 < seconds <= profiler.MAX_SECONDS:
+            return _error_response(400, 'seconds must be more than 0 and at most {}'.format(profiler.MAX_SECONDS))
+        try:
+            collapsed = yield from profiler.profile(seconds)
+        except profiler.ProfilerBusy as e:
+            return _error_response(409, str(e))
+        return Response(status=200, content_type='text/plain', text=collapsed)
+
 
 class HTTPServiceClient(Singleton, _Service):
-    def __init__(self, service_name, service_version):
+    def __init__(self, service_name, service_version, balancer=None):
         if not self.has_inited():
-            super(HTTPServiceClient, self).__init__(service_name, service_version)
+            super(HTTPServiceClient, self).__init__(service_name, service_version, balancer=balancer)
             self.init_done()
 
+    @property
+    def http_bus(self):
+        return self._http_bus
+
+    @http_bus.setter
+    def http_bus(self, bus):
+        self._http_bus = bus
+
     def _send_http_request(self, app_name, method, entity, params):
         response = yield from self._http_bus.send_http_request(app_name, self.name, self.version, method, entity,
-                                                               params)
+                                                               params, balancer=self.balancer)
         return response
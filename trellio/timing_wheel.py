@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import math
+from weakref import WeakKeyDictionary
+
+TICK = 0.1  # seconds between two slots of the wheel, timers fire at most this late
+SLOTS = 512  # slots in a revolution, longer timers wait for some revolutions in their slot
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """
+    Handle of a callback scheduled on a TimingWheel
+    """
+    __slots__ = ('_wheel', '_slot', '_rounds', '_callback', '_args', '_cancelled')
+
+    def __init__(self, wheel, slot, rounds, callback, args):
+        self._wheel = wheel
+        self._slot = slot
+        self._rounds = rounds
+        self._callback = callback
+        self._args = args
+        self._cancelled = False
+
+    def cancel(self):
+        if not self._cancelled:
+            self._cancelled = True
+            self._wheel._remove(self)
+
+    def cancelled(self):
+        return self._cancelled
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel sharing one event loop timer between any number of timeouts. Scheduling and cancelling
+    are O(1), every tick only visits the timers hashed to its slot and the loop timer is stopped while the wheel
+    is empty.
+    """
+
+    def __init__(self, tick=TICK, slots=SLOTS, loop=None):
+        self._tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._cursor = 0
+        self._count = 0
+        self._next = None  # when the slot at the cursor is due
+        self._handle = None
+        self._expiring = False
+        self._loop = loop or asyncio.get_event_loop()
+
+    def __len__(self):
+        return self._count
+
+    def call_later(self, delay, callback, *args):
+        """
+        Calls callback(*args) once delay seconds have passed, up to a tick later
+        :return: Timer which can be cancelled
+        """
+        if self._handle is None and not self._expiring:
+            self._next = self._loop.time() + self._tick
+            self._handle = self._loop.call_at(self._next, self._advance)
+        ticks = max(int(math.ceil((self._loop.time() + delay - self._next) / self._tick)) + 1, 1)
+        if self._expiring:
+            ticks = max(ticks, 2)  # timer callbacks are expiring the slot at the cursor, the next one is the first left
+        slot = (self._cursor + ticks - 1) % len(self._slots)
+        rounds = (ticks - 1) // len(self._slots)
+        if self._expiring and slot == self._cursor:
+            rounds -= 1  # the slot being expired was counted down for this revolution already
+        timer = Timer(self, slot, rounds, callback, args)
+        self._slots[slot].add(timer)
+        self._count += 1
+        return timer
+
+    def _remove(self, timer):
+        slot = self._slots[timer._slot]
+        if timer in slot:
+            slot.remove(timer)
+            self._count -= 1
+            if not self._count:
+                self._stop()
+
+    def _stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _advance(self):
+        self._handle = None
+        now = self._loop.time()
+        self._expiring = True
+        try:
+            while self._next <= now and self._count:
+                self._expire(self._slots[self._cursor])
+                self._cursor = (self._cursor + 1) % len(self._slots)
+                self._next += self._tick
+        finally:
+            self._expiring = False
+        if self._count and self._handle is None:
+            self._next = max(self._next, now)
+            self._handle = self._loop.call_at(self._next, self._advance)
+
+    def _expire(self, slot):
+        due = [timer for timer in slot if not timer._rounds]
+        for timer in slot:
+            timer._rounds -= 1
+        for timer in due:
+            slot.remove(timer)
+            self._count -= 1
+            timer._cancelled = True  # so that a late cancel doesn't touch the wheel
+            try:
+                timer._callback(*timer._args)
+            except Exception:
+                logger.exception('Error in timer callback %s', timer._callback)
+
+
+_wheels = WeakKeyDictionary()
+
+
+def get_wheel(loop=None) -> TimingWheel:
+    """
+    :return: the wheel shared by request deadlines, api timeouts and pingers on loop
+    """
+    loop = loop or asyncio.get_event_loop()
+    wheel = _wheels.get(loop)
+    if wheel is None:
+        wheel = _wheels[loop] = TimingWheel(loop=loop)
+    return wheel
+
+
+class Deadline:
+    """
+    Context manager for coroutines running in a task which cancels the task after timeout seconds and raises
+    asyncio.TimeoutError in its place, without the extra task and timer of asyncio.wait_for
+
+        with Deadline(5):
+            result = yield from handler()
+    """
+
+    def __init__(self, timeout, loop=None):
+        self._timeout = timeout
+        self._loop = loop or asyncio.get_event_loop()
+        self._task = None
+        self._timer = None
+        self._expired = False
+
+    def __enter__(self):
+        if self._timeout is not None:
+            self._task = asyncio.Task.current_task(loop=self._loop)
+            if self._task is None:
+                raise RuntimeError('Deadline must be used inside a task')
+            self._timer = get_wheel(self._loop).call_later(self._timeout, self._expire)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._expired and exc_type is asyncio.CancelledError:
+            raise asyncio.TimeoutError from None
+        if self._timer is not None:
+            self._timer.cancel()
+        return False
+
+    def _expire(self):
+        self._expired = True
+        self._task.cancel()
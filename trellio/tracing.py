@@ -0,0 +1,241 @@
+"""
+Spans of requests as they cross trellio services, linked by trace and span ids that tcp requests carry in their
+packet and http requests in their headers.
+
+Tracing is off until configure_tracing is called, or Host is given tracing settings. The span being served is
+kept per asyncio task, so that requests sent while handling a request become its children. Finished spans of
+sampled traces are buffered and handed to the sink in batches from a thread, the sink being anything with an
+export(spans) method taking a list of span dicts.
+"""
+import asyncio
+import json
+import random
+import time
+from functools import partial
+from weakref import WeakKeyDictionary
+
+from .utils.stats import Aggregator
+
+TRACE_HEADER = 'X-Trace-Id'
+SPAN_HEADER = 'X-Span-Id'
+SAMPLED_HEADER = 'X-Trace-Sampled'
+
+CLIENT = 'client'
+SERVER = 'server'
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 5
+
+_exporter = None
+_spans = WeakKeyDictionary()  # task -> span it is serving
+
+
+def _new_id(bits=64):
+    return '{:0{}x}'.format(random.getrandbits(bits), bits // 4)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'sampled', 'start', 'duration', 'timings',
+                 'error', '_started', '_marked')
+
+    def __init__(self, name, kind, trace_id=None, parent_id=None, sampled=True):
+        self.trace_id = trace_id or _new_id(128)
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start = time.time()
+        self.duration = None
+        self.timings = {}
+        self.error = None
+        self._started = self._marked = time.monotonic()
+
+    def mark(self, phase):
+        """
+        Records the milliseconds since the span started or was last marked as the time taken by phase
+        """
+        now = time.monotonic()
+        self.timings[phase] = round((now - self._marked) * 1000, 3)
+        self._marked = now
+
+    def finish(self, error=None):
+        if self.duration is None:
+            self.duration = round((time.monotonic() - self._started) * 1000, 3)
+            self.error = error
+            if self.sampled and _exporter is not None:
+                _exporter.add(self)
+
+    def context(self):
+        """
+        :return: what a request carries for the service serving it to continue the trace
+        """
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'sampled': self.sampled}
+
+    def headers(self):
+        return {TRACE_HEADER: self.trace_id, SPAN_HEADER: self.span_id, SAMPLED_HEADER: '1' if self.sampled else '0'}
+
+    def to_dict(self):
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id, 'name': self.name,
+                'kind': self.kind, 'start': self.start, 'duration': self.duration, 'timings': self.timings,
+                'error': self.error}
+
+
+class MemorySink:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+class FileSink:
+    """
+    Appends spans to a file as json lines
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def export(self, spans):
+        with open(self._path, 'a') as f:
+            f.write(''.join(json.dumps(span) + '\n' for span in spans))
+
+
+class SpanExporter:
+    def __init__(self, sink, sample_rate=1.0, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self._sink = sink
+        self._sample_rate = sample_rate
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._buffer = []
+        self._handle = None
+        self._exported = 0
+        self._dropped = 0
+
+    @property
+    def sink(self):
+        return self._sink
+
+    def sample(self):
+        return random.random() < self._sample_rate
+
+    def add(self, span):
+        self._buffer.append(span.to_dict())
+        if len(self._buffer) >= self._batch_size:
+            self._export()
+        elif self._handle is None:
+            self._handle = asyncio.get_event_loop().call_later(self._flush_interval, self._export)
+
+    def _export(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._buffer = self._buffer, []
+        if batch:
+            future = asyncio.get_event_loop().run_in_executor(None, self._sink.export, batch)
+            future.add_done_callback(partial(self._exported_batch, len(batch)))
+
+    def _exported_batch(self, size, future):
+        if future.exception() is None:
+            self._exported += size
+        else:
+            self._dropped += size
+
+    def flush(self):
+        """
+        Exports the buffered spans right away, in the calling thread
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._buffer = self._buffer, []
+        if batch:
+            self._sink.export(batch)
+            self._exported += len(batch)
+
+    def stats(self):
+        return {'buffered': len(self._buffer), 'exported': self._exported, 'dropped': self._dropped}
+
+
+def configure_tracing(sink=None, path=None, sample_rate=1.0, batch_size=DEFAULT_BATCH_SIZE,
+                      flush_interval=DEFAULT_FLUSH_INTERVAL):
+    """
+    Turns tracing on, or off when neither a sink nor a path to a FileSink is given
+
+    :param sample_rate: fraction of traces recorded, decided where a trace starts and followed by the services it
+                        goes through
+    """
+    global _exporter
+    if sink is None and path:
+        sink = FileSink(path)
+    _exporter = SpanExporter(sink, sample_rate, batch_size, flush_interval) if sink is not None else None
+    if _exporter is not None:
+        Aggregator.register_source('tracing', _exporter.stats)
+    return _exporter
+
+
+def flush_tracing():
+    if _exporter is not None:
+        _exporter.flush()
+
+
+def tracing_enabled():
+    return _exporter is not None
+
+
+def current_span():
+    """
+    :return: the span the current task is serving, None if tracing is off or there is none
+    """
+    if _exporter is None:
+        return None
+    try:
+        task = asyncio.Task.current_task()
+    except RuntimeError:  # no event loop in this thread
+        return None
+    return _spans.get(task) if task is not None else None
+
+
+def set_current_span(span, task=None):
+    """
+    Makes span the one task, the current task by default, is serving
+    """
+    task = task or asyncio.Task.current_task()
+    if task is not None:
+        _spans[task] = span
+
+
+def clear_current_span(task=None):
+    """
+    Forgets the span task, the current task by default, was serving, for tasks serving one request after another
+    """
+    task = task or asyncio.Task.current_task()
+    if task is not None:
+        _spans.pop(task, None)
+
+
+def start_span(name, kind, parent=None):
+    """
+    :param parent: a Span or the context of one received with a request, the current span for None
+    :return: a new span, None if tracing is off
+    """
+    if _exporter is None:
+        return None
+    if parent is None:
+        parent = current_span()
+    if parent is None:
+        return Span(name, kind, sampled=_exporter.sample())
+    if isinstance(parent, Span):
+        return Span(name, kind, parent.trace_id, parent.span_id, parent.sampled)
+    return Span(name, kind, parent.get('trace_id'), parent.get('span_id'), parent.get('sampled', True))
+
+
+def context_from_headers(headers):
+    """
+    :return: the span context an http request carries in its headers, None if it carries none
+    """
+    trace_id = headers.get(TRACE_HEADER)
+    if trace_id is None:
+        return None
+    return {'trace_id': trace_id, 'span_id': headers.get(SPAN_HEADER), 'sampled': headers.get(SAMPLED_HEADER) != '0'}
@@ -1,3 +1,5 @@
+import socket
+
 from ..wrappers import Response
 
 
@@ -24,6 +26,14 @@ class Singleton(object):
         return cls._instance
 
 
+def host_identity():
+    """
+    Identifies the machine a service runs on, services reporting the same identity can reach each other's unix
+    sockets
+    """
+    return socket.gethostname()
+
+
 def default_preflight_response(request):
     headers = {'Access-Control-Allow-Origin': '*',
                'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE',
@@ -0,0 +1,141 @@
+"""
+Fixed memory latency histogram in the manner of HdrHistogram: values are counted in buckets whose width doubles
+every octave, each octave split in SUB_BUCKETS / 2 equal buckets, so that percentiles are off by at most
+1 / 32 of the value whatever its magnitude, updates are O(1) and histograms merge by adding their counts.
+"""
+import sys
+from array import array
+
+PRECISION_BITS = 6
+SUB_BUCKETS = 1 << PRECISION_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+MAX_BITS = 40  # values up to 2 ** 40 units, over 30 years in milliseconds, larger ones go to the last bucket
+BUCKETS = (MAX_BITS - PRECISION_BITS + 1) * HALF_SUB_BUCKETS + HALF_SUB_BUCKETS
+MAX_UNITS = (1 << MAX_BITS) - 1
+
+PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9))
+
+
+def bucket_index(units):
+    """
+    :return: the bucket counting a value of units, at most MAX_UNITS
+    """
+    if units < SUB_BUCKETS:
+        return units
+    shift = units.bit_length() - PRECISION_BITS
+    return shift * HALF_SUB_BUCKETS + (units >> shift)
+
+
+def _upper_bound(index):
+    """
+    :return: the highest value in units counted in bucket index
+    """
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // HALF_SUB_BUCKETS - 1
+    return ((index - shift * HALF_SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    __slots__ = ('_resolution', '_counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, resolution=1):
+        """
+        :param resolution: the smallest difference between values told apart, values are counted in its units
+        """
+        self._resolution = resolution
+        self._counts = array('Q', bytes(8 * BUCKETS))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def update(self, value):
+        units = int(value / self._resolution) if value > 0 else 0
+        self._counts[bucket_index(units if units <= MAX_UNITS else MAX_UNITS)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @classmethod
+    def from_buckets(cls, buckets, total, min_value, max_value, resolution=1, count=None):
+        """
+        :param buckets: bucket counts, a memoryview of 8 byte words is copied without reading them one by one
+        :param count: the sum of the bucket counts when known
+        :return: a histogram with the bucket counts of another one, kept elsewhere like in shared memory
+        """
+        histogram = cls(resolution)
+        histogram._counts = array('Q', buckets.tobytes() if isinstance(buckets, memoryview) else buckets)
+        histogram.count = sum(histogram._counts) if count is None else count
+        histogram.total = total
+        if histogram.count:
+            histogram.min, histogram.max = min_value, max_value
+        return histogram
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """
+        :return: the value percent of the counted values are at most, within the precision of its bucket
+        """
+        if not self.count:
+            return 0
+        rank = max(int(self.count * percent / 100 + 0.5), 1)
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(max(_upper_bound(index) * self._resolution, self.min), self.max)
+        return self.max
+
+    def cumulative_counts(self, bounds):
+        """
+        :param bounds: ascending values
+        :return: for every bound the count of values at most that bound, within the precision of its bucket
+        """
+        counts = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            last = bucket_index(min(max(int(bound / self._resolution), 0), MAX_UNITS))
+            while index <= last:
+                seen += self._counts[index]
+                index += 1
+            counts.append(seen)
+        return counts
+
+    def merge(self, other):
+        """
+        Adds the values counted by other, a histogram of the same resolution
+        """
+        if other._resolution != self._resolution:
+            raise ValueError('histograms of different resolutions cannot be merged')
+        # the buckets are added as the 64 bit digits of two big ints, which takes one addition instead of a python
+        # loop over every bucket, no bucket comes near 2 ** 64 to carry into the next one
+        counts = (int.from_bytes(self._counts.tobytes(), sys.byteorder) +
+                  int.from_bytes(other._counts.tobytes(), sys.byteorder))
+        self._counts = array('Q', counts.to_bytes(8 * BUCKETS, sys.byteorder))
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def snapshot(self):
+        """
+        :return: a copy that keeps the values counted so far
+        """
+        return Histogram(self._resolution).merge(self)
+
+    def to_dict(self):
+        d = {'min': self.min or 0, 'max': self.max or 0}
+        for name, percent in PERCENTILES:
+            d[name] = self.percentile(percent)
+        return d
@@ -0,0 +1,157 @@
+"""
+Aggregator stats shared by the workers Host forks, so that any of them reports the numbers of the whole host.
+
+The supervisor maps an anonymous shared memory segment before forking, with a slot per worker. A worker only
+writes to its own slot, so updates take no locks, and readers merge the slots of every worker. A slot holds up
+to a fixed number of series, one per server type, endpoint and status, each with its request counts and its
+latency histogram buckets laid out as 8 byte words. A series is published by writing the first byte of its key
+last, so readers never see a key being written.
+"""
+import json
+import logging
+import mmap
+
+from .histogram import BUCKETS, MAX_UNITS, Histogram, bucket_index
+from .stats import StatUnit
+
+DEFAULT_SERIES = 512  # series a worker can record, further ones are only kept in the worker's own stats
+
+KEY_WORDS = 16  # json of [server_type, endpoint, status], zero padded
+COUNT, SUCCESS, TOTAL, MIN, MAX = range(KEY_WORDS, KEY_WORDS + 5)
+FIRST_BUCKET = KEY_WORDS + 5
+SERIES_WORDS = FIRST_BUCKET + BUCKETS
+WORD = 8
+
+_logger = logging.getLogger(__name__)
+
+
+def _add(unit, other):
+    """
+    Adds the counts of other to unit, leaving their sub units alone
+    """
+    unit.histogram.merge(other.histogram)
+    unit.count += other.count
+    unit.success_count += other.success_count
+
+
+class SharedStats:
+    def __init__(self, workers, series=DEFAULT_SERIES):
+        self._workers = workers
+        self._series = series
+        self._mmap = mmap.mmap(-1, workers * series * SERIES_WORDS * WORD)  # shared with forked processes
+        self._words = memoryview(self._mmap).cast('Q')
+        self._floats = memoryview(self._mmap).cast('d')
+        self._slot = None
+        self._offsets = {}  # key -> word offset of its series in this worker's slot, None for dropped keys
+        self._used = 0  # series written to this worker's slot
+        self._dropped = 0
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def attach(self, worker):
+        """
+        Makes the calling process write to the slot of worker, keeping what an earlier process of the same
+        worker recorded
+        """
+        self._slot = worker
+        self._offsets = {}
+        self._used = 0
+        for offset in self._slot_offsets(worker):
+            key = self._read_key(offset)
+            if key is None:
+                break
+            self._offsets[key] = offset
+            self._used += 1
+
+    def _slot_offsets(self, worker):
+        first = worker * self._series * SERIES_WORDS
+        return range(first, first + self._series * SERIES_WORDS, SERIES_WORDS)
+
+    def _read_key(self, offset):
+        raw = self._mmap[offset * WORD:(offset + KEY_WORDS) * WORD].rstrip(b'\0')
+        if not raw or not raw[0]:
+            return None
+        try:
+            return tuple(json.loads(raw.decode()))
+        except ValueError:  # left half written by a worker that died writing it
+            return None
+
+    def _add_series(self, key):
+        encoded = json.dumps(key).encode()
+        if len(encoded) > KEY_WORDS * WORD or self._used == self._series:
+            self._dropped += 1
+            self._offsets[key] = None
+            _logger.warning('Stats of %s are not shared with other workers', key)
+            return None
+        offset = (self._slot * self._series + self._used) * SERIES_WORDS
+        start = offset * WORD
+        self._mmap[start + 1:start + len(encoded)] = encoded[1:]
+        self._mmap[start:start + 1] = encoded[:1]
+        self._offsets[key] = offset
+        self._used += 1
+        return offset
+
+    def update(self, server_type, endpoint, status, time_taken, success):
+        if self._slot is None:
+            return
+        key = (server_type, endpoint, status)
+        offset = self._offsets.get(key, -1)
+        if offset == -1:
+            offset = self._add_series(key)
+        if offset is None:
+            return
+        words, floats = self._words, self._floats
+        words[offset + COUNT] += 1
+        if success:
+            words[offset + SUCCESS] += 1
+        floats[offset + TOTAL] += time_taken
+        if words[offset + COUNT] == 1 or time_taken < floats[offset + MIN]:
+            floats[offset + MIN] = time_taken
+        if time_taken > floats[offset + MAX]:
+            floats[offset + MAX] = time_taken
+        units = int(time_taken) if time_taken > 0 else 0
+        words[offset + FIRST_BUCKET + bucket_index(units if units <= MAX_UNITS else MAX_UNITS)] += 1
+
+    def stat_tree(self):
+        """
+        :return: a StatUnit tree like Aggregator keeps, of the requests served by all workers. The series of the
+                 workers are merged into one per key first and every unit then only adds up its own sub units,
+                 rather than every series being added to each unit above it.
+        """
+        leaves = {}
+        for worker in range(self._workers):
+            for offset in self._slot_offsets(worker):
+                key = self._read_key(offset)
+                if key is None:
+                    break
+                leaf = StatUnit(key=key[2])
+                leaf.count = self._words[offset + COUNT]
+                leaf.success_count = self._words[offset + SUCCESS]
+                leaf.histogram = Histogram.from_buckets(
+                    self._words[offset + FIRST_BUCKET:offset + SERIES_WORDS], self._floats[offset + TOTAL],
+                    self._floats[offset + MIN], self._floats[offset + MAX], count=leaf.count)
+                if key in leaves:
+                    _add(leaves[key], leaf)
+                else:
+                    leaves[key] = leaf
+        total = StatUnit(key='total')
+        for (server_type, endpoint, status), leaf in leaves.items():
+            if server_type not in total.sub:
+                total.sub[server_type] = StatUnit(key=server_type)
+            typed = total.sub[server_type]
+            if endpoint not in typed.sub:
+                typed.sub[endpoint] = StatUnit(key=endpoint)
+            typed.sub[endpoint].sub[status] = leaf
+        for typed in total.sub.values():
+            for unit in typed.sub.values():
+                for leaf in unit.sub.values():
+                    _add(unit, leaf)
+                _add(typed, unit)
+            _add(total, typed)
+        return total
+
+    def stats(self):
+        return {'workers': self._workers, 'series': self._used, 'max_series': self._series,
+                'dropped': self._dropped}
@@ -1,10 +1,12 @@
 import asyncio
 import logging
 import socket
-from collections import defaultdict, deque
+from collections import defaultdict, OrderedDict
 
 import setproctitle
 
+from .histogram import Histogram
+
 
 class Stats:
     name = None
@@ -34,40 +36,91 @@ class Stats:
 
 
 class StatUnit:
-    MAXSIZE = 10
-
     def __init__(self, key=None):
         self.key = key
-        self.average = 0
-        self.values = deque()
+        self.histogram = Histogram()
         self.count = 0
         self.success_count = 0
         self.sub = dict()
 
-    def update(self, val, success):
-        self.values.append(val)
-        if len(self.values) > self.MAXSIZE:
-            self.values.popleft()
+    @property
+    def average(self):
+        return self.histogram.mean
 
-        self.average = sum(self.values) / len(self.values)
+    def update(self, val, success):
+        self.histogram.update(val)
         self.count += 1
         if success:
             self.success_count += 1
 
-    def to_dict(self):
+    def merge(self, other):
+        """
+        Adds the counts of other, a StatUnit of another process or period, including those of its sub units
+        """
+        self.histogram.merge(other.histogram)
+        self.count += other.count
+        self.success_count += other.success_count
+        for key, unit in other.sub.items():
+            if key not in self.sub:
+                self.sub[key] = StatUnit(key=key)
+            self.sub[key].merge(unit)
+        return self
+
+    def snapshot(self):
+        return StatUnit(key=self.key).merge(self)
 
+    def to_dict(self):
         d = dict({'count': self.count, 'average': self.average, 'success_count': self.success_count, 'sub': dict()})
+        d.update(self.histogram.to_dict())
         for k, v in self.sub.items():
             d['sub'][k] = v.to_dict()
         return d
 
     def __str__(self):
-        return "{} {} {} {}".format(self.key, self.sum, self.average, self.count)
+        return "{} {} {} {}".format(self.key, self.count, self.average, self.histogram.to_dict())
 
 
 class Aggregator:
     _stats = StatUnit(key='total')
     _service_name = None
+    _sources = OrderedDict()
+    _shared = None
+
+    @classmethod
+    def register_source(cls, name, source):
+        """
+        Adds stats kept outside the aggregator, like connection pools or queues, to dumps and periodic logs
+        :param source: callable returning a json serializable dict, called only when stats are read
+        """
+        cls._sources[name] = source
+
+    @classmethod
+    def share(cls, shared_stats):
+        """
+        Records stats in shared_stats as well, a SharedStats of the workers of this host, and reads them from it
+        """
+        cls._shared = shared_stats
+        cls.register_source('shared_stats', shared_stats.stats)
+
+    @classmethod
+    def stat_tree(cls):
+        """
+        :return: the StatUnit tree of requests served by this host, this process when it is the only worker
+        """
+        return cls._shared.stat_tree() if cls._shared is not None else cls._stats
+
+    @classmethod
+    def dump_sources(cls):
+        """
+        :return: stats of every source by name, leaving out sources that fail
+        """
+        stats = {}
+        for name, source in list(cls._sources.items()):
+            try:
+                stats[name] = source()
+            except Exception:
+                logging.getLogger(__name__).exception('Stats source %s failed', name)
+        return stats
 
     @classmethod
     def recursive_update(cls, d, new_val, keys, success):
@@ -91,10 +144,14 @@ class Aggregator:
 
         cls._stats.update(val=time_taken, success=success)
         cls.recursive_update(cls._stats.sub, time_taken, keys=[status, endpoint, server_type], success=success)
+        if cls._shared is not None:
+            cls._shared.update(server_type, endpoint, status, time_taken, success)
 
     @classmethod
     def dump_stats(cls):
-        return cls._stats.to_dict()
+        d = cls.stat_tree().to_dict()
+        d.update(cls.dump_sources())
+        return d
 
     @classmethod
     def periodic_aggregated_stats_logger(cls):
@@ -114,6 +171,12 @@ class Aggregator:
                     'hostname': hostname,
                     'service_name': cls._service_name,
                     'average_response_time': v['average'],
+                    'min_response_time': v['min'],
+                    'max_response_time': v['max'],
+                    'p50_response_time': v['p50'],
+                    'p90_response_time': v['p90'],
+                    'p99_response_time': v['p99'],
+                    'p999_response_time': v['p999'],
                     'total_request_count': v['count'],
                     'success_count': v['success_count']
                 })
@@ -121,6 +184,9 @@ class Aggregator:
                     d['CODE_{}'.format(k2)] = v2['count']
                 logs.append(d)
 
+        for name, stats in cls.dump_sources().items():
+            logs.append({'source': name, 'hostname': hostname, 'service_name': cls._service_name, 'stats': stats})
+
         _logger = logging.getLogger('stats')
         for logd in logs:
             _logger.info(dict(logd))
@@ -2,11 +2,12 @@ __all__ = ['HTTPView', 'TCPView']
 
 from again.utils import unique_hex
 
+from .middleware import MiddlewareHost
 from .utils.helpers import default_preflight_response
 from .utils.ordered_class_member import OrderedClassMembers
 
 
-class BaseView:
+class BaseView(MiddlewareHost):
     '''base class for views'''
     _host = None
 
@@ -21,7 +22,6 @@ class BaseView:
 
 class BaseHTTPView(BaseView, metaclass=OrderedClassMembers):
     '''base class for HTTP views'''
-    middlewares = []
 
     def __init__(self):
         super(BaseHTTPView, self).__init__()